@@ -0,0 +1,153 @@
+"""
+Сравнение проверки файла по заголовкам (utils/image_header) с проверкой Pillow
+
+Генерирует несжатые TIFF (RGB, полосы по 64 строки) и PNG заданных размеров и
+измеряет read_image_header и прежнюю проверку Image.open() + verify(). Данные
+изображения записываются разреженно (нули без записи на диск), поэтому файлы
+в 2000 МБ создаются мгновенно и не занимают места, а Pillow читает их из кэша
+страниц - на реальном диске verify() для PNG будет только медленнее.
+
+Запуск:
+    python -m benchmarks.bench_image_header
+    python -m benchmarks.bench_image_header --sizes 10 100 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import struct
+import tempfile
+import time
+import zlib
+from typing import Callable, List
+from PIL import Image
+from utils.image_header import read_image_header
+
+MB = 1024 * 1024
+WIDTH = 8192
+ROWS_PER_STRIP = 64
+# Размер блока IDAT в PNG (как у многих кодировщиков, файл делится на блоки)
+PNG_CHUNK_SIZE = 64 * MB
+
+
+def write_tiff(path: str, size: int) -> None:
+    """Несжатый RGB TIFF размером около size байт: заголовок, IFD, таблицы полос, данные"""
+    row_bytes = WIDTH * 3
+    height = max(1, size // row_bytes)
+    strips = (height + ROWS_PER_STRIP - 1) // ROWS_PER_STRIP
+    counts = [min(ROWS_PER_STRIP, height - i * ROWS_PER_STRIP) * row_bytes for i in range(strips)]
+    entries = 11
+    ifd_offset = 8
+    ifd_size = 2 + entries * 12 + 4
+    bits_offset = ifd_offset + ifd_size
+    offsets_table = bits_offset + 6
+    counts_table = offsets_table + 4 * strips
+    data_offset = counts_table + 4 * strips
+    offsets = []
+    position = data_offset
+    for count in counts:
+        offsets.append(position)
+        position += count
+
+    def entry(tag: int, field_type: int, count: int, value: int) -> bytes:
+        if field_type == 3 and count == 1:
+            return struct.pack('<HHIHH', tag, field_type, count, value, 0)
+        return struct.pack('<HHII', tag, field_type, count, value)
+
+    ifd = struct.pack('<H', entries) + b''.join([
+        entry(256, 4, 1, WIDTH),                 # ImageWidth
+        entry(257, 4, 1, height),                # ImageLength
+        entry(258, 3, 3, bits_offset),           # BitsPerSample
+        entry(259, 3, 1, 1),                     # Compression: нет
+        entry(262, 3, 1, 2),                     # Photometric: RGB
+        entry(273, 4, strips, offsets_table),    # StripOffsets
+        entry(277, 3, 1, 3),                     # SamplesPerPixel
+        entry(278, 4, 1, ROWS_PER_STRIP),        # RowsPerStrip
+        entry(279, 4, strips, counts_table),     # StripByteCounts
+        entry(284, 3, 1, 1),                     # PlanarConfig: chunky
+        entry(339, 3, 1, 1),                     # SampleFormat: uint
+    ]) + struct.pack('<I', 0)
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_offset))
+        f.write(ifd)
+        f.write(struct.pack('<HHH', 8, 8, 8))
+        f.write(struct.pack(f'<{strips}I', *offsets))
+        f.write(struct.pack(f'<{strips}I', *counts))
+        f.truncate(position)
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def write_png(path: str, size: int) -> None:
+    """PNG размером около size байт: IHDR, блоки IDAT из нулей с верными CRC, IEND"""
+    height = max(1, size // (WIDTH * 3))
+    chunk_count = max(1, size // PNG_CHUNK_SIZE)
+    chunk_size = size // chunk_count
+    # CRC блока из нулей одинаков для всех блоков одного размера
+    crc = zlib.crc32(b'IDAT')
+    zeros = bytes(MB)
+    for _ in range(chunk_size // MB):
+        crc = zlib.crc32(zeros, crc)
+    crc = zlib.crc32(bytes(chunk_size % MB), crc)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', WIDTH, height, 8, 2, 0, 0, 0)))
+        for _ in range(chunk_count):
+            f.write(struct.pack('>I', chunk_size) + b'IDAT')
+            f.seek(chunk_size, os.SEEK_CUR)
+            f.write(struct.pack('>I', crc))
+        f.write(_png_chunk(b'IEND', b''))
+
+
+def check_header(path: str) -> None:
+    read_image_header(path)
+
+
+def check_pillow(path: str) -> None:
+    with Image.open(path) as image:
+        image.verify()
+
+
+def measure(check: Callable[[str], None], path: str, repeat: int) -> List[float]:
+    check(path)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        check(path)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _format(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.0f} мкс"
+    return f"{seconds * 1e3:8.1f} мс "
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Проверка заголовков против Pillow verify()")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 2000],
+                        help="размеры файлов в МБ")
+    parser.add_argument('--repeat', type=int, default=10, help="число замеров на файл")
+    parser.add_argument('--dir', default=None, help="каталог для временных файлов")
+    args = parser.parse_args()
+
+    # Прежняя проверка отклоняла снимки больше ~179 млн пикселей как «бомбу декомпрессии»;
+    # для замера времени проверка отключена
+    Image.MAX_IMAGE_PIXELS = None
+    print(f"{'файл':<14}{'заголовки p50':>16}{'Pillow p50':>16}{'разница':>10}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size_mb in args.sizes:
+            for file_format, writer in (('TIFF', write_tiff), ('PNG', write_png)):
+                path = os.path.join(directory, f"bench.{file_format.lower()}")
+                writer(path, size_mb * MB)
+                header = statistics.median(measure(check_header, path, args.repeat))
+                pillow = statistics.median(measure(check_pillow, path, args.repeat))
+                print(f"{file_format + ' ' + str(size_mb) + ' МБ':<14}{_format(header):>16}"
+                      f"{_format(pillow):>16}{pillow / header:>9.0f}x")
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
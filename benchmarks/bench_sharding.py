@@ -0,0 +1,150 @@
+"""
+Пересылка обновлений рабочим процессам по user_id (services/sharding.py)
+
+Фронт получает обновления long polling от локальной замены Bot API
+(benchmarks/fake_bot_api.py) и через UpdateForwarder пересылает их рабочим
+процессам, которые запускает WorkerPool - этот же скрипт с BOT_SHARD=i.
+Обработчик рабочего процесса тратит --cpu-ms миллисекунд процессора (как
+проверка файла) и записывает пользователя и номер его сообщения. Замер
+показывает пропускную способность, распределение по процессам и то, что
+сообщения каждого пользователя обработаны по порядку.
+
+Запуск:
+    python -m benchmarks.bench_sharding
+    python -m benchmarks.bench_sharding --workers 1 2 4 --cpu-ms 5
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, ContextTypes, MessageHandler, TypeHandler, filters
+from benchmarks.fake_bot_api import BOT_TOKEN, FakeBotApi
+from config import BOT_SHARD, SHARD_HOST, SHARD_BASE_PORT
+from main import ALLOWED_UPDATES
+from services.sharding import UpdateForwarder, WorkerPool, run_worker
+from utils.update_processor import PerUserUpdateProcessor
+
+BOT_API_PORT = 18100
+WORKER_BASE_PORT = 18200
+CONCURRENCY = 32
+
+
+def _builder(api_url: str) -> ApplicationBuilder:
+    return (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(api_url)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENCY))
+    )
+
+
+async def run_shard() -> None:
+    """Рабочий процесс: обработчик с заданной нагрузкой на процессор"""
+    cpu_seconds = float(os.environ['BENCH_CPU_MS']) / 1000
+    output = open(os.path.join(os.environ['BENCH_OUTPUT_DIR'], f"shard{BOT_SHARD}.jsonl"), 'w', buffering=1)
+
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        deadline = time.process_time() + cpu_seconds
+        while time.process_time() < deadline:
+            hashlib.sha256(b'x' * 4096).digest()
+        output.write(json.dumps([update.effective_user.id, int(update.message.text)]) + "\n")
+
+    application = _builder(os.environ['BENCH_BOT_API_URL']).updater(None).build()
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+    try:
+        await run_worker(application, SHARD_HOST, SHARD_BASE_PORT + BOT_SHARD)
+    finally:
+        output.close()
+
+
+def _check_results(output_dir: str) -> Tuple[List[int], bool]:
+    """Число обновлений по процессам и соблюден ли порядок сообщений каждого пользователя"""
+    per_worker = []
+    in_order = True
+    for path in sorted(glob.glob(os.path.join(output_dir, 'shard*.jsonl'))):
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        per_worker.append(len(rows))
+        last: Dict[int, int] = {}
+        for user_id, number in rows:
+            if number != last.get(user_id, 0) + 1:
+                in_order = False
+            last[user_id] = number
+    return per_worker, in_order
+
+
+def _processed(output_dir: str) -> int:
+    total = 0
+    for path in glob.glob(os.path.join(output_dir, 'shard*.jsonl')):
+        with open(path) as f:
+            total += sum(1 for _ in f)
+    return total
+
+
+async def run_front(workers: int, count: int, users: int, cpu_ms: float) -> None:
+    api = FakeBotApi(port=BOT_API_PORT)
+    await api.start()
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.environ.update(
+            BENCH_CPU_MS=str(cpu_ms),
+            BENCH_OUTPUT_DIR=output_dir,
+            BENCH_BOT_API_URL=api.base_url
+        )
+        pool = WorkerPool(workers, '127.0.0.1', WORKER_BASE_PORT)
+        await pool.start()
+        forwarder = UpdateForwarder(pool.urls)
+        await forwarder.start()
+        front = _builder(api.base_url).build()
+        front.add_handler(TypeHandler(Update, forwarder.forward))
+        await front.initialize()
+        await front.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=ALLOWED_UPDATES)
+        await front.start()
+        try:
+            numbers: Dict[int, int] = {}
+            started = time.perf_counter()
+            for i in range(count):
+                user_id = 1000 + i % users
+                numbers[user_id] = numbers.get(user_id, 0) + 1
+                api.push(api.make_update(user_id, str(numbers[user_id])))
+            while _processed(output_dir) < count:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            per_worker, in_order = _check_results(output_dir)
+        finally:
+            await front.updater.stop()
+            await front.stop()
+            await front.shutdown()
+            await forwarder.stop()
+            await pool.stop()
+            await api.stop()
+    print(
+        f"процессов: {workers}: {count / elapsed:6.0f} обн/с, по процессам {per_worker}, "
+        f"порядок по пользователю {'соблюден' if in_order else 'НАРУШЕН'}, пересылка: {forwarder.stats()}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Пересылка обновлений рабочим процессам")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--cpu-ms', type=float, default=5, help="процессорное время на обновление, мс")
+    args = parser.parse_args()
+    # Рабочие процессы запускаются как python benchmarks/bench_sharding.py и импортируют пакеты проекта
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [project_dir, os.environ.get('PYTHONPATH')]))
+    for workers in args.workers:
+        await run_front(workers, args.count, args.users, args.cpu_ms)
+
+
+if __name__ == '__main__':
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    asyncio.run(run_shard() if BOT_SHARD is not None else main())
@@ -0,0 +1,130 @@
+"""
+Прием обновлений: long polling против webhook
+
+Бот на python-telegram-bot с PerUserUpdateProcessor получает текстовые
+сообщения от локальной замены Bot API (benchmarks/fake_bot_api.py): в режиме
+polling - через getUpdates, в режиме webhook - POST на встроенный сервер
+(один запрос на обновление, до --connections одновременно, как у Telegram).
+Замеряются пропускная способность и задержка от отправки обновления до
+вызова обработчика - при постоянной нагрузке и при всплеске.
+
+Запуск:
+    python -m benchmarks.bench_updates
+    python -m benchmarks.bench_updates --steady-count 1000 --burst-count 5000
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import List
+from aiohttp import ClientSession, TCPConnector
+from telegram import Update
+from telegram.ext import Application, ContextTypes, MessageHandler, filters
+from benchmarks.fake_bot_api import BOT_TOKEN, FakeBotApi
+from main import ALLOWED_UPDATES
+from utils.update_processor import PerUserUpdateProcessor
+
+WEBHOOK_PORT = 18101
+WEBHOOK_SECRET = 'benchmark-secret'
+
+
+async def run(mode: str, count: int, rate: float, users: int, concurrency: int, connections: int) -> None:
+    """Отправляет count обновлений от users пользователей (rate в секунду, 0 - сразу все)"""
+    api = FakeBotApi()
+    await api.start()
+    latencies: List[float] = []
+    done = asyncio.Event()
+
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        latencies.append(time.perf_counter() - float(update.message.text))
+        if len(latencies) >= count:
+            done.set()
+
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(api.base_url)
+        .concurrent_updates(PerUserUpdateProcessor(concurrency))
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+    await application.initialize()
+    if mode == 'polling':
+        await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=ALLOWED_UPDATES)
+    else:
+        await application.updater.start_webhook(
+            listen='127.0.0.1',
+            port=WEBHOOK_PORT,
+            url_path='telegram',
+            webhook_url=f"http://127.0.0.1:{WEBHOOK_PORT}/telegram",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    await application.start()
+
+    session = ClientSession(connector=TCPConnector(limit=connections))
+    rejected = None
+    pending = set()
+
+    async def post(update: dict) -> None:
+        url, secret = api.webhook
+        async with session.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"webhook ответил {response.status}")
+
+    try:
+        if mode == 'webhook':
+            # Запрос без секретного токена должен быть отклонен
+            async with session.post(api.webhook[0], json=api.make_update(1, '0')) as response:
+                rejected = response.status
+        started = time.perf_counter()
+        for i in range(count):
+            update = api.make_update(1000 + i % users, repr(time.perf_counter()))
+            if mode == 'polling':
+                api.push(update)
+            else:
+                task = asyncio.create_task(post(update))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if rate:
+                await asyncio.sleep(1 / rate)
+            elif i % 100 == 0:
+                await asyncio.sleep(0)
+        await asyncio.wait_for(done.wait(), 120)
+        elapsed = time.perf_counter() - started
+    finally:
+        await session.close()
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    extra = f"getUpdates={api.get_updates_calls}" if mode == 'polling' else f"без секрета: {rejected}"
+    print(
+        f"{mode:<8} {count:>5} обн. {('%.0f/с' % rate) if rate else 'всплеск':>8}: "
+        f"{count / elapsed:6.0f} обн/с, p50 {p50:5.1f} мс, p99 {p99:6.1f} мс, {extra}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Прием обновлений: polling против webhook")
+    parser.add_argument('--steady-count', type=int, default=500)
+    parser.add_argument('--steady-rate', type=float, default=100, help="обновлений в секунду")
+    parser.add_argument('--burst-count', type=int, default=3000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=32, help="одновременных обработчиков")
+    parser.add_argument('--connections', type=int, default=40, help="соединений webhook")
+    args = parser.parse_args()
+    # Запросы к Bot API и жизненный цикл приложения в логе не нужны
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    for mode in ('polling', 'webhook'):
+        await run(mode, args.steady_count, args.steady_rate, args.users, args.concurrency, args.connections)
+        await run(mode, args.burst_count, 0, args.users, args.concurrency, args.connections)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Локальная замена Telegram Bot API для замеров приема обновлений
+
+Отвечает на getMe, setWebhook/deleteWebhook и long polling getUpdates из
+очереди обновлений, которую наполняет замер; остальные методы отвечают ok.
+Обновления - текстовые сообщения в личных чатах.
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from aiohttp import web
+
+BOT_TOKEN = '123:benchmark'
+# Пакет обновлений в ответе getUpdates (как у Telegram)
+UPDATES_LIMIT = 100
+
+
+class FakeBotApi:
+    """Сервер Bot API: POST /bot{token}/{method}"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 18100):
+        self.host = host
+        self.port = port
+        self.queue: List[Dict[str, Any]] = []
+        self.webhook: Optional[Tuple[str, Optional[str]]] = None
+        self.get_updates_calls = 0
+        self._update_id = 0
+        self._arrived = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def make_update(self, user_id: int, text: str) -> Dict[str, Any]:
+        """Новое обновление: сообщение text от пользователя user_id"""
+        self._update_id += 1
+        user = {'id': user_id, 'is_bot': False, 'first_name': 'user'}
+        return {
+            'update_id': self._update_id,
+            'message': {
+                'message_id': self._update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': user,
+                'text': text
+            }
+        }
+
+    def push(self, update: Dict[str, Any]) -> None:
+        """Ставит обновление в очередь getUpdates"""
+        self.queue.append(update)
+        self._arrived.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data: Dict[str, Any] = {}
+        if request.can_read_body:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = dict(await request.post())
+        if method == 'getMe':
+            result: Any = {'id': 123, 'is_bot': True, 'first_name': 'bot', 'username': 'benchmark_bot'}
+        elif method == 'setWebhook':
+            self.webhook = (data.get('url'), data.get('secret_token'))
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook = None
+            result = True
+        elif method == 'getUpdates':
+            result = await self._get_updates(int(data.get('offset') or 0), float(data.get('timeout') or 0))
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        self.get_updates_calls += 1
+        # Обновления до offset подтверждены ботом
+        self.queue = [update for update in self.queue if update['update_id'] >= offset]
+        if not self.queue and timeout:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.queue[:UPDATES_LIMIT]
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
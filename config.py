@@ -1,7 +1,9 @@
 """
 Конфигурация бота
 """
+import hashlib
 import os
+import socket
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из token.env или .env
@@ -17,9 +19,218 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 # Пример: 'http://localhost:8081' (по умолчанию порт 8081)
 LOCAL_BOT_API_URL = os.getenv('LOCAL_BOT_API_URL', '')
 
+# Локальный сервер Bot API запущен с --local и отдает файлы как пути на диске
+# (сервер и бот должны видеть одну файловую систему, поэтому по умолчанию выключено)
+LOCAL_BOT_API_LOCAL_MODE = os.getenv('LOCAL_BOT_API_LOCAL_MODE', 'false').lower() in ('1', 'true', 'yes')
+# Как переносить файлы локального сервера в рабочий каталог:
+# 'link' - жесткая ссылка или reflink (файл сервера остается на месте), 'move' - перемещение
+LOCAL_FILE_INGEST = os.getenv('LOCAL_FILE_INGEST', 'link').lower()
+
+# Максимальное число обновлений, обрабатываемых одновременно
+# Обновления разных пользователей идут параллельно, одного пользователя - по очереди
+# Значение 1 отключает параллельную обработку
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+
+# Получение обновлений: 'polling' (long polling, по умолчанию) или 'webhook'
+# В режиме webhook бот слушает WEBHOOK_LISTEN:WEBHOOK_PORT по пути WEBHOOK_PATH, а Telegram
+# присылает обновления на WEBHOOK_URL - полный внешний адрес (обычно обратный прокси), например
+# https://bot.example.com/telegram - с заголовком X-Telegram-Bot-Api-Secret-Token = WEBHOOK_SECRET.
+# Несколько реплик за одним прокси запускаются с одинаковыми WEBHOOK_URL и WEBHOOK_SECRET
+BOT_UPDATE_MODE = os.getenv('BOT_UPDATE_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# По умолчанию секрет выводится из токена бота, поэтому одинаков у всех реплик
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(f'webhook:{BOT_TOKEN}'.encode()).hexdigest()
+# Сколько соединений Telegram одновременно открывает к WEBHOOK_URL (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Несколько рабочих процессов: при BOT_WORKERS > 1 процесс-фронт получает обновления и
+# пересылает каждое рабочему процессу его пользователя (номер - user_id % BOT_WORKERS).
+# Фронт сам запускает процессы на SHARD_HOST:SHARD_BASE_PORT+i; если задан список адресов
+# SHARD_WORKER_URLS, процессы запускаются отдельно (BOT_SHARD=i BOT_WORKERS=N python main.py)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+# Номер рабочего процесса; задается фронтом, без него процесс работает сам по себе
+BOT_SHARD = int(os.getenv('BOT_SHARD')) if os.getenv('BOT_SHARD') else None
+SHARD_HOST = os.getenv('SHARD_HOST', '127.0.0.1')
+SHARD_BASE_PORT = int(os.getenv('SHARD_BASE_PORT', '8100'))
+SHARD_WORKER_URLS = [url.strip().rstrip('/') for url in os.getenv('SHARD_WORKER_URLS', '').split(',') if url.strip()]
+# Токен фронта в заголовке X-Shard-Token (по умолчанию выводится из токена бота)
+SHARD_TOKEN = os.getenv('SHARD_TOKEN') or hashlib.sha256(f'shard:{BOT_TOKEN}'.encode()).hexdigest()[:32]
+# Попыток переслать обновление процессу, прежде чем отдать его следующему
+SHARD_FORWARD_RETRIES = int(os.getenv('SHARD_FORWARD_RETRIES', '3'))
+# Как часто фронт проверяет, что запущенные им процессы живы (в секундах)
+SHARD_MONITOR_INTERVAL = float(os.getenv('SHARD_MONITOR_INTERVAL', '5'))
+
 # URL сервера алгоритмов
 ALGORITHM_SERVER_URL = os.getenv('ALGORITHM_SERVER_URL', 'http://localhost:8000')
 
+# Режим симуляции сервера алгоритмов (прототип без реального сервера)
+# Для работы с реальным сервером или stub_server.py установите SIMULATE_ALGORITHM_SERVER=false
+SIMULATE_ALGORITHM_SERVER = os.getenv('SIMULATE_ALGORITHM_SERVER', 'true').lower() in ('1', 'true', 'yes')
+
+# Пул соединений с сервером алгоритмов (один клиент на всё приложение)
+# Общий лимит соединений и лимит на один хост
+SERVER_POOL_LIMIT = int(os.getenv('SERVER_POOL_LIMIT', '100'))
+SERVER_POOL_LIMIT_PER_HOST = int(os.getenv('SERVER_POOL_LIMIT_PER_HOST', '20'))
+# Время кэширования DNS-записей и время жизни простаивающего keep-alive соединения (в секундах)
+SERVER_DNS_CACHE_TTL = int(os.getenv('SERVER_DNS_CACHE_TTL', '300'))
+SERVER_KEEPALIVE_TIMEOUT = float(os.getenv('SERVER_KEEPALIVE_TIMEOUT', '30'))
+# Максимум задач в одном пакетном запросе статусов (POST /api/tasks/status)
+SERVER_BULK_STATUS_MAX = int(os.getenv('SERVER_BULK_STATUS_MAX', '500'))
+# Число одновременных одиночных запросов статуса, если пакетный запрос не поддерживается
+SERVER_STATUS_CONCURRENCY = int(os.getenv('SERVER_STATUS_CONCURRENCY', '10'))
+
+# Уведомления сервера алгоритмов о завершении задач (вместо частого опроса статусов)
+# Бот слушает CALLBACK_HOST:CALLBACK_PORT и при запуске задачи передает серверу CALLBACK_URL -
+# адрес, по которому сервер достучится до бота (путь - /api/callback), - и CALLBACK_TOKEN,
+# который сервер возвращает в заголовке X-Callback-Token
+CALLBACK_ENABLED = os.getenv('CALLBACK_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CALLBACK_HOST = os.getenv('CALLBACK_HOST', '0.0.0.0')
+CALLBACK_PORT = int(os.getenv('CALLBACK_PORT', '8090'))
+# {port} в CALLBACK_URL заменяется на CALLBACK_PORT: рабочие процессы (BOT_WORKERS > 1)
+# слушают разные порты, и каждый должен передавать серверу свой адрес
+CALLBACK_URL_TEMPLATE = os.getenv('CALLBACK_URL', 'http://127.0.0.1:{port}/api/callback')
+CALLBACK_URL = CALLBACK_URL_TEMPLATE.replace('{port}', str(CALLBACK_PORT))
+# По умолчанию токен выводится из токена бота: одинаков для всех процессов и перезапусков
+CALLBACK_TOKEN = os.getenv('CALLBACK_TOKEN') or hashlib.sha256(f'callback:{BOT_TOKEN}'.encode()).hexdigest()[:32]
+# Интервал страховочного опроса задач, когда уведомления включены (в секундах)
+CALLBACK_SAFETY_POLL_INTERVAL = float(os.getenv('CALLBACK_SAFETY_POLL_INTERVAL', '120'))
+
+# Потоковая отправка файлов на сервер алгоритмов
+# Размер части файла, читаемой с диска за раз (определяет потолок памяти на одну загрузку)
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Таймаут чтения ответа сервера во время загрузки (в секундах); общий таймаут не ограничен,
+# так как загрузка файла в 2000 МБ на медленном канале может идти долго
+UPLOAD_READ_TIMEOUT = float(os.getenv('UPLOAD_READ_TIMEOUT', '300'))
+
+# Докачиваемая загрузка по частям для больших файлов (POST /api/uploads)
+# Файлы от этого размера загружаются частями; при обрыве повторяются только недостающие части
+RESUMABLE_UPLOAD_THRESHOLD = int(os.getenv('RESUMABLE_UPLOAD_THRESHOLD', str(64 * 1024 * 1024)))
+# Размер одной части, число частей, загружаемых параллельно, и число попыток на часть
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_PARALLEL_PARTS = int(os.getenv('UPLOAD_PARALLEL_PARTS', '4'))
+UPLOAD_PART_RETRIES = int(os.getenv('UPLOAD_PART_RETRIES', '5'))
+# Каталог с состоянием незавершенных загрузок (позволяет продолжить загрузку после перезапуска)
+UPLOAD_STATE_DIR = os.getenv('UPLOAD_STATE_DIR', 'uploads_state')
+
+# Получение результатов анализа
+# Размер части ответа, результаты до RESULT_IN_MEMORY_MAX байт отправляются в Telegram из памяти,
+# большие сохраняются во временный файл в RESULTS_DIR
+RESULT_CHUNK_SIZE = int(os.getenv('RESULT_CHUNK_SIZE', str(1024 * 1024)))
+RESULT_IN_MEMORY_MAX = int(os.getenv('RESULT_IN_MEMORY_MAX', str(16 * 1024 * 1024)))
+RESULTS_DIR = os.getenv('RESULTS_DIR', 'results')
+
+# Скачивание файлов из Telegram: размер части, записываемой на диск за раз
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Файлы от этого размера скачиваются частями параллельными запросами Range (если сервер их поддерживает)
+RANGED_DOWNLOAD_THRESHOLD = int(os.getenv('RANGED_DOWNLOAD_THRESHOLD', str(32 * 1024 * 1024)))
+# Максимум одновременных запросов частей и начальный размер части (дальше подстраивается под скорость)
+DOWNLOAD_MAX_SEGMENTS = int(os.getenv('DOWNLOAD_MAX_SEGMENTS', '8'))
+DOWNLOAD_SEGMENT_SIZE = int(os.getenv('DOWNLOAD_SEGMENT_SIZE', str(8 * 1024 * 1024)))
+
+# Кэш результатов по содержимому файла (SHA-256) и алгоритму
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'result_cache')
+# Максимальный общий объем кэша (в байтах) и время хранения неиспользуемого результата (в секундах)
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(10 * 1024 * 1024 * 1024)))
+RESULT_CACHE_MAX_AGE = float(os.getenv('RESULT_CACHE_MAX_AGE', str(30 * 24 * 3600)))
+
+# Проверка файлов (Pillow) вне цикла событий: 'thread' - пул потоков, 'process' - пул процессов
+VALIDATION_EXECUTOR = os.getenv('VALIDATION_EXECUTOR', 'thread').lower()
+# Число файлов, проверяемых одновременно, и длина очереди, сверх которой файлы отклоняются
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', str(min(4, os.cpu_count() or 1))))
+VALIDATION_MAX_PENDING = int(os.getenv('VALIDATION_MAX_PENDING', '64'))
+# Максимальное время проверки одного файла (в секундах)
+VALIDATION_TIMEOUT = float(os.getenv('VALIDATION_TIMEOUT', '60'))
+
+# Пакетная загрузка (альбом или /batch): максимум файлов в пакете, число файлов,
+# одновременно скачиваемых, проверяемых и отправляемых на сервер, и пауза (в секундах),
+# после которой альбом считается полученным целиком
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+BATCH_COLLECT_DELAY = float(os.getenv('BATCH_COLLECT_DELAY', '2'))
+# Минимальный интервал между обновлениями сообщения о прогрессе пакета (в секундах)
+BATCH_PROGRESS_INTERVAL = float(os.getenv('BATCH_PROGRESS_INTERVAL', '3'))
+
+# Кэш известных пользователей в памяти процесса: число записей и время жизни (в секундах)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '600'))
+
+# Интервал обновления кэша региона по умолчанию (в секундах)
+REGION_CACHE_REFRESH_INTERVAL = float(os.getenv('REGION_CACHE_REFRESH_INTERVAL', '300'))
+
+# Интервал записи накопленных статусов заявок в БД (в секундах);
+# итоговые статусы (COMPLETED/ERROR/CANCELLED) записываются сразу
+STATUS_FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', '2'))
+
+# Опрос статусов задач на сервере алгоритмов (один планировщик на все задачи)
+# Интервал между опросами одной задачи (в секундах) и число попыток до таймаута -
+# для алгоритмов, по которым еще не набралась статистика длительности
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '5'))
+JOB_MAX_POLL_ATTEMPTS = int(os.getenv('JOB_MAX_POLL_ATTEMPTS', '60'))
+# Опрос по прогнозу длительности: границы интервала между опросами (в секундах)
+JOB_POLL_MIN_INTERVAL = float(os.getenv('JOB_POLL_MIN_INTERVAL', '2'))
+JOB_POLL_MAX_INTERVAL = float(os.getenv('JOB_POLL_MAX_INTERVAL', '60'))
+# Таймаут - 99-й перцентиль длительности, умноженный на JOB_TIMEOUT_FACTOR, в пределах
+# от JOB_MIN_TIMEOUT до JOB_MAX_TIMEOUT (в секундах)
+JOB_TIMEOUT_FACTOR = float(os.getenv('JOB_TIMEOUT_FACTOR', '2'))
+JOB_MIN_TIMEOUT = float(os.getenv('JOB_MIN_TIMEOUT', '300'))
+JOB_MAX_TIMEOUT = float(os.getenv('JOB_MAX_TIMEOUT', '21600'))
+# Размер пачки задач за один проход (один пакетный запрос статусов)
+JOB_POLL_BATCH_SIZE = int(os.getenv('JOB_POLL_BATCH_SIZE', '100'))
+
+# Допуск задач на сервер алгоритмов: одновременно в работе не больше SUBMIT_MAX_IN_FLIGHT задач
+# и не больше SUBMIT_MAX_PER_ALGORITHM задач одного алгоритма, остальные ждут в очереди
+# (модераторы - вне очереди). Лимиты отдельных алгоритмов: 'object_detection=2,vegetation_index=4'
+SUBMIT_MAX_IN_FLIGHT = int(os.getenv('SUBMIT_MAX_IN_FLIGHT', '16'))
+SUBMIT_MAX_PER_ALGORITHM = int(os.getenv('SUBMIT_MAX_PER_ALGORITHM', '8'))
+SUBMIT_ALGORITHM_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition('=') for item in os.getenv('SUBMIT_ALGORITHM_LIMITS', '').split(',') if '=' in item
+    )
+}
+# Как часто обновлять позицию пользователя в очереди и писать метрики допуска в лог (в секундах)
+SUBMIT_POSITION_INTERVAL = float(os.getenv('SUBMIT_POSITION_INTERVAL', '5'))
+SUBMIT_METRICS_INTERVAL = float(os.getenv('SUBMIT_METRICS_INTERVAL', '60'))
+
+# Очередь задач в БД (analysis_jobs): опрос задач продолжается после перезапуска
+# и делится между несколькими процессами бота
+# Имя процесса в аренде задач, срок аренды и интервал ее продления и поиска свободных задач (в секундах)
+JOB_WORKER_ID = os.getenv('JOB_WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+JOB_LEASE_TTL = float(os.getenv('JOB_LEASE_TTL', '60'))
+JOB_LEASE_INTERVAL = float(os.getenv('JOB_LEASE_INTERVAL', '15'))
+# Рабочий процесс (BOT_SHARD) забирает из очереди только задачи своих пользователей
+# (user_id % BOT_WORKERS = BOT_SHARD): /cancel пользователя приходит в его процесс и должен
+# найти там задачу. Задачи процесса, который долго недоступен, передаются другому явно:
+# JOB_TAKEOVER_SHARDS='2' у следующего по кругу процесса - ему фронт и пересылает обновления
+# пользователей недоступного процесса
+JOB_TAKEOVER_SHARDS = [int(shard) for shard in os.getenv('JOB_TAKEOVER_SHARDS', '').split(',') if shard.strip()]
+
+# Статистика длительности анализа по алгоритму и размеру файла (по завершенным заявкам)
+# Окно статистики (в днях), минимум заявок для прогноза и интервал обновления (в секундах)
+DURATION_STATS_WINDOW_DAYS = float(os.getenv('DURATION_STATS_WINDOW_DAYS', '30'))
+DURATION_STATS_MIN_SAMPLES = int(os.getenv('DURATION_STATS_MIN_SAMPLES', '20'))
+DURATION_STATS_REFRESH_INTERVAL = float(os.getenv('DURATION_STATS_REFRESH_INTERVAL', '600'))
+# Границы групп размера файла (в мегабайтах)
+DURATION_STATS_SIZE_BUCKETS_MB = [
+    int(bound) for bound in os.getenv('DURATION_STATS_SIZE_BUCKETS_MB', '16,64,256,1024').split(',') if bound.strip()
+]
+
+# Хранение состояния диалога пользователей в БД (user_states): выбранный алгоритм
+# и шаг диалога переживают перезапуск бота и доступны любому рабочему процессу
+PERSISTENCE_ENABLED = os.getenv('PERSISTENCE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Как часто записывать изменения (в секундах): изменения всех пользователей - одним запросом
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '2'))
+# Пользователи без активности дольше PERSISTENCE_IDLE_TTL секунд выгружаются из памяти
+# (состояние остается в БД), в памяти - не больше PERSISTENCE_MAX_USERS пользователей;
+# проверка - раз в PERSISTENCE_EVICT_INTERVAL секунд
+PERSISTENCE_IDLE_TTL = float(os.getenv('PERSISTENCE_IDLE_TTL', '1800'))
+PERSISTENCE_MAX_USERS = int(os.getenv('PERSISTENCE_MAX_USERS', '10000'))
+PERSISTENCE_EVICT_INTERVAL = float(os.getenv('PERSISTENCE_EVICT_INTERVAL', '60'))
+
 # Поддерживаемые форматы файлов
 SUPPORTED_FILE_FORMATS = ['.tif', '.tiff', '.geotiff', '.jpg', '.jpeg', '.png']
 
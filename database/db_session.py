@@ -70,6 +70,20 @@ async def get_db_session():
             await session.close()
 
 
+# Изменения схемы для уже существующих БД (таблицы, созданные до появления новых колонок).
+# Новые таблицы создает create_all, новые колонки в старых таблицах - эти запросы
+SCHEMA_UPGRADES = [
+    "ALTER TABLE source_images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_source_images_content_hash ON source_images (content_hash)",
+    # Статус CANCELLED: ограничение пересоздается (имя из init.sql или из модели)
+    "ALTER TABLE analysis_requests DROP CONSTRAINT IF EXISTS analysis_requests_status_check",
+    "ALTER TABLE analysis_requests DROP CONSTRAINT IF EXISTS check_request_status",
+    "ALTER TABLE analysis_requests ADD CONSTRAINT check_request_status "
+    "CHECK (status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR', 'CANCELLED'))",
+    "ALTER TABLE analysis_requests ADD COLUMN IF NOT EXISTS submitted_at TIMESTAMP WITH TIME ZONE",
+]
+
+
 async def init_db():
     """
     Инициализация базы данных - создание всех таблиц
@@ -87,7 +101,12 @@ async def init_db():
             )
             tables_exist = result.scalar()
             if tables_exist:
-                logger.info("Таблицы уже существуют")
+                logger.info("Таблицы уже существуют, проверяю обновления схемы...")
+                async with engine.begin() as trans_conn:
+                    # create_all создает только отсутствующие таблицы
+                    await trans_conn.run_sync(Base.metadata.create_all)
+                    for statement in SCHEMA_UPGRADES:
+                        await trans_conn.execute(text(statement))
             else:
                 logger.info("Создаю таблицы...")
                 async with engine.begin() as trans_conn:
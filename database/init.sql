@@ -1,4 +1,7 @@
 -- Очистка старой схемы (удаление таблиц в правильном порядке)
+DROP TABLE IF EXISTS user_states CASCADE;
+DROP TABLE IF EXISTS analysis_jobs CASCADE;
+DROP TABLE IF EXISTS result_cache CASCADE;
 DROP TABLE IF EXISTS results CASCADE;
 DROP TABLE IF EXISTS analysis_requests CASCADE;
 DROP TABLE IF EXISTS source_images CASCADE;
@@ -27,6 +30,7 @@ CREATE TABLE source_images (
     file_path TEXT NOT NULL,
     file_size BIGINT,
     file_extension VARCHAR(10),
+    content_hash VARCHAR(64),
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -37,8 +41,9 @@ CREATE TABLE analysis_requests (
     region_id UUID REFERENCES regions(id),
     source_image_id UUID NOT NULL REFERENCES source_images(id),
     algorithm_name VARCHAR(100) NOT NULL,
-    status VARCHAR(50) NOT NULL DEFAULT 'PENDING' CHECK (status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR')),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    status VARCHAR(50) NOT NULL DEFAULT 'PENDING' CHECK (status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR', 'CANCELLED')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    submitted_at TIMESTAMP
 );
 
 -- 5. Таблица результатов
@@ -49,9 +54,54 @@ CREATE TABLE results (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 6. Кэш результатов (ключ - SHA-256 файла и алгоритм)
+CREATE TABLE result_cache (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    content_hash VARCHAR(64) NOT NULL,
+    algorithm_id VARCHAR(100) NOT NULL,
+    source_image_id UUID REFERENCES source_images(id) ON DELETE SET NULL,
+    result_id UUID REFERENCES results(id) ON DELETE SET NULL,
+    file_path TEXT NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    file_size BIGINT NOT NULL DEFAULT 0,
+    telegram_file_id TEXT,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_result_cache_key UNIQUE (content_hash, algorithm_id)
+);
+
+-- 7. Задачи на сервере алгоритмов, результат которых еще не отправлен (переживают перезапуск бота)
+CREATE TABLE analysis_jobs (
+    analysis_request_id UUID PRIMARY KEY REFERENCES analysis_requests(id) ON DELETE CASCADE,
+    server_task_id VARCHAR(100) NOT NULL,
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    file_path TEXT,
+    algorithm_name VARCHAR(100),
+    algorithm_id VARCHAR(100),
+    content_hash VARCHAR(64),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_poll_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    leased_by VARCHAR(100),
+    lease_expires_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 8. Состояние диалога пользователей (context.user_data)
+CREATE TABLE user_states (
+    user_id BIGINT PRIMARY KEY,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Индексы
 CREATE INDEX idx_requests_user ON analysis_requests(user_id);
 CREATE INDEX idx_requests_status ON analysis_requests(status);
+CREATE INDEX idx_source_images_hash ON source_images(content_hash);
+CREATE INDEX idx_result_cache_last_used ON result_cache(last_used_at);
+CREATE INDEX idx_analysis_jobs_task ON analysis_jobs(server_task_id);
+CREATE INDEX idx_analysis_jobs_next_poll ON analysis_jobs(next_poll_at);
 
 -- Базовое наполнение (необязательно)
 INSERT INTO regions (name, code) VALUES ('Неизвестный регион', '00');
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, DateTime, Text, ForeignKey, CheckConstraint
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Text, ForeignKey, CheckConstraint, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -40,6 +40,8 @@ class SourceImage(Base):
     file_path = Column(Text, nullable=False)
     file_size = Column(BigInteger, nullable=True)
     file_extension = Column(String(10), nullable=True)
+    # SHA-256 содержимого файла (ключ кэша результатов)
+    content_hash = Column(String(64), nullable=True, index=True)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связь: Одна картинка -> Одна заявка
@@ -57,6 +59,8 @@ class AnalysisRequest(Base):
     algorithm_name = Column(String(100), nullable=False)
     status = Column(String(50), nullable=False, default='PENDING', index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Запуск на сервере алгоритмов (после ожидания в очереди допуска); от него считается длительность анализа
+    submitted_at = Column(DateTime(timezone=True), nullable=True)
 
     # Связи
     user = relationship("User", back_populates="requests")
@@ -67,7 +71,7 @@ class AnalysisRequest(Base):
     result = relationship("Result", back_populates="request", uselist=False, cascade="all, delete-orphan")
 
     __table_args__ = (
-        CheckConstraint("status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR')", name='check_request_status'),
+        CheckConstraint("status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR', 'CANCELLED')", name='check_request_status'),
     )
 
 
@@ -82,4 +86,84 @@ class Result(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связи
-    request = relationship("AnalysisRequest", back_populates="result")
\ No newline at end of file
+    request = relationship("AnalysisRequest", back_populates="result")
+
+
+class ResultCacheEntry(Base):
+    """Кэш результатов: один и тот же файл с тем же алгоритмом не отправляется на сервер повторно"""
+    __tablename__ = "result_cache"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    content_hash = Column(String(64), nullable=False)
+    algorithm_id = Column(String(100), nullable=False)
+    source_image_id = Column(UUID(as_uuid=True), ForeignKey('source_images.id', ondelete='SET NULL'), nullable=True)
+    result_id = Column(UUID(as_uuid=True), ForeignKey('results.id', ondelete='SET NULL'), nullable=True)
+
+    # Файл результата на диске и его file_id в Telegram (повторная отправка без загрузки)
+    file_path = Column(Text, nullable=False)
+    file_name = Column(String(255), nullable=False)
+    file_size = Column(BigInteger, nullable=False, default=0)
+    telegram_file_id = Column(Text, nullable=True)
+
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    # Связи
+    source_image = relationship("SourceImage")
+    result = relationship("Result")
+
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'algorithm_id', name='uq_result_cache_key'),
+    )
+
+
+class AnalysisJob(Base):
+    """
+    Задача на сервере алгоритмов, результат которой еще не отправлен пользователю
+
+    Строка живет от запуска анализа до отправки результата. Процесс бота,
+    который опрашивает задачу, держит аренду (leased_by, lease_expires_at) и
+    продлевает ее; после перезапуска или падения процесса аренда истекает и
+    задачу забирает бот без рабочих процессов, рабочий процесс ее пользователя
+    (user_id % BOT_WORKERS) или процесс, которому этот номер передан в
+    JOB_TAKEOVER_SHARDS (SELECT ... FOR UPDATE SKIP LOCKED).
+    """
+    __tablename__ = "analysis_jobs"
+
+    analysis_request_id = Column(UUID(as_uuid=True), ForeignKey('analysis_requests.id', ondelete='CASCADE'), primary_key=True)
+    server_task_id = Column(String(100), nullable=False, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+
+    # Что нужно, чтобы после перезапуска получить и отправить результат
+    file_path = Column(Text, nullable=True)
+    algorithm_name = Column(String(100), nullable=True)
+    algorithm_id = Column(String(100), nullable=True)
+    content_hash = Column(String(64), nullable=True)
+
+    # Расписание опроса
+    attempts = Column(Integer, nullable=False, default=0)
+    next_poll_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+    # Аренда: какой процесс опрашивает задачу и до какого момента
+    leased_by = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Связи
+    request = relationship("AnalysisRequest")
+
+
+class UserState(Base):
+    """
+    Состояние диалога пользователя (context.user_data) для DatabasePersistence
+
+    Хранятся только значения, которые сериализуются в JSON; объекты времени
+    выполнения (пакет файлов в работе) в БД не попадают.
+    """
+    __tablename__ = "user_states"
+
+    user_id = Column(BigInteger, primary_key=True)
+    data = Column(JSONB, nullable=False, default=dict)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
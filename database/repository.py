@@ -1,13 +1,24 @@
 import logging
 import os
-from typing import Optional, List
+from datetime import datetime, timedelta
+import uuid
+from typing import Dict, Optional, List, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from database.models import User, Region, SourceImage, AnalysisRequest, Result
+from sqlalchemy import select, update, delete, func, or_, case, tuple_, values, column, literal_column, DateTime, Integer, String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import insert
+from config import USER_CACHE_SIZE, USER_CACHE_TTL
+from utils.ttl_cache import TTLCache
+from database.models import User, Region, SourceImage, AnalysisRequest, AnalysisJob, Result, ResultCacheEntry, UserState
 
 logger = logging.getLogger(__name__)
 
 
+# Известные пользователи: telegram_id -> (username, role); избавляет от запроса к БД
+# при каждой загрузке файла. Запись сбрасывается при смене username.
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
 class UserRepository:
     @staticmethod
     async def get_or_create_user(
@@ -15,33 +26,70 @@ class UserRepository:
             telegram_id: int,
             username: Optional[str] = None
     ) -> User:
+        cached = _user_cache.get(telegram_id)
+        if cached is not None:
+            cached_username, role = cached
+            if username is None or username == cached_username:
+                # Объект не привязан к сессии: пользователь уже есть в БД
+                return User(telegram_id=telegram_id, username=cached_username, role=role)
+            _user_cache.invalidate(telegram_id)
+
         try:
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if user:
-                if username and user.username != username:
-                    user.username = username
-                    await session.commit()
-                return user
-
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                role='OPERATOR'
+            # Один запрос: INSERT ... ON CONFLICT DO UPDATE ... RETURNING;
+            # xmax = 0 только у только что вставленной строки
+            stmt = UserRepository.upsert_statement(telegram_id, username).returning(
+                User.telegram_id, User.username, User.role, literal_column('xmax = 0').label('inserted')
             )
-            session.add(user)
+            row = (await session.execute(stmt)).one()
             await session.commit()
-            await session.refresh(user)
-            logger.info(f"Created new user: {telegram_id} ({username})")
-            return user
         except Exception as e:
             await session.rollback()
             logger.error(f"Error in get_or_create_user: {e}", exc_info=True)
             raise
 
+        if row.inserted:
+            logger.info(f"Created new user: {telegram_id} ({username})")
+        _user_cache.set(telegram_id, (row.username, row.role))
+        return User(telegram_id=row.telegram_id, username=row.username, role=row.role)
+
+    @staticmethod
+    def upsert_statement(telegram_id: int, username: Optional[str] = None):
+        """INSERT ... ON CONFLICT DO UPDATE для пользователя; пустой username не затирает известный"""
+        stmt = insert(User).values(telegram_id=telegram_id, username=username, role='OPERATOR')
+        return stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={'username': func.coalesce(stmt.excluded.username, User.username)}
+        )
+
+    @staticmethod
+    def is_cached(telegram_id: int, username: Optional[str] = None) -> bool:
+        """Пользователь уже есть в БД и его username не изменился"""
+        cached = _user_cache.get(telegram_id)
+        return cached is not None and (username is None or username == cached[0])
+
+    @staticmethod
+    def cached_role(telegram_id: int) -> Optional[str]:
+        """Роль пользователя из кэша (None, если пользователя нет в кэше)"""
+        cached = _user_cache.get(telegram_id)
+        return cached[1] if cached is not None else None
+
+    @staticmethod
+    def invalidate_cache(telegram_id: int) -> None:
+        """Сбрасывает кэш пользователя (например, после изменения роли в БД)"""
+        _user_cache.invalidate(telegram_id)
+
+
+class RegionRepository:
+    @staticmethod
+    async def get_default_region_id(session: AsyncSession) -> Optional[uuid.UUID]:
+        """Регион по умолчанию (в реальном проекте регион выбирал бы пользователь)"""
+        result = await session.execute(select(Region.id).order_by(Region.code).limit(1))
+        return result.scalar_one_or_none()
+
+
+# Допустимые статусы заявки (см. check_request_status)
+REQUEST_STATUSES = ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR', 'CANCELLED')
+
 
 class RequestRepository:
     @staticmethod
@@ -50,44 +98,103 @@ class RequestRepository:
             user_id: int,
             file_path: str,
             file_size: int,
-            algorithm_name: str
+            algorithm_name: str,
+            content_hash: Optional[str] = None,
+            region_id: Optional[uuid.UUID] = None,
+            username: Optional[str] = None
     ) -> AnalysisRequest:
+        """
+        Создает запись о файле и заявку одним запросом в одной транзакции
+
+        См. create_analysis_requests.
+        """
+        requests = await RequestRepository.create_analysis_requests(
+            session=session,
+            user_id=user_id,
+            files=[(file_path, file_size, content_hash)],
+            algorithm_name=algorithm_name,
+            region_id=region_id,
+            username=username
+        )
+        return requests[0]
+
+    @staticmethod
+    async def create_analysis_requests(
+            session: AsyncSession,
+            user_id: int,
+            files: List[Tuple[str, int, Optional[str]]],
+            algorithm_name: str,
+            region_id: Optional[uuid.UUID] = None,
+            username: Optional[str] = None
+    ) -> List[AnalysisRequest]:
+        """
+        Создает записи о файлах и заявки по ним одним запросом в одной транзакции
+
+        Записи о файлах (и пользователь, если его нет в кэше UserRepository)
+        вставляются в CTE того же многострочного INSERT, что и заявки; ID
+        генерируются на стороне бота, а время создания возвращает RETURNING.
+        Итого два обращения к БД независимо от числа файлов: запрос и COMMIT.
+
+        Args:
+            files: Список (путь к файлу, размер, SHA-256 содержимого)
+            region_id: Регион заявок (см. RegionCache)
+            username: Username пользователя для создания/обновления записи пользователя
+
+        Returns:
+            Заявки в порядке files
+        """
+        source_rows = []
+        request_rows = []
+        for file_path, file_size, content_hash in files:
+            source_image_id = uuid.uuid4()
+            source_rows.append({
+                'id': source_image_id,
+                'file_path': file_path,
+                'file_size': file_size,
+                'file_extension': os.path.splitext(file_path)[1].lower() if file_path else None,
+                'content_hash': content_hash
+            })
+            request_rows.append({
+                'id': uuid.uuid4(),
+                'user_id': user_id,
+                'source_image_id': source_image_id,
+                'region_id': region_id,
+                'algorithm_name': algorithm_name,
+                'status': 'PENDING'
+            })
+
+        returning = [AnalysisRequest.id, AnalysisRequest.created_at]
+        upserted_user = None
+        if not UserRepository.is_cached(user_id, username):
+            # Внешние ключи проверяются в конце запроса, когда пользователь уже вставлен;
+            # username и роль из CTE возвращаются вместе с заявками и попадают в кэш
+            upserted_user = UserRepository.upsert_statement(user_id, username).returning(
+                User.username, User.role
+            ).cte('upserted_user')
+            returning += [
+                select(upserted_user.c.username).scalar_subquery().label('user_username'),
+                select(upserted_user.c.role).scalar_subquery().label('user_role')
+            ]
+        stmt = insert(AnalysisRequest).values(request_rows).returning(*returning)
+        stmt = stmt.add_cte(insert(SourceImage).values(source_rows).cte('new_source_images'))
+        if upserted_user is not None:
+            stmt = stmt.add_cte(upserted_user)
+
         try:
-            # 1. Создаем запись о файле
-            ext = os.path.splitext(file_path)[1].lower() if file_path else None
-            source_image = SourceImage(
-                file_path=file_path,
-                file_size=file_size,
-                file_extension=ext
-            )
-            session.add(source_image)
-            await session.flush()  # Получаем ID картинки
-
-            # 2. Пытаемся найти дефолтный регион (опционально)
-            # В реальном проекте здесь был бы выбор региона пользователем
-            region_res = await session.execute(select(Region).limit(1))
-            region = region_res.scalar_one_or_none()
-            region_id = region.id if region else None
-
-            # 3. Создаем заявку
-            request = AnalysisRequest(
-                user_id=user_id,
-                source_image_id=source_image.id,
-                region_id=region_id,
-                algorithm_name=algorithm_name,
-                status='PENDING'
-            )
-            session.add(request)
+            rows = (await session.execute(stmt)).all()
             await session.commit()
-            await session.refresh(request)
-
-            logger.info(f"Created analysis request: {request.id} for user {user_id}")
-            return request
         except Exception as e:
             await session.rollback()
-            logger.error(f"Error in create_analysis_request: {e}", exc_info=True)
+            logger.error(f"Error in create_analysis_requests: {e}", exc_info=True)
             raise
 
+        created_at = {row.id: row.created_at for row in rows}
+        if upserted_user is not None and rows:
+            _user_cache.set(user_id, (rows[0].user_username, rows[0].user_role))
+
+        logger.info(f"Created {len(request_rows)} analysis request(s) for user {user_id}")
+        return [AnalysisRequest(created_at=created_at.get(row['id']), **row) for row in request_rows]
+
     @staticmethod
     async def update_status(
             session: AsyncSession,
@@ -95,8 +202,7 @@ class RequestRepository:
             status: str
     ) -> bool:
         try:
-            valid_statuses = ('PENDING', 'PROCESSING', 'COMPLETED', 'ERROR')
-            if status not in valid_statuses:
+            if status not in REQUEST_STATUSES:
                 logger.error(f"Invalid status: {status}")
                 return False
 
@@ -113,6 +219,327 @@ class RequestRepository:
             logger.error(f"Error updating status: {e}", exc_info=True)
             return False
 
+    @staticmethod
+    async def update_statuses(
+            session: AsyncSession,
+            statuses: Dict[str, str],
+            submitted: Optional[Dict[str, datetime]] = None
+    ) -> int:
+        """
+        Обновляет статусы нескольких заявок одним запросом UPDATE ... FROM (VALUES ...)
+
+        Args:
+            statuses: ID заявки -> новый статус
+            submitted: ID заявки -> время запуска на сервере алгоритмов; записывается,
+                только если у заявки его еще нет
+
+        Returns:
+            Число обновленных заявок
+        """
+        submitted = submitted or {}
+        invalid = [status for status in statuses.values() if status not in REQUEST_STATUSES]
+        if invalid:
+            raise ValueError(f"Invalid statuses: {invalid}")
+        if not statuses:
+            return 0
+
+        new_statuses = values(
+            column('id', UUID(as_uuid=True)),
+            column('status', String(50)),
+            column('submitted_at', DateTime(timezone=True)),
+            name='new_statuses'
+        ).data([
+            (uuid.UUID(str(request_id)), status, submitted.get(request_id))
+            for request_id, status in statuses.items()
+        ])
+        try:
+            result = await session.execute(
+                update(AnalysisRequest)
+                .where(AnalysisRequest.id == new_statuses.c.id)
+                .values(
+                    status=new_statuses.c.status,
+                    submitted_at=func.coalesce(AnalysisRequest.submitted_at, new_statuses.c.submitted_at)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def get_duration_percentiles(
+            session: AsyncSession,
+            size_bounds: List[int],
+            window_seconds: float
+    ) -> List[Tuple]:
+        """
+        Длительность выполненных заявок (от запуска на сервере алгоритмов до
+        сохранения результата) по алгоритму и группе размера файла за последние
+        window_seconds
+
+        Ожидание в очереди допуска не входит в длительность: прогноз и таймаут
+        задачи отсчитываются от запуска. Результаты из кэша и заявки без
+        времени запуска не учитываются. Группа размера - индекс в size_bounds
+        (len(size_bounds) - файл больше всех границ); строки с группой None -
+        по алгоритму в целом.
+
+        Returns:
+            Список (алгоритм, группа размера или None, число заявок, p50, p90, p99) в секундах
+        """
+        duration = func.extract('epoch', Result.created_at - AnalysisRequest.submitted_at)
+        size_bucket = case(
+            *[(SourceImage.file_size < bound, index) for index, bound in enumerate(size_bounds)],
+            else_=len(size_bounds)
+        ).label('size_bucket')
+        result = await session.execute(
+            select(
+                AnalysisRequest.algorithm_name,
+                size_bucket,
+                func.count(),
+                func.percentile_cont(0.5).within_group(duration),
+                func.percentile_cont(0.9).within_group(duration),
+                func.percentile_cont(0.99).within_group(duration)
+            )
+            .join(Result, Result.analysis_request_id == AnalysisRequest.id)
+            .join(SourceImage, SourceImage.id == AnalysisRequest.source_image_id)
+            .where(AnalysisRequest.status == 'COMPLETED')
+            .where(AnalysisRequest.submitted_at.is_not(None))
+            .where(AnalysisRequest.created_at > func.now() - timedelta(seconds=window_seconds))
+            .where(~Result.result_metadata.has_key('cached'))
+            .group_by(func.grouping_sets(
+                tuple_(AnalysisRequest.algorithm_name, size_bucket),
+                tuple_(AnalysisRequest.algorithm_name)
+            ))
+        )
+        return [tuple(row) for row in result.all()]
+
+
+class JobQueueRepository:
+    """Очередь задач в работе (analysis_jobs) с арендой строк процессами бота"""
+
+    @staticmethod
+    async def enqueue(
+            session: AsyncSession,
+            jobs: List[Dict],
+            worker_id: str,
+            lease_ttl: float,
+            poll_interval: float
+    ) -> None:
+        """
+        Сохраняет запущенные задачи, сразу арендованные процессом worker_id
+
+        Args:
+            jobs: Значения колонок analysis_jobs (analysis_request_id, server_task_id, chat_id, ...)
+        """
+        if not jobs:
+            return
+        stmt = insert(AnalysisJob).values([
+            dict(job, leased_by=worker_id,
+                 lease_expires_at=func.now() + timedelta(seconds=lease_ttl),
+                 next_poll_at=func.now() + timedelta(seconds=poll_interval))
+            for job in jobs
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[AnalysisJob.analysis_request_id],
+            set_={
+                'server_task_id': stmt.excluded.server_task_id,
+                'attempts': 0,
+                'next_poll_at': stmt.excluded.next_poll_at,
+                'leased_by': stmt.excluded.leased_by,
+                'lease_expires_at': stmt.excluded.lease_expires_at
+            }
+        )
+        try:
+            await session.execute(stmt)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def lease(
+            session: AsyncSession,
+            worker_id: str,
+            lease_ttl: float,
+            limit: int,
+            shard_count: int = 1,
+            shards: Optional[List[int]] = None
+    ) -> List[Dict]:
+        """
+        Арендует задачи без владельца или с истекшей арендой, ближайшие по сроку опроса
+
+        Строки, которые в этот момент арендует другой процесс, пропускаются
+        (FOR UPDATE SKIP LOCKED), поэтому несколько процессов делят очередь без конфликтов.
+
+        Args:
+            shard_count: Число рабочих процессов
+            shards: Номера процессов, задачи пользователей которых арендуются
+                (user_id % shard_count); None - задачи всех пользователей
+
+        Returns:
+            Значения колонок арендованных задач
+        """
+        leasable = (
+            select(AnalysisJob.analysis_request_id)
+            .where(or_(AnalysisJob.lease_expires_at.is_(None), AnalysisJob.lease_expires_at < func.now()))
+            .order_by(AnalysisJob.next_poll_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        if shards is not None:
+            leasable = leasable.where((AnalysisJob.user_id % shard_count).in_(shards))
+        try:
+            result = await session.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.analysis_request_id.in_(leasable.scalar_subquery()))
+                .values(leased_by=worker_id, lease_expires_at=func.now() + timedelta(seconds=lease_ttl))
+                .returning(*AnalysisJob.__table__.c, (AnalysisJob.next_poll_at - func.now()).label('poll_delay'))
+                .execution_options(synchronize_session=False)
+            )
+            rows = [dict(row) for row in result.mappings().all()]
+            await session.commit()
+            return rows
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def renew(
+            session: AsyncSession,
+            worker_id: str,
+            lease_ttl: float,
+            attempts: Dict[str, int],
+            poll_interval: float
+    ) -> int:
+        """
+        Продлевает аренду всех задач процесса и сохраняет число опросов отслеживаемых задач
+
+        Args:
+            attempts: ID заявки -> число выполненных опросов
+
+        Returns:
+            Число задач, аренда которых продлена
+        """
+        try:
+            if attempts:
+                polled = values(
+                    column('id', UUID(as_uuid=True)),
+                    column('attempts', Integer),
+                    name='polled'
+                ).data([(uuid.UUID(str(request_id)), count) for request_id, count in attempts.items()])
+                await session.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.analysis_request_id == polled.c.id)
+                    .where(AnalysisJob.leased_by == worker_id)
+                    .values(attempts=polled.c.attempts, next_poll_at=func.now() + timedelta(seconds=poll_interval))
+                    .execution_options(synchronize_session=False)
+                )
+            result = await session.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.leased_by == worker_id)
+                .values(lease_expires_at=func.now() + timedelta(seconds=lease_ttl))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def complete(session: AsyncSession, request_ids: List[str]) -> None:
+        """Удаляет задачи, результат которых отправлен (или которые завершились ошибкой)"""
+        if not request_ids:
+            return
+        try:
+            await session.execute(
+                delete(AnalysisJob)
+                .where(AnalysisJob.analysis_request_id.in_([uuid.UUID(str(request_id)) for request_id in request_ids]))
+            )
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def release(session: AsyncSession, worker_id: str) -> int:
+        """Снимает аренду процесса, чтобы задачи сразу забрал следующий запуск или другой процесс"""
+        try:
+            result = await session.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.leased_by == worker_id)
+                .values(leased_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+        except Exception:
+            await session.rollback()
+            raise
+
+
+class UserStateRepository:
+    """Состояние диалога пользователей (user_states) для DatabasePersistence"""
+
+    @staticmethod
+    async def get(session: AsyncSession, user_id: int) -> Dict:
+        """Сохраненное состояние пользователя (пустой словарь, если его нет)"""
+        data = await session.scalar(select(UserState.data).where(UserState.user_id == user_id))
+        # null остается только у ключа, удаленного до того, как строка была создана
+        return {key: value for key, value in (data or {}).items() if value is not None}
+
+    @staticmethod
+    async def save(session: AsyncSession, patches: Dict[int, Dict]) -> int:
+        """
+        Записывает изменения состояния нескольких пользователей одним запросом
+
+        Args:
+            patches: ID пользователя -> измененные ключи; значение None удаляет ключ
+
+        Returns:
+            Число записанных строк
+        """
+        if not patches:
+            return 0
+        stmt = insert(UserState).values([
+            {'user_id': user_id, 'data': patch}
+            for user_id, patch in patches.items()
+        ])
+        # Изменения накладываются на сохраненное состояние, ключи со значением null удаляются
+        patch_items = func.jsonb_each(stmt.excluded.data).table_valued('key', 'value')
+        removed_keys = (
+            select(func.coalesce(func.array_agg(patch_items.c.key), literal_column("'{}'::text[]")))
+            .where(patch_items.c.value == literal_column("'null'::jsonb"))
+            .scalar_subquery()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserState.user_id],
+            set_={
+                'data': UserState.data.op('||')(stmt.excluded.data).op('-')(removed_keys),
+                'updated_at': func.now()
+            }
+        )
+        try:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount
+        except Exception:
+            await session.rollback()
+            raise
+
+    @staticmethod
+    async def delete(session: AsyncSession, user_ids: List[int]) -> None:
+        if not user_ids:
+            return
+        try:
+            await session.execute(delete(UserState).where(UserState.user_id.in_(user_ids)))
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
 
 class ResultRepository:
     @staticmethod
@@ -134,4 +561,145 @@ class ResultRepository:
         except Exception as e:
             await session.rollback()
             logger.error(f"Error create_result: {e}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+
+class ResultCacheRepository:
+    @staticmethod
+    async def get(
+            session: AsyncSession,
+            content_hash: str,
+            algorithm_id: str
+    ) -> Optional[ResultCacheEntry]:
+        result = await session.execute(
+            select(ResultCacheEntry).where(
+                ResultCacheEntry.content_hash == content_hash,
+                ResultCacheEntry.algorithm_id == algorithm_id
+            )
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def touch(session: AsyncSession, entry_id) -> None:
+        """Отмечает попадание в кэш (для вытеснения по давности использования)"""
+        try:
+            await session.execute(
+                update(ResultCacheEntry)
+                .where(ResultCacheEntry.id == entry_id)
+                .values(hit_count=ResultCacheEntry.hit_count + 1, last_used_at=func.now())
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error touching cache entry: {e}", exc_info=True)
+
+    @staticmethod
+    async def upsert(
+            session: AsyncSession,
+            content_hash: str,
+            algorithm_id: str,
+            request_id: Optional[str],
+            result_id: Optional[str],
+            file_path: str,
+            file_name: str,
+            file_size: int
+    ) -> Optional[str]:
+        """
+        Сохраняет запись кэша. Если запись с таким ключом уже есть, заменяет ее
+
+        Returns:
+            Путь к файлу прежней записи, если он отличается от нового (его нужно удалить)
+        """
+        try:
+            previous = await ResultCacheRepository.get(session, content_hash, algorithm_id)
+            previous_path = previous.file_path if previous and previous.file_path != file_path else None
+
+            source_image_id = None
+            if request_id:
+                source_image_id = (await session.execute(
+                    select(AnalysisRequest.source_image_id).where(AnalysisRequest.id == request_id)
+                )).scalar_one_or_none()
+
+            values = dict(
+                source_image_id=source_image_id,
+                result_id=result_id,
+                file_path=file_path,
+                file_name=file_name,
+                file_size=file_size,
+                telegram_file_id=None,
+                last_used_at=func.now()
+            )
+            statement = insert(ResultCacheEntry).values(
+                content_hash=content_hash,
+                algorithm_id=algorithm_id,
+                hit_count=0,
+                **values
+            ).on_conflict_do_update(constraint='uq_result_cache_key', set_=values)
+            await session.execute(statement)
+            await session.commit()
+            logger.info(f"Cached result for {content_hash[:12]}/{algorithm_id}")
+            return previous_path
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error in result cache upsert: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    async def set_telegram_file_id(
+            session: AsyncSession,
+            content_hash: str,
+            algorithm_id: str,
+            telegram_file_id: str
+    ) -> None:
+        try:
+            await session.execute(
+                update(ResultCacheEntry)
+                .where(
+                    ResultCacheEntry.content_hash == content_hash,
+                    ResultCacheEntry.algorithm_id == algorithm_id
+                )
+                .values(telegram_file_id=telegram_file_id)
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error saving telegram file id: {e}", exc_info=True)
+
+    @staticmethod
+    async def delete_entries(session: AsyncSession, entry_ids: List) -> None:
+        if not entry_ids:
+            return
+        try:
+            await session.execute(delete(ResultCacheEntry).where(ResultCacheEntry.id.in_(entry_ids)))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error deleting cache entries: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    async def select_for_eviction(
+            session: AsyncSession,
+            max_age_seconds: float,
+            max_bytes: int
+    ) -> List[Tuple]:
+        """
+        Возвращает (id, file_path) записей, которые нужно вытеснить: не использованных дольше
+        max_age_seconds, а также самых давно использованных, пока общий объем больше max_bytes
+        """
+        running_total = func.sum(ResultCacheEntry.file_size).over(
+            order_by=ResultCacheEntry.last_used_at.desc()
+        ).label('running_total')
+        ranked = select(
+            ResultCacheEntry.id,
+            ResultCacheEntry.file_path,
+            ResultCacheEntry.last_used_at,
+            running_total
+        ).subquery()
+        result = await session.execute(
+            select(ranked.c.id, ranked.c.file_path).where(or_(
+                ranked.c.last_used_at < func.now() - timedelta(seconds=max_age_seconds),
+                ranked.c.running_total > max_bytes
+            ))
+        )
+        return [tuple(row) for row in result.all()]
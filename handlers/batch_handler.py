@@ -0,0 +1,551 @@
+"""
+Пакетная загрузка: файлы альбома (media_group_id) или пакетного режима (/batch ... /done)
+скачиваются, проверяются и запускаются вместе, а прогресс показывается одним сообщением
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, ContextTypes
+from services.job_scheduler import TrackedJob
+from services.region_cache import get_default_region_id
+from services.validation_pool import get_shared_validation_pool
+from utils.downloader import DownloadRejected, DownloadResult, get_shared_downloader
+from utils.file_validator import check_file_name
+from utils.image_header import check_image_prefix
+from config import (
+    BATCH_COLLECT_DELAY,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_FILES,
+    BATCH_PROGRESS_INTERVAL,
+    MAX_FILE_SIZE,
+    TELEGRAM_MAX_FILE_SIZE
+)
+from handlers.command_handler import get_after_result_keyboard, get_error_keyboard, get_main_keyboard
+from handlers.file_handler import (
+    handle_file,
+    _format_duration,
+    _register_submission,
+    _remove_source_file,
+    _set_db_status,
+    _submit_job
+)
+from database.db_session import AsyncSessionLocal
+from database.repository import RequestRepository, UserRepository
+
+logger = logging.getLogger(__name__)
+
+# Сколько ошибок по отдельным файлам показывать в сообщении о прогрессе
+MAX_LISTED_ERRORS = 10
+
+
+class FileBatch:
+    """Файлы, которые собираются в пакет, но еще не отправлены в обработку"""
+
+    __slots__ = ('chat_id', 'user_id', 'username', 'algorithm', 'auto', 'items', 'file_ids', 'skipped', 'updated_at')
+
+    def __init__(self, chat_id: int, user_id: int, username: Optional[str], algorithm: Dict[str, str], auto: bool):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.username = username
+        self.algorithm = algorithm
+        # True - альбом, отправляется сам после паузы BATCH_COLLECT_DELAY; False - ждет /done
+        self.auto = auto
+        # (документ или фото, имя файла)
+        self.items: List[Tuple[Any, str]] = []
+        self.file_ids = set()
+        self.skipped = 0
+        self.updated_at = time.monotonic()
+
+    def __deepcopy__(self, memo):
+        # Лежит в user_data, который копируется при сохранении состояния: это объект
+        # времени выполнения, он не сохраняется в БД (см. DatabasePersistence)
+        return self
+
+    def add(self, file: Any, file_name: str) -> bool:
+        """Добавляет файл в пакет; False - пакет уже заполнен"""
+        self.updated_at = time.monotonic()
+        if file.file_unique_id in self.file_ids:
+            return True
+        if len(self.items) >= BATCH_MAX_FILES:
+            self.skipped += 1
+            return False
+        self.file_ids.add(file.file_unique_id)
+        self.items.append((file, file_name))
+        return True
+
+
+class JobGroup:
+    """
+    Заявки одного пакета: общий прогресс и итог по всем файлам
+
+    Сообщение о прогрессе редактируется не чаще раза в BATCH_PROGRESS_INTERVAL
+    секунд; когда все файлы пакета обработаны, отправляется итог и
+    сбрасывается состояние пользователя.
+    """
+
+    __slots__ = (
+        'chat_id',
+        'user_id',
+        'algorithm_name',
+        'total',
+        'checked',
+        'completed',
+        'failed',
+        'running',
+        'finished',
+        'names',
+        'errors',
+        'message',
+        'closed',
+        'expected_at',
+        '_text',
+        '_edited_at',
+        '_refresh_task'
+    )
+
+    def __init__(self, batch: FileBatch):
+        self.chat_id = batch.chat_id
+        self.user_id = batch.user_id
+        self.algorithm_name = batch.algorithm['name']
+        self.total = len(batch.items) + batch.skipped
+        self.checked = 0
+        self.completed = 0
+        self.failed = batch.skipped
+        # ID заявок, запущенных на сервере и еще не завершенных
+        self.running = set()
+        # ID завершенных заявок (завершение может прийти раньше start_item)
+        self.finished = set()
+        # ID заявки -> имя файла
+        self.names: Dict[str, str] = {}
+        self.errors: List[Tuple[str, str]] = []
+        if batch.skipped:
+            self.errors.append((f"{batch.skipped} файл(ов)", f"в пакете не больше {BATCH_MAX_FILES} файлов"))
+        self.message = None
+        self.closed = False
+        # Ожидаемое завершение последней запущенной заявки (time.time()), если есть прогноз
+        self.expected_at: Optional[float] = None
+        self._text = None
+        self._edited_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def __deepcopy__(self, memo):
+        # Как и FileBatch, не копируется и не сохраняется в БД
+        return self
+
+    def file_name(self, job: TrackedJob) -> str:
+        return self.names.get(job.db_request_id) or os.path.basename(job.file_path or '')
+
+    def render(self) -> str:
+        lines = [
+            f"📦 Файлов в пакете: {self.total}",
+            f"Алгоритм: {self.algorithm_name}",
+            ""
+        ]
+        if self.checked + self.failed < self.total and not self.closed:
+            lines.append(f"🔍 Проверено: {self.checked}")
+        lines.append(f"⏳ В работе: {len(self.running)}")
+        lines.append(f"✅ Готово: {self.completed}")
+        lines.append(f"❌ Ошибки: {self.failed}")
+        if self.running and self.expected_at is not None:
+            lines.append(f"⏱ Ожидаемое время: {_format_duration(self.expected_at - time.time())}")
+        if self.errors:
+            lines.append("")
+            for name, error in self.errors[:MAX_LISTED_ERRORS]:
+                lines.append(f"• {name}: {error}")
+            if len(self.errors) > MAX_LISTED_ERRORS:
+                lines.append(f"... и еще {len(self.errors) - MAX_LISTED_ERRORS}")
+        return "\n".join(lines)
+
+    async def refresh(self, force: bool = False) -> None:
+        """Обновляет сообщение о прогрессе (не чаще раза в BATCH_PROGRESS_INTERVAL)"""
+        if self.message is None:
+            return
+        wait = self._edited_at + BATCH_PROGRESS_INTERVAL - time.monotonic()
+        if wait > 0 and not force:
+            # Отложенное обновление покажет все изменения за интервал
+            if self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._refresh_later(wait))
+            return
+        text = self.render()
+        if text == self._text:
+            return
+        self._text = text
+        self._edited_at = time.monotonic()
+        try:
+            await self.message.edit_text(text)
+        except TelegramError as e:
+            logger.debug(f"Failed to update batch progress: {e}")
+
+    async def _refresh_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._refresh_task = None
+        if not self.closed:
+            await self.refresh()
+
+    async def check_item(self) -> None:
+        """Файл скачан и прошел проверку"""
+        self.checked += 1
+        await self.refresh()
+
+    async def start_item(self, job: TrackedJob) -> None:
+        """Заявка запущена на сервере или присоединена к такой же задаче"""
+        if job.db_request_id not in self.finished:
+            self.running.add(job.db_request_id)
+            if job.expected_duration is not None:
+                expected_at = job.submitted_at + job.expected_duration
+                self.expected_at = max(self.expected_at or expected_at, expected_at)
+        await self.refresh()
+
+    async def fail_item(self, application: Application, file_name: str, error: str) -> None:
+        """Файл не дошел до запуска анализа"""
+        self.failed += 1
+        self.errors.append((file_name, error))
+        await self._progress(application)
+
+    async def finish_item(self, application: Application, job: TrackedJob, error: Optional[str] = None) -> None:
+        """Заявка пакета завершена: результат отправлен (error is None) или произошла ошибка"""
+        self.running.discard(job.db_request_id)
+        self.finished.add(job.db_request_id)
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+            self.errors.append((self.file_name(job), error))
+        await self._progress(application)
+
+    async def _progress(self, application: Application) -> None:
+        if self.completed + self.failed >= self.total:
+            await self._finish(application)
+        else:
+            await self.refresh()
+
+    async def _finish(self, application: Application) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        await self.refresh(force=True)
+        if self.completed:
+            text = f"✅ Пакет обработан: готово {self.completed} из {self.total}."
+            keyboard = get_after_result_keyboard()
+        else:
+            text = "❌ Не удалось обработать ни одного файла пакета.\n\nВыберите действие:"
+            keyboard = get_error_keyboard()
+        try:
+            await application.bot.send_message(self.chat_id, text, reply_markup=keyboard)
+        except TelegramError as e:
+            logger.warning(f"Failed to send batch summary: {e}")
+        self._release(application)
+
+    async def cancel(self) -> None:
+        """Пакет отменен пользователем: незапущенные файлы пропускаются, прогресс больше не обновляется"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self.message is not None:
+            try:
+                await self.message.edit_text(self.render() + "\n\n❌ Пакет отменен.")
+            except TelegramError:
+                pass
+
+    async def abort(self, application: Application, text: str) -> None:
+        """Прерывает пакет после непредвиденной ошибки; уже запущенные заявки дорабатывают без прогресса"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await application.bot.send_message(self.chat_id, text, reply_markup=get_error_keyboard())
+        except TelegramError:
+            pass
+        self._release(application)
+
+    def _release(self, application: Application) -> None:
+        user_data = application.user_data.get(self.user_id)
+        if user_data is not None and user_data.get('batch_group') is self:
+            user_data.clear()
+            application.mark_data_for_update_persistence(user_ids=self.user_id)
+
+
+async def handle_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Принимает документ или фото: файлы альбома и пакетного режима собираются
+    в пакет, остальные обрабатываются по одному (см. handle_file)
+    """
+    message = update.message
+    batch = context.user_data.get('batch')
+    if batch is not None and context.user_data.get('state') != 'waiting_file':
+        # Пользователь вышел из выбора файлов (другой алгоритм и т.п.) - несобранный пакет отбрасывается
+        context.user_data.pop('batch', None)
+        batch = None
+    if batch is None and message.media_group_id is None:
+        await handle_file(update, context)
+        return
+
+    if batch is None:
+        if context.user_data.get('state') != 'waiting_file' or 'selected_algorithm' not in context.user_data:
+            # Об ошибке сообщаем один раз на альбом, а не на каждый его файл
+            if context.user_data.get('rejected_media_group') != message.media_group_id:
+                context.user_data['rejected_media_group'] = message.media_group_id
+                await handle_file(update, context)
+            return
+        batch = _new_batch(update, context, auto=True)
+        # Альбом приходит отдельными сообщениями подряд: ждем паузы и отправляем пакет
+        context.application.create_task(_submit_when_quiet(context.application, context.user_data, batch))
+
+    if message.document:
+        file = message.document
+        file_name = getattr(file, 'file_name', None) or f"file_{file.file_id}"
+    elif message.photo:
+        file = message.photo[-1]
+        file_name = f"photo_{file.file_id}.jpg"
+    else:
+        return
+
+    if not batch.add(file, file_name) and batch.skipped == 1:
+        await message.reply_text(f"⚠️ В пакете может быть не больше {BATCH_MAX_FILES} файлов, остальные будут пропущены.")
+
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /batch: файлы, отправленные до /done, обрабатываются одним пакетом"""
+    if context.user_data.get('state') != 'waiting_file' or 'selected_algorithm' not in context.user_data:
+        await update.message.reply_text(
+            "❌ Сначала выберите алгоритм, используя кнопку 'Выбрать алгоритм'",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    batch = context.user_data.get('batch')
+    if batch is None:
+        _new_batch(update, context, auto=False)
+    else:
+        # Собираемый альбом становится частью пакета
+        batch.auto = False
+    await update.message.reply_text(
+        f"📦 Пакетный режим включен.\n\n"
+        f"Отправьте файлы (до {BATCH_MAX_FILES}), затем команду /done - "
+        f"все файлы будут проверены и запущены одним пакетом."
+    )
+
+
+async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /done: отправляет собранный пакет в обработку"""
+    batch = context.user_data.get('batch')
+    if batch is None or batch.auto:
+        await update.message.reply_text("❌ Пакетный режим не включен. Используйте /batch после выбора алгоритма.")
+        return
+    if not batch.items:
+        await update.message.reply_text("❌ В пакете нет файлов. Отправьте файлы и повторите /done.")
+        return
+    _start_batch(context.application, context.user_data, batch)
+
+
+def _new_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, auto: bool) -> FileBatch:
+    batch = FileBatch(
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id,
+        username=update.effective_user.username,
+        algorithm=context.user_data['selected_algorithm'],
+        auto=auto
+    )
+    context.user_data['batch'] = batch
+    return batch
+
+
+async def _submit_when_quiet(application: Application, user_data: dict, batch: FileBatch) -> None:
+    """Отправляет альбом в обработку, когда его файлы перестали приходить"""
+    while True:
+        delay = batch.updated_at + BATCH_COLLECT_DELAY - time.monotonic()
+        if delay <= 0:
+            break
+        await asyncio.sleep(delay)
+    # Пакет могли отменить или перевести в режим /batch
+    if batch.auto and user_data.get('batch') is batch:
+        _start_batch(application, user_data, batch)
+
+
+def _start_batch(application: Application, user_data: dict, batch: FileBatch) -> None:
+    """Переводит пользователя в ожидание пакета и запускает его обработку в фоне"""
+    group = JobGroup(batch)
+    user_data.pop('batch', None)
+    user_data['state'] = 'processing'
+    user_data['batch_group'] = group
+    application.mark_data_for_update_persistence(user_ids=batch.user_id)
+    # Скачивание и запуск идут вне обработчика, чтобы не задерживать остальные обновления пользователя
+    application.create_task(_run_batch(application, batch, group))
+
+
+async def _run_batch(application: Application, batch: FileBatch, group: JobGroup) -> None:
+    """Скачивает и проверяет файлы пакета, создает заявки одним запросом и запускает анализ"""
+    try:
+        group.message = await application.bot.send_message(group.chat_id, group.render())
+    except TelegramError as e:
+        logger.warning(f"Failed to send batch progress message: {e}")
+    logger.info(f"Processing batch of {group.total} files for user {group.user_id}")
+
+    try:
+        os.makedirs('downloads', exist_ok=True)
+        # Одновременно скачивается, проверяется и отправляется на сервер не больше BATCH_CONCURRENCY файлов
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        prepared = await asyncio.gather(*(
+            _prepare_item(application, group, file, file_name, semaphore)
+            for file, file_name in batch.items
+        ))
+        ready = [item for item in prepared if item is not None]
+        if group.closed:
+            # Пакет отменили, пока файлы скачивались
+            for _, download in ready:
+                try:
+                    os.remove(download.path)
+                except:
+                    pass
+            return
+        jobs = await _create_jobs(application, batch, group, ready)
+        # Роль пользователя попадает в кэш при создании заявок
+        priority = UserRepository.cached_role(batch.user_id) == 'MODERATOR'
+        # Запуск каждой заявки - отдельная задача, которую прерывает /cancel (см. cancel_user_jobs)
+        tasks = []
+        for job in jobs:
+            task = application.create_task(_submit_item(application, group, job, semaphore, priority))
+            _register_submission(application, job, task)
+            tasks.append(task)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Отмененные задачи уже учтены в cancel_user_jobs
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+    except Exception as e:
+        logger.error(f"Unexpected error in batch of user {group.user_id}: {e}", exc_info=True)
+        await group.abort(application, "❌ Произошла непредвиденная ошибка при обработке пакета.")
+
+
+async def _prepare_item(
+        application: Application,
+        group: JobGroup,
+        file: Any,
+        file_name: str,
+        semaphore: asyncio.Semaphore
+) -> Optional[Tuple[str, DownloadResult]]:
+    """Скачивает и проверяет файл пакета; None - файл отклонен (ошибка учтена в group)"""
+    download_path = f"downloads/{group.user_id}_{file.file_unique_id}_{file_name}"
+    download = None
+    # Неподдерживаемое расширение и слишком большой файл отклоняем до скачивания
+    error = check_file_name(file_name)
+    file_size = getattr(file, 'file_size', 0)
+    if error is None and file_size and file_size > TELEGRAM_MAX_FILE_SIZE:
+        error = f"Файл слишком большой для скачивания ({file_size / (1024 * 1024):.1f} МБ)"
+
+    if error is None:
+        async with semaphore:
+            if group.closed:
+                return None
+            try:
+                file_obj = await application.bot.get_file(file.file_id)
+                download = await get_shared_downloader(application.bot_data).download(
+                    file_obj,
+                    download_path,
+                    max_size=MAX_FILE_SIZE,
+                    probe=check_image_prefix
+                )
+            except DownloadRejected as e:
+                error = str(e)
+            except TelegramError as e:
+                error = f"Ошибка при получении файла: {e}"
+            except Exception as e:
+                logger.error(f"Error downloading {file_name}: {e}", exc_info=True)
+                error = "Не удалось скачать файл"
+            if error is None:
+                image_info, error = await get_shared_validation_pool(application.bot_data).inspect(
+                    download_path,
+                    download.size
+                )
+
+    if error is not None:
+        try:
+            os.remove(download_path)
+        except:
+            pass
+        await group.fail_item(application, file_name, error)
+        return None
+
+    await group.check_item()
+    return file_name, download
+
+
+async def _create_jobs(
+        application: Application,
+        batch: FileBatch,
+        group: JobGroup,
+        ready: List[Tuple[str, DownloadResult]]
+) -> List[TrackedJob]:
+    """Создает записи о файлах и заявки всего пакета одним запросом"""
+    if not ready:
+        return []
+    try:
+        async with AsyncSessionLocal() as session:
+            db_requests = await RequestRepository.create_analysis_requests(
+                session=session,
+                user_id=batch.user_id,
+                files=[(download.path, download.size, download.sha256) for _, download in ready],
+                algorithm_name=batch.algorithm['name'],
+                region_id=get_default_region_id(application.bot_data),
+                username=batch.username
+            )
+    except Exception as e:
+        logger.error(f"Error creating batch requests in DB: {e}", exc_info=True)
+        for file_name, download in ready:
+            try:
+                os.remove(download.path)
+            except:
+                pass
+            await group.fail_item(application, file_name, "Ошибка базы данных")
+        return []
+
+    jobs = []
+    for (file_name, download), db_request in zip(ready, db_requests):
+        job = TrackedJob(
+            server_task_id='',
+            chat_id=batch.chat_id,
+            user_id=batch.user_id,
+            db_request_id=str(db_request.id),
+            file_path=download.path,
+            algorithm_name=batch.algorithm['name'],
+            algorithm_id=batch.algorithm['id'],
+            content_hash=download.sha256,
+            group=group,
+            file_size=download.size
+        )
+        group.names[job.db_request_id] = file_name
+        jobs.append(job)
+    return jobs
+
+
+async def _submit_item(
+        application: Application,
+        group: JobGroup,
+        job: TrackedJob,
+        semaphore: asyncio.Semaphore,
+        priority: bool = False
+) -> None:
+    """Запускает заявку пакета; результат из кэша учитывается в group сразу (см. _complete_from_cache)"""
+    async with semaphore:
+        if group.closed:
+            await _set_db_status(application.bot_data, job, 'CANCELLED')
+            _remove_source_file(job)
+            return
+        outcome, error = await _submit_job(application, job, priority=priority)
+    if outcome == 'cancelled':
+        _remove_source_file(job)
+    elif outcome == 'failed':
+        _remove_source_file(job)
+        await group.finish_item(application, job, f"Ошибка при запуске анализа: {error}")
+    elif outcome != 'cached':
+        await group.start_item(job)
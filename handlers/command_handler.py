@@ -47,8 +47,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user = await UserRepository.get_or_create_user(
                 session=session,
                 telegram_id=update.effective_user.id,
-                username=update.effective_user.username,
-                full_name=update.effective_user.full_name
+                username=update.effective_user.username
             )
             logger.info(f"User {user.telegram_id} ({user.username}) started the bot")
     except Exception as e:
@@ -77,22 +76,30 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1. Используйте кнопку 'Выбрать алгоритм' для начала работы\n"
         "2. Выберите нужный алгоритм из списка\n"
         "3. Загрузите файл с данными (поддерживаются форматы: .tif, .tiff, .geotiff, .jpg, .jpeg, .png)\n"
+        "   Несколько файлов можно отправить альбомом или командой /batch\n"
         "4. Дождитесь завершения анализа\n"
         "5. Получите результат в чате\n\n"
         "Команды:\n"
         "/start - начать работу\n"
         "/help - показать эту справку\n"
-        "/cancel - отменить текущую операцию"
+        "/cancel - отменить текущую операцию\n"
+        "/batch - пакетный режим: несколько файлов одним пакетом\n"
+        "/done - отправить собранный пакет в обработку"
     )
     
     await update.message.reply_text(help_text, reply_markup=get_main_keyboard())
 
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /cancel"""
+    """Обработчик команды /cancel: сбрасывает состояние и останавливает запущенные анализы"""
+    from handlers.file_handler import cancel_user_jobs
+    cancelled = await cancel_user_jobs(context.application, update.effective_user.id)
     context.user_data.clear()
+    text = "❌ Операция отменена."
+    if cancelled:
+        text += f"\nОстановлено анализов: {cancelled}."
     await update.message.reply_text(
-        "❌ Операция отменена.",
+        text,
         reply_markup=get_main_keyboard()
     )
 
@@ -1,13 +1,24 @@
-import os
 import asyncio
+import time
+import os
 import logging
-from telegram import Update
+from typing import Optional, Tuple
+from telegram import InputFile, Update
 from telegram.error import TelegramError, TimedOut, NetworkError
-from telegram.ext import ContextTypes
-from utils.file_validator import validate_file
-from server_client import AlgorithmServerClient
-from config import TELEGRAM_MAX_FILE_SIZE, USE_LOCAL_BOT_API
+from telegram.ext import Application, ContextTypes
+from server_client import get_shared_client
+from services.job_queue import get_shared_job_queue
+from services.job_scheduler import TrackedJob
+from services.region_cache import get_default_region_id
+from services.status_buffer import get_shared_status_buffer
+from services.submission_scheduler import get_shared_submission_scheduler
+from services.validation_pool import get_shared_validation_pool
+from utils.downloader import DownloadRejected, get_shared_downloader
+from utils.file_validator import check_file_name
+from utils.image_header import check_image_prefix
+from config import MAX_FILE_SIZE, TELEGRAM_MAX_FILE_SIZE, USE_LOCAL_BOT_API
 from handlers.command_handler import (
+    cancel_command,
     get_error_keyboard,
     get_main_keyboard,
     get_after_result_keyboard,
@@ -15,7 +26,7 @@ from handlers.command_handler import (
 )
 from database.db_session import AsyncSessionLocal
 # Импортируем обновленные репозитории
-from database.repository import UserRepository, RequestRepository, ResultRepository
+from database.repository import RequestRepository, ResultRepository, UserRepository
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +39,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if user_text == "❌ Отмена":
-        context.user_data.clear()
-        await update.message.reply_text(
-            "❌ Операция отменена.",
-            reply_markup=get_main_keyboard()
-        )
+        await cancel_command(update, context)
         return
 
     if context.user_data.get('state') != 'waiting_file':
@@ -107,14 +114,31 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         download_path = f"downloads/{update.effective_user.id}_{file_name}"
         os.makedirs('downloads', exist_ok=True)
 
-        logger.info(f"Starting file download: {file_name}, size: {file_size} bytes")
-        await file_obj.download_to_drive(download_path)
+        # Неподдерживаемое расширение отклоняем до скачивания
+        image_info = None
+        error_message = check_file_name(file_name)
+        if error_message is None:
+            logger.info(f"Starting file download: {file_name}, size: {file_size} bytes")
+            try:
+                # SHA-256 считается по ходу скачивания и служит ключом кэша результатов;
+                # размер и заголовок проверяются на лету, некорректный файл не скачивается целиком
+                download = await get_shared_downloader(context.bot_data).download(
+                    file_obj,
+                    download_path,
+                    max_size=MAX_FILE_SIZE,
+                    probe=check_image_prefix
+                )
+            except DownloadRejected as e:
+                error_message = str(e)
 
-        # Получаем реальный размер файла после скачивания
-        real_file_size = os.path.getsize(download_path)
-        is_valid, error_message = validate_file(download_path, real_file_size)
+        if error_message is None:
+            # Заголовки файла проверяются в пуле, не блокируя обработку обновлений других пользователей
+            image_info, error_message = await get_shared_validation_pool(context.bot_data).inspect(
+                download_path,
+                download.size
+            )
 
-        if not is_valid:
+        if image_info is None:
             error_text = f"❌ Ошибка проверки файла:\n{error_message}\n\nВыберите действие:"
             if processing_msg:
                 try:
@@ -128,7 +152,12 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['state'] = 'waiting_file'
             return
 
-        status_text = "✅ Файл проверен и готов к обработке.\n🚀 Запускаю анализ на сервере..."
+        logger.info(f"Validated {file_name}: {image_info}")
+        status_text = (
+            f"✅ Файл проверен и готов к обработке.\n"
+            f"🖼 {image_info.describe()}\n"
+            f"🚀 Запускаю анализ на сервере..."
+        )
         if processing_msg:
             try:
                 await processing_msg.edit_text(status_text)
@@ -142,20 +171,16 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         try:
             async with AsyncSessionLocal() as session:
-                # Гарантируем, что юзер есть
-                await UserRepository.get_or_create_user(
-                    session=session,
-                    telegram_id=user_id,
-                    username=update.effective_user.username
-                )
-
-                # Создаем заявку (AnalysisRequest) и запись о файле
+                # Пользователь, запись о файле и заявка создаются одним запросом в одной транзакции
                 db_request = await RequestRepository.create_analysis_request(
                     session=session,
                     user_id=user_id,
                     file_path=download_path,
-                    file_size=real_file_size,
-                    algorithm_name=algo_name
+                    file_size=download.size,
+                    algorithm_name=algo_name,
+                    content_hash=download.sha256,
+                    region_id=get_default_region_id(context.bot_data),
+                    username=update.effective_user.username
                 )
                 request_id = str(db_request.id)
                 logger.info(f"Created request in DB: {request_id}")
@@ -165,196 +190,563 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await processing_msg.edit_text("❌ Ошибка базы данных.", reply_markup=get_error_keyboard())
             return
 
-        # Работа с сервером алгоритмов
-        client = AlgorithmServerClient()
-        algorithm_id = context.user_data['selected_algorithm']['id']
-        success, server_task_id, error = await client.start_analysis(
-            algorithm_id,
-            download_path,
-            user_id
+        job = TrackedJob(
+            server_task_id='',
+            chat_id=update.effective_chat.id,
+            user_id=user_id,
+            db_request_id=request_id,
+            file_path=download_path,
+            algorithm_name=algo_name,
+            algorithm_id=context.user_data['selected_algorithm']['id'],
+            content_hash=download.sha256,
+            file_size=download.size
         )
 
-        if not success:
-            try:
-                async with AsyncSessionLocal() as session:
-                    await RequestRepository.update_status(
-                        session=session,
-                        request_id=request_id,
-                        status='ERROR'
-                    )
-            except Exception:
-                pass
-
-            error_text = f"❌ Ошибка при запуске анализа:\n{error}\n\nВыберите действие:"
-            if processing_msg:
-                try:
-                    await processing_msg.edit_text(error_text, reply_markup=get_error_keyboard())
-                except:
-                    pass
-            await client.close()
-            context.user_data['state'] = 'error'
-            return
-
-        # Обновляем статус на PROCESSING
-        try:
-            async with AsyncSessionLocal() as session:
-                await RequestRepository.update_status(
-                    session=session,
-                    request_id=request_id,
-                    status='PROCESSING'
-                )
-        except Exception:
-            pass
-
+        # Модераторы проходят на сервер алгоритмов вне очереди
+        priority = UserRepository.cached_role(user_id) == 'MODERATOR'
         context.user_data['db_request_id'] = request_id
-        context.user_data['server_task_id'] = server_task_id
         context.user_data['file_path'] = download_path
         context.user_data['state'] = 'processing'
+        # Ожидание места на сервере и загрузка идут вне обработчика, как у пакетов: заявка
+        # в очереди допуска не занимает обработку обновлений, и пользователь может ее отменить
+        _start_submission(context.application, job, processing_msg, priority)
 
-        success_text = f"✅ Анализ запущен!\n📋 ID заявки: {request_id}\n\n⏳ Ожидаю завершения анализа..."
+    except Exception as e:
+        logger.error(f"Unexpected error in handle_file: {e}", exc_info=True)
         if processing_msg:
             try:
-                await processing_msg.edit_text(success_text)
+                await processing_msg.edit_text("❌ Произошла непредвиденная ошибка.", reply_markup=get_error_keyboard())
             except:
                 pass
+        context.user_data['state'] = 'error'
 
-        await client.close()
-        asyncio.create_task(
-            monitor_task_status(update, context, server_task_id, download_path, request_id)
-        )
 
+def _format_duration(seconds: float) -> str:
+    """Ожидаемое время для пользователя: 'меньше минуты', '~12 мин', '~1.5 ч'"""
+    if seconds < 60:
+        return "меньше минуты"
+    if seconds < 90 * 60:
+        return f"~{round(seconds / 60)} мин"
+    return f"~{seconds / 3600:.1f} ч"
+
+
+def _start_submission(application: Application, job: TrackedJob, processing_msg, priority: bool) -> None:
+    """Запускает заявку в фоне; пока она не запущена, ее можно отменить (см. cancel_user_jobs)"""
+    task = application.create_task(_run_submission(application, job, processing_msg, priority))
+    _register_submission(application, job, task)
+
+
+def _register_submission(application: Application, job: TrackedJob, task: asyncio.Task) -> None:
+    """Запоминает задачу, которая запускает заявку, до ее завершения, чтобы /cancel мог ее прервать"""
+    submissions = application.bot_data.setdefault('pending_submissions', {})
+    user_submissions = submissions.setdefault(job.user_id, {})
+    user_submissions[task] = job
+
+    def forget(_task) -> None:
+        user_submissions.pop(task, None)
+        if not user_submissions and submissions.get(job.user_id) is user_submissions:
+            del submissions[job.user_id]
+
+    task.add_done_callback(forget)
+
+
+async def _run_submission(application: Application, job: TrackedJob, processing_msg, priority: bool) -> None:
+    """Запускает заявку одиночного файла и сообщает пользователю итог запуска"""
+    try:
+        outcome, error = await _submit_job(application, job, processing_msg, priority)
     except Exception as e:
-        logger.error(f"Unexpected error in handle_file: {e}", exc_info=True)
+        logger.error(f"Unexpected error submitting request {job.db_request_id}: {e}", exc_info=True)
+        await _set_db_status(application.bot_data, job, 'ERROR')
+        outcome, error = 'failed', None
+    if outcome == 'cached':
+        return
+
+    user_data = _waiting_user_data(application, job)
+    if outcome == 'failed':
+        if error is None:
+            error_text = "❌ Произошла непредвиденная ошибка."
+        else:
+            error_text = f"❌ Ошибка при запуске анализа:\n{error}\n\nВыберите действие:"
         if processing_msg:
             try:
-                await processing_msg.edit_text("❌ Произошла непредвиденная ошибка.", reply_markup=get_error_keyboard())
+                await processing_msg.edit_text(error_text, reply_markup=get_error_keyboard())
             except:
                 pass
-        context.user_data['state'] = 'error'
+        if user_data is not None:
+            user_data.pop('db_request_id', None)
+            user_data.pop('file_path', None)
+            user_data['state'] = 'error'
+            application.mark_data_for_update_persistence(user_ids=job.user_id)
+        return
+
+    if user_data is not None:
+        user_data['server_task_id'] = job.server_task_id
+        application.mark_data_for_update_persistence(user_ids=job.user_id)
+    if outcome == 'attached':
+        success_text = (
+            f"✅ Такой же анализ уже выполняется, результат придет вместе с ним.\n"
+            f"📋 ID заявки: {job.db_request_id}\n\n⏳ Ожидаю завершения анализа..."
+        )
+    else:
+        success_text = f"✅ Анализ запущен!\n📋 ID заявки: {job.db_request_id}\n\n⏳ Ожидаю завершения анализа..."
+    if job.expected_duration is not None:
+        remaining = job.expected_duration - (time.time() - job.submitted_at)
+        success_text += f"\n⏱ Ожидаемое время: {_format_duration(remaining)}"
+    if processing_msg:
+        try:
+            await processing_msg.edit_text(success_text)
+        except:
+            pass
+
+
+# Маппинг статусов сервера на статусы БД
+# server: processing, completed, failed, cancelled, queued
+# db: PENDING, PROCESSING, COMPLETED, ERROR, CANCELLED
+SERVER_TO_DB_STATUS = {
+    'processing': 'PROCESSING',
+    'completed': 'COMPLETED',
+    'failed': 'ERROR',
+    'cancelled': 'CANCELLED',
+    'queued': 'PENDING'
+}
+
+
+async def _submit_job(
+        application: Application,
+        job: TrackedJob,
+        processing_msg=None,
+        priority: bool = False
+) -> Tuple[str, Optional[str]]:
+    """
+    Запускает заявку: готовым результатом из кэша, присоединением к такой же
+    выполняющейся задаче или новой задачей на сервере алгоритмов
+
+    Новая задача ждет места на сервере (см. SubmissionScheduler); пока заявка
+    в очереди, в processing_msg показывается ее позиция.
+
+    Returns:
+        Tuple[str, Optional[str]]: (исход: 'cached', 'attached', 'started', 'failed' или 'cancelled' -
+            пакет заявки отменен до ее запуска, сообщение об ошибке если есть)
+    """
+    cache = application.bot_data.get('result_cache')
+    cache_key = (job.content_hash, job.algorithm_id)
+    scheduler = application.bot_data['job_scheduler']
+
+    # Этот файл уже анализировали этим алгоритмом - отдаем результат из кэша
+    if cache:
+        entry = await cache.lookup(*cache_key)
+        if entry is not None:
+            await _complete_from_cache(application, job, entry, processing_msg)
+            return 'cached', None
+
+    # Такая же задача уже запускается или выполняется - ждем ее результата
+    leader = True
+    if cache:
+        pending = cache.claim(cache_key)
+        if pending is not None:
+            leader = False
+            job.server_task_id = await pending or ''
+            if job.server_task_id and scheduler.attach(job.server_task_id, job):
+                await _set_db_status(application.bot_data, job, 'PROCESSING')
+                await _persist_job(application, job)
+                return 'attached', None
+            # Задача уже завершилась - запускаем свою
+            job.server_task_id = ''
+
+    async def report_position(position: int) -> None:
+        await processing_msg.edit_text(
+            f"⏳ Сервер алгоритмов загружен, заявка ждет в очереди.\n"
+            f"📍 Позиция в очереди: {position}"
+        )
+
+    # Работа с сервером алгоритмов
+    admission = get_shared_submission_scheduler(application.bot_data)
+    client = get_shared_client(application.bot_data)
+    acquired = False
+    success = False
+    cancelled = False
+    error = None
+    try:
+        await admission.acquire(
+            job.user_id,
+            job.algorithm_id,
+            priority=priority,
+            on_position=report_position if processing_msg and job.group is None else None
+        )
+        acquired = True
+        # Пакет могли отменить, пока заявка ждала места на сервере
+        cancelled = job.group is not None and job.group.closed
+        if not cancelled:
+            success, server_task_id, error = await client.start_analysis(
+                job.algorithm_id,
+                job.file_path,
+                job.user_id
+            )
+            if success and job.group is not None and job.group.closed:
+                # ...или пока загружался файл: задача на сервере уже не нужна
+                stopped, cancel_error = await client.cancel_task(server_task_id)
+                if not stopped:
+                    logger.warning(f"Failed to cancel task {server_task_id} on server: {cancel_error}")
+                success = False
+                cancelled = True
+        if success:
+            job.server_task_id = server_task_id
+            # Таймаут отсчитывается от запуска, а не от ожидания в очереди допуска
+            job.submitted_at = time.time()
+            # Место на сервере занято до завершения задачи (см. on_job_finished)
+            admission.bind(server_task_id, job.algorithm_id)
+            # Статус задачи отслеживает общий планировщик (см. on_job_status_change/on_job_finished).
+            # Регистрируем до publish, чтобы ожидающие заявки могли присоединиться к задаче
+            scheduler.track(job)
+    finally:
+        if acquired and not success:
+            admission.release(job.algorithm_id)
+        if cache and leader:
+            cache.publish(cache_key, job.server_task_id if success else None)
+
+    if cancelled:
+        await _set_db_status(application.bot_data, job, 'CANCELLED')
+        return 'cancelled', None
+    if not success:
+        await _set_db_status(application.bot_data, job, 'ERROR')
+        return 'failed', error
+
+    # Обновляем статус на PROCESSING
+    await _set_db_status(application.bot_data, job, 'PROCESSING')
+    await _persist_job(application, job)
+    return 'started', None
+
+
+async def _persist_job(application: Application, job: TrackedJob) -> None:
+    """Сохраняет задачу в очереди в БД, чтобы ее опрос продолжился после перезапуска бота"""
+    queue = get_shared_job_queue(application.bot_data)
+    if queue:
+        await queue.enqueue(job)
+
+
+def _waiting_user_data(application: Application, job: TrackedJob) -> Optional[dict]:
+    """Состояние пользователя, если он все еще ждет именно эту заявку (None - уже нет)"""
+    user_data = application.user_data.get(job.user_id)
+    if user_data is not None and user_data.get('db_request_id') == job.db_request_id:
+        return user_data
+    return None
+
+
+def _release_user_state(application: Application, job: TrackedJob) -> None:
+    """Сбрасывает состояние пользователя, если он все еще ждет именно эту заявку"""
+    user_data = _waiting_user_data(application, job)
+    if user_data is not None:
+        user_data.clear()
+        application.mark_data_for_update_persistence(user_ids=job.user_id)
+
+
+async def _set_db_status(bot_data: dict, job: TrackedJob, status: str) -> None:
+    """Обновляет статус заявки через общий буфер (запись в БД пачками)"""
+    if not job.db_request_id:
+        return
+    try:
+        await get_shared_status_buffer(bot_data).update(job.db_request_id, status)
+    except Exception as e:
+        logger.error(f"Error updating DB status: {e}")
+
+
+async def _save_result(bot_data: dict, job: TrackedJob, meta: dict):
+    """Отмечает заявку выполненной и сохраняет метаданные результата"""
+    if not job.db_request_id:
+        return None
+    # Итоговый статус записывается сразу вместе с накопленными в буфере
+    await _set_db_status(bot_data, job, 'COMPLETED')
+    try:
+        async with AsyncSessionLocal() as session:
+            return await ResultRepository.create_result(
+                session=session,
+                request_id=job.db_request_id,
+                metadata=meta
+            )
+    except Exception as e:
+        logger.error(f"Error saving result to DB: {e}", exc_info=True)
+        return None
 
 
-async def monitor_task_status(
-        update: Update,
-        context: ContextTypes.DEFAULT_TYPE,
-        server_task_id: str,
-        file_path: str,
-        db_request_id: str = None
+def _remove_source_file(job: TrackedJob) -> None:
+    try:
+        os.remove(job.file_path)
+    except:
+        pass
+
+
+async def _send_result_document(
+        application: Application,
+        job: TrackedJob,
+        content: bytes = None,
+        path: str = None,
+        filename: str = None,
+        telegram_file_id: str = None
 ):
-    client = AlgorithmServerClient()
-    max_attempts = 60
-    attempt = 0
+    """
+    Отправляет результат: по file_id (без повторной загрузки), из памяти или потоком из файла
+
+    Returns:
+        file_id отправленного документа
+    """
+    caption = f"📊 Результат анализа\nАлгоритм: {job.algorithm_name or 'N/A'}"
+    if job.group is not None:
+        caption += f"\nФайл: {job.group.file_name(job)}"
+    if telegram_file_id:
+        try:
+            await application.bot.send_document(job.chat_id, document=telegram_file_id, caption=caption)
+            return telegram_file_id
+        except TelegramError as e:
+            logger.warning(f"Failed to resend result by file_id, uploading file: {e}")
+
+    handle = None
     try:
-        while attempt < max_attempts:
-            await asyncio.sleep(5)
-            status, error = await client.check_status(server_task_id)
-            attempt += 1
-
-            # Маппинг статусов сервера на статусы БД
-            # server: processing, completed, failed, queued
-            # db: PENDING, PROCESSING, COMPLETED, ERROR
-            if db_request_id and status:
-                try:
-                    async with AsyncSessionLocal() as session:
-                        status_map = {
-                            'processing': 'PROCESSING',
-                            'completed': 'COMPLETED',
-                            'failed': 'ERROR',
-                            'queued': 'PENDING'
-                        }
-                        db_status = status_map.get(status, 'PROCESSING')
-                        # Не обновляем статус каждый раз, если он не меняется, чтобы не спамить БД,
-                        # но в MVP можно оставить простой update
-                        await RequestRepository.update_status(
-                            session=session,
-                            request_id=db_request_id,
-                            status=db_status
-                        )
-                except Exception as e:
-                    logger.error(f"Error updating DB status: {e}")
+        if content is not None:
+            document = InputFile(content, filename=filename)
+        else:
+            handle = open(path, 'rb')
+            document = InputFile(handle, filename=filename, read_file_handle=False)
+        message = await application.bot.send_document(job.chat_id, document=document, caption=caption)
+    finally:
+        if handle:
+            handle.close()
+    return message.document.file_id if message.document else None
 
-            if error:
-                try:
-                    await update.message.reply_text(
-                        f"❌ Ошибка при проверке статуса:\n{error}\n\nВыберите действие:",
-                        reply_markup=get_error_keyboard()
-                    )
-                except:
-                    pass
-                if db_request_id:
-                    async with AsyncSessionLocal() as session:
-                        await RequestRepository.update_status(session, db_request_id, 'ERROR')
-                context.user_data.clear()
-                break
-
-            if status == 'completed':
-                await update.message.reply_text("✅ Анализ завершен! Получаю результат...")
-                success, result_path, error = await client.get_result(server_task_id)
-
-                if success:
-                    # 1. Сохраняем результат в БД
-                    if db_request_id:
-                        try:
-                            async with AsyncSessionLocal() as session:
-                                await RequestRepository.update_status(session, db_request_id, 'COMPLETED')
-                                # Создаем метаданные для примера
-                                meta = {
-                                    "status": "success",
-                                    "file_generated": result_path,
-                                    "algorithm": context.user_data.get('selected_algorithm', {}).get('name')
-                                }
-                                await ResultRepository.create_result(
-                                    session=session,
-                                    request_id=db_request_id,
-                                    metadata=meta
-                                )
-                        except Exception as e:
-                            logger.error(f"Error saving result to DB: {e}", exc_info=True)
-
-                    # 2. Отправляем файл пользователю
-                    try:
-                        with open(result_path, 'rb') as result_file:
-                            await update.message.reply_document(
-                                document=result_file,
-                                caption=f"📊 Результат анализа\nАлгоритм: {context.user_data.get('selected_algorithm', {}).get('name', 'N/A')}"
-                            )
-                        await update.message.reply_text("✅ Результат успешно отправлен!",
-                                                        reply_markup=get_after_result_keyboard())
-
-                        # Чистим файлы
-                        try:
-                            os.remove(file_path)
-                            os.remove(result_path)
-                        except:
-                            pass
-
-                    except Exception as e:
-                        logger.error(f"Error sending file: {e}")
-                        await update.message.reply_text("❌ Ошибка отправки файла.", reply_markup=get_error_keyboard())
-                else:
-                    await update.message.reply_text(f"❌ Не удалось скачать результат: {error}",
-                                                    reply_markup=get_error_keyboard())
-                    if db_request_id:
-                        async with AsyncSessionLocal() as session:
-                            await RequestRepository.update_status(session, db_request_id, 'ERROR')
-
-                context.user_data.clear()
-                break
-
-            elif status == 'failed':
-                await update.message.reply_text("❌ Анализ завершился с ошибкой на сервере.",
-                                                reply_markup=get_error_keyboard())
-                context.user_data.clear()
-                break
-
-            if attempt >= max_attempts:
-                await update.message.reply_text("⏱️ Время ожидания истекло.", reply_markup=get_error_keyboard())
-                if db_request_id:
-                    async with AsyncSessionLocal() as session:
-                        await RequestRepository.update_status(session, db_request_id, 'ERROR')
-                context.user_data.clear()
-                break
 
+async def _notify(application: Application, job: TrackedJob, text: str, reply_markup=None) -> None:
+    """Отправляет сообщение о заявке; по заявкам пакета пишется только общий прогресс пакета"""
+    if job.group is not None:
+        return
+    try:
+        await application.bot.send_message(job.chat_id, text, reply_markup=reply_markup)
+    except TelegramError as e:
+        logger.warning(f"Failed to notify chat {job.chat_id}: {e}")
+
+
+async def _complete_from_cache(application: Application, job: TrackedJob, entry, processing_msg) -> None:
+    """Завершает заявку готовым результатом из кэша, не обращаясь к серверу алгоритмов"""
+    cache = application.bot_data['result_cache']
+    logger.info(f"Result cache hit for request {job.db_request_id}")
+    if processing_msg and job.group is None:
+        try:
+            await processing_msg.edit_text("✅ Этот файл уже анализировался этим алгоритмом. Отправляю готовый результат...")
+        except:
+            pass
+
+    await _save_result(application.bot_data, job, {
+        "status": "success",
+        "cached": True,
+        "file_generated": entry.file_name,
+        "file_size": entry.file_size,
+        "algorithm": job.algorithm_name
+    })
+    error = None
+    try:
+        file_id = await _send_result_document(
+            application,
+            job,
+            path=entry.file_path,
+            filename=entry.file_name,
+            telegram_file_id=entry.telegram_file_id
+        )
+        if file_id and file_id != entry.telegram_file_id:
+            await cache.remember_file_id(job.content_hash, job.algorithm_id, file_id)
+        await _notify(application, job, "✅ Результат успешно отправлен!", get_after_result_keyboard())
     except Exception as e:
-        logger.error(f"Error in monitor: {e}", exc_info=True)
+        logger.error(f"Error sending cached result: {e}")
+        error = "Ошибка отправки файла"
+        await _notify(application, job, "❌ Ошибка отправки файла.", get_error_keyboard())
+    _remove_source_file(job)
+    if job.group is not None:
+        await job.group.finish_item(application, job, error)
+        return
+    _release_user_state(application, job)
+
+
+async def on_job_status_change(application: Application, job: TrackedJob, status: str) -> None:
+    """Вызывается планировщиком, когда статус незавершенной задачи изменился"""
+    db_status = SERVER_TO_DB_STATUS.get(status, 'PROCESSING')
+    for recipient in [job] + job.followers:
+        await _set_db_status(application.bot_data, recipient, db_status)
+
+
+async def on_job_finished(
+        application: Application,
+        job: TrackedJob,
+        status: str,
+        error: str = None
+):
+    """
+    Вызывается планировщиком, когда задача завершилась, упала или истекло время ожидания
+
+    Результат получается один раз и отправляется всем заявкам, объединенным с задачей,
+    затем кладется в кэш результатов.
+    """
+    client = get_shared_client(application.bot_data)
+    cache = application.bot_data.get('result_cache')
+    recipients = [job] + job.followers
+    result = None
+    # Получатели, которым отправлен результат, и причина ошибки для остальных (для итога пакетов)
+    delivered = set()
+    failure = "Анализ не завершен"
+    try:
+        if error or status in ('timeout', 'failed', 'cancelled'):
+            db_status = 'ERROR'
+            if error:
+                text = f"❌ Ошибка при проверке статуса:\n{error}\n\nВыберите действие:"
+                failure = f"Ошибка при проверке статуса: {error}"
+            elif status == 'timeout':
+                text = "⏱️ Время ожидания истекло."
+                failure = "Время ожидания истекло"
+            elif status == 'cancelled':
+                text = "❌ Анализ отменен на сервере."
+                failure = "Анализ отменен на сервере"
+                db_status = 'CANCELLED'
+            else:
+                text = "❌ Анализ завершился с ошибкой на сервере."
+                failure = "Анализ завершился с ошибкой на сервере"
+            for recipient in recipients:
+                await _notify(application, recipient, text, get_error_keyboard())
+                await _set_db_status(application.bot_data, recipient, db_status)
+            return
+
+        for recipient in recipients:
+            await _notify(application, recipient, "✅ Анализ завершен! Получаю результат...")
+        success, result, error = await client.get_result(job.server_task_id)
+
+        if not success:
+            failure = f"Не удалось скачать результат: {error}"
+            for recipient in recipients:
+                await _notify(application, recipient, f"❌ Не удалось скачать результат: {error}",
+                              get_error_keyboard())
+                await _set_db_status(application.bot_data, recipient, 'ERROR')
+            return
+
+        # 1. Сохраняем результат в БД
+        result_ids = []
+        for recipient in recipients:
+            # Создаем метаданные для примера
+            db_result = await _save_result(application.bot_data, recipient, {
+                "status": "success",
+                "file_generated": result.filename,
+                "file_size": result.size,
+                "algorithm": recipient.algorithm_name
+            })
+            result_ids.append(str(db_result.id) if db_result else None)
+
+        # 2. Кладем результат в кэш: большой файл перемещается в каталог кэша
+        path = result.path
+        if cache and job.content_hash and job.algorithm_id:
+            cache_path = await cache.store(job.content_hash, job.algorithm_id, job.db_request_id, result_ids[0], result)
+            path = cache_path or result.path
+
+        # 3. Отправляем файл пользователям: небольшой результат - из памяти,
+        # большой - потоком из файла; остальным получателям - по file_id первой отправки
+        file_id = None
+        failure = "Ошибка отправки файла"
+        for recipient in recipients:
+            try:
+                file_id = await _send_result_document(
+                    application,
+                    recipient,
+                    content=result.content,
+                    path=path,
+                    filename=result.filename,
+                    telegram_file_id=file_id
+                )
+                delivered.add(id(recipient))
+                await _notify(application, recipient, "✅ Результат успешно отправлен!",
+                              get_after_result_keyboard())
+                # Чистим исходный файл
+                _remove_source_file(recipient)
+            except Exception as e:
+                logger.error(f"Error sending file: {e}")
+                await _notify(application, recipient, "❌ Ошибка отправки файла.", get_error_keyboard())
+        if cache and file_id and job.content_hash and job.algorithm_id:
+            await cache.remember_file_id(job.content_hash, job.algorithm_id, file_id)
     finally:
-        await client.close()
\ No newline at end of file
+        if result is not None:
+            result.discard()
+        if cache and job.content_hash and job.algorithm_id:
+            cache.release((job.content_hash, job.algorithm_id), job.server_task_id)
+        get_shared_submission_scheduler(application.bot_data).finish(job.server_task_id)
+        queue = get_shared_job_queue(application.bot_data)
+        if queue:
+            await queue.complete(recipients)
+        for recipient in recipients:
+            if recipient.group is not None:
+                await recipient.group.finish_item(
+                    application,
+                    recipient,
+                    None if id(recipient) in delivered else failure
+                )
+            else:
+                _release_user_state(application, recipient)
+
+
+async def cancel_user_jobs(application: Application, user_id: int) -> int:
+    """
+    Отменяет анализы пользователя, результата которых он ждет
+
+    Заявки, которые еще ждут места на сервере алгоритмов, снимаются с
+    очереди, запущенные перестают опрашиваться; все они получают статус
+    CANCELLED, загруженные файлы удаляются. Задача на сервере алгоритмов
+    отменяется, если ее результата не ждут заявки других пользователей
+    (см. JobStatusScheduler.detach).
+
+    Returns:
+        Число отмененных заявок
+    """
+    bot_data = application.bot_data
+    user_data = application.user_data.get(user_id)
+    group = user_data.get('batch_group') if user_data is not None else None
+    if group is not None:
+        # Файлы пакета, которые еще не запущены, больше не скачиваются и не запускаются
+        await group.cancel()
+
+    cancelled = []
+    # Заявки, которые ждут места на сервере алгоритмов или загружаются на него
+    # (копия: завершившиеся задачи сами удаляют себя из словаря)
+    submissions = dict(bot_data.get('pending_submissions', {}).pop(user_id, {}))
+    for task in submissions:
+        task.cancel()
+    await asyncio.gather(*submissions, return_exceptions=True)
+    for task, job in submissions.items():
+        # Задача, запущенная до отмены, уже в планировщике и отменяется ниже
+        if task.cancelled() and not job.server_task_id:
+            cancelled.append(job)
+
+    scheduler = bot_data.get('job_scheduler')
+    orphaned = []
+    for job in scheduler.jobs() if scheduler is not None else ():
+        for recipient in [job] + job.followers:
+            if recipient.user_id != user_id:
+                continue
+            detached, untracked = scheduler.detach(recipient.server_task_id, recipient.db_request_id)
+            if detached is None:
+                continue
+            cancelled.append(detached)
+            if untracked:
+                orphaned.append(detached)
+
+    if orphaned:
+        client = get_shared_client(bot_data)
+        results = await asyncio.gather(*(client.cancel_task(job.server_task_id) for job in orphaned))
+        cache = bot_data.get('result_cache')
+        admission = get_shared_submission_scheduler(bot_data)
+        for job, (stopped, error) in zip(orphaned, results):
+            if not stopped:
+                logger.warning(f"Failed to cancel task {job.server_task_id} on server: {error}")
+            admission.finish(job.server_task_id)
+            if cache and job.content_hash and job.algorithm_id:
+                cache.release((job.content_hash, job.algorithm_id), job.server_task_id)
+
+    for job in cancelled:
+        await _set_db_status(bot_data, job, 'CANCELLED')
+        _remove_source_file(job)
+    queue = get_shared_job_queue(bot_data)
+    if queue:
+        await queue.complete(cancelled)
+    if cancelled:
+        logger.info(f"Cancelled {len(cancelled)} requests of user {user_id} ({len(orphaned)} server tasks)")
+    return len(cancelled)
@@ -3,6 +3,7 @@
 """
 import asyncio
 import logging
+from functools import partial
 import sys
 import selectors
 from telegram import Update
@@ -11,6 +12,7 @@ from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
@@ -18,7 +20,34 @@ from telegram.ext import (
 # Устанавливаем SelectorEventLoop для Windows (требуется для psycopg)
 if sys.platform == 'winчё32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-from config import BOT_TOKEN, AVAILABLE_ALGORITHMS, LOCAL_BOT_API_URL, USE_LOCAL_BOT_API, TELEGRAM_MAX_FILE_SIZE
+from config import (
+    BOT_TOKEN,
+    AVAILABLE_ALGORITHMS,
+    LOCAL_BOT_API_URL,
+    USE_LOCAL_BOT_API,
+    LOCAL_BOT_API_LOCAL_MODE,
+    TELEGRAM_MAX_FILE_SIZE,
+    MAX_CONCURRENT_UPDATES,
+    RESULT_CACHE_ENABLED,
+    CALLBACK_ENABLED,
+    CALLBACK_URL,
+    CALLBACK_URL_TEMPLATE,
+    CALLBACK_TOKEN,
+    CALLBACK_SAFETY_POLL_INTERVAL,
+    BOT_UPDATE_MODE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    BOT_WORKERS,
+    BOT_SHARD,
+    SHARD_HOST,
+    SHARD_BASE_PORT,
+    SHARD_WORKER_URLS,
+    PERSISTENCE_ENABLED
+)
 from handlers.command_handler import (
     start_command,
     help_command,
@@ -27,8 +56,23 @@ from handlers.command_handler import (
     get_main_keyboard
 )
 from handlers.algorithm_handler import handle_algorithm_selection
-from handlers.file_handler import handle_file
+from handlers.file_handler import handle_file, on_job_status_change, on_job_finished
+from handlers.batch_handler import handle_upload, batch_command, done_command
 from database.db_session import init_db, close_db, AsyncSessionLocal
+from utils.update_processor import PerUserUpdateProcessor
+from server_client import AlgorithmServerClient
+from services.callback_server import CallbackServer
+from services.db_persistence import DatabasePersistence
+from services.duration_stats import DurationStats
+from services.job_queue import DurableJobQueue
+from services.job_scheduler import JobStatusScheduler
+from services.region_cache import RegionCache
+from services.result_cache import ResultCache
+from services.sharding import UpdateForwarder, WorkerPool, run_worker
+from services.status_buffer import StatusUpdateBuffer
+from services.submission_scheduler import SubmissionScheduler
+from services.validation_pool import ValidationPool
+from utils.downloader import TelegramFileDownloader
 
 # Настройка логирования
 logging.basicConfig(
@@ -133,6 +177,11 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
                 logger.error(f"Failed to send error message: {e}")
 
 
+# Бот обрабатывает только сообщения (команды, текст кнопок, файлы и фото) -
+# остальные типы обновлений Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+
 def check_local_server_sync(url: str) -> bool:
     """Проверяет доступность локального сервера Bot API (синхронно)"""
     try:
@@ -149,11 +198,70 @@ def check_local_server_sync(url: str) -> bool:
         return False
 
 
+def run_updates(application: Application) -> None:
+    """Получает обновления от Telegram: long polling или webhook (BOT_UPDATE_MODE)"""
+    if BOT_UPDATE_MODE == 'webhook':
+        # Встроенный HTTP-сервер принимает обновления от Telegram; запросы без секретного
+        # токена отклоняются. setWebhook с теми же параметрами от каждой реплики ничего не меняет
+        logger.info(f"Бот запущен (webhook): {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} <- {WEBHOOK_URL}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    else:
+        logger.info("Бот запущен...")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+
+def run_front(application: Application) -> None:
+    """
+    Процесс-фронт: получает обновления и пересылает каждое рабочему процессу
+    его пользователя (см. services/sharding.py). Без SHARD_WORKER_URLS
+    рабочие процессы запускаются здесь же.
+    """
+    pool = None if SHARD_WORKER_URLS else WorkerPool(BOT_WORKERS)
+    forwarder = UpdateForwarder(SHARD_WORKER_URLS or pool.urls)
+    application.add_handler(TypeHandler(Update, forwarder.forward))
+
+    async def post_init(app: Application) -> None:
+        await forwarder.start()
+        if pool:
+            await pool.start()
+
+    # Рабочие процессы останавливаются после того, как фронт переслал последние обновления
+    async def post_stop(app: Application) -> None:
+        await forwarder.stop()
+        logger.info(f"Статистика пересылки обновлений: {forwarder.stats()}")
+        if pool:
+            await pool.stop()
+            logger.info(f"Перезапусков рабочих процессов: {pool.restarts}")
+
+    application.post_init = post_init
+    application.post_stop = post_stop
+    logger.info(f"Фронт: обновления распределяются между {len(forwarder.worker_urls)} рабочими процессами")
+    run_updates(application)
+
+
 def main():
     """Запуск бота"""
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN не установлен! Создайте файл token.env и добавьте BOT_TOKEN=ваш_токен")
         return
+    if BOT_UPDATE_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("BOT_UPDATE_MODE=webhook требует WEBHOOK_URL - внешний адрес, на который Telegram присылает обновления")
+        return
+    if BOT_SHARD is not None and not 0 <= BOT_SHARD < BOT_WORKERS:
+        logger.error("BOT_SHARD должен быть от 0 до BOT_WORKERS-1: задайте в BOT_WORKERS общее число рабочих процессов")
+        return
+    if CALLBACK_ENABLED and BOT_WORKERS > 1 and not SHARD_WORKER_URLS and '{port}' not in CALLBACK_URL_TEMPLATE:
+        # Рабочие процессы слушают CALLBACK_PORT+i, а один адрес отправил бы все уведомления одному из них
+        logger.error("При BOT_WORKERS > 1 CALLBACK_URL должен содержать {port}, например http://bot-host:{port}/api/callback")
+        return
     
     # Если используется локальный сервер Bot API, проверяем его доступность
     if USE_LOCAL_BOT_API:
@@ -181,25 +289,47 @@ def main():
         logger.info(f"✅ Используется локальный сервер Bot API: {LOCAL_BOT_API_URL}")
         # Устанавливаем базовый URL для локального сервера
         builder = builder.base_url(f"{LOCAL_BOT_API_URL}/bot")
+        builder = builder.base_file_url(f"{LOCAL_BOT_API_URL}/file/bot")
+        if LOCAL_BOT_API_LOCAL_MODE:
+            # Файлы берутся прямо с диска сервера Bot API, без скачивания по HTTP
+            builder = builder.local_mode(True)
         logger.info(f"Максимальный размер файла: {TELEGRAM_MAX_FILE_SIZE / (1024*1024):.0f} МБ")
     else:
         logger.info("Используется официальный Telegram Bot API")
         logger.info(f"Максимальный размер файла: {TELEGRAM_MAX_FILE_SIZE / (1024*1024):.0f} МБ")
     
+    # Параллельная обработка: долгая загрузка одного пользователя не блокирует остальных
+    if MAX_CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        logger.info(f"Параллельная обработка обновлений: до {MAX_CONCURRENT_UPDATES} одновременно")
+    
+    # Несколько рабочих процессов: этот процесс только пересылает им обновления
+    if (BOT_WORKERS > 1 or SHARD_WORKER_URLS) and BOT_SHARD is None:
+        run_front(builder.build())
+        return
+    # Рабочий процесс получает обновления от фронта, а не от Telegram
+    if BOT_SHARD is not None:
+        builder = builder.updater(None)
+    # Состояние диалога хранится в БД: переживает перезапуск и переход пользователя в другой процесс
+    if PERSISTENCE_ENABLED:
+        builder = builder.persistence(DatabasePersistence())
+    
     application = builder.build()
     
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("batch", batch_command))
+    application.add_handler(CommandHandler("done", done_command))
     
     # Обработчик текстовых сообщений
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     
-    # Обработчик файлов (документы и фото)
+    # Обработчик файлов (документы и фото); альбомы и файлы после /batch собираются в пакет
     application.add_handler(MessageHandler(
         filters.Document.ALL | filters.PHOTO,
-        handle_file
+        handle_upload
     ))
     
     # Регистрируем обработчик ошибок
@@ -208,6 +338,47 @@ def main():
     # Инициализируем базу данных при запуске
     async def post_init(app: Application) -> None:
         """Инициализация после создания приложения"""
+        # Общий клиент сервера алгоритмов с пулом соединений для всех обработчиков
+        client = AlgorithmServerClient()
+        app.bot_data['server_client'] = client
+        app.bot_data['file_downloader'] = TelegramFileDownloader()
+        app.bot_data['validation_pool'] = ValidationPool()
+        # Статусы заявок пишутся в БД пачками
+        status_buffer = StatusUpdateBuffer()
+        app.bot_data['status_buffer'] = status_buffer
+        status_buffer.start()
+        if RESULT_CACHE_ENABLED:
+            app.bot_data['result_cache'] = ResultCache()
+        # Ограничение числа задач на сервере алгоритмов и очередь заявок сверх него
+        admission = SubmissionScheduler()
+        app.bot_data['submission_scheduler'] = admission
+        admission.start()
+        # Статистика длительности анализа: по ней выбираются моменты опроса и таймаут задачи
+        duration_stats = DurationStats()
+        app.bot_data['duration_stats'] = duration_stats
+        # Один планировщик опрашивает статусы всех задач в работе
+        scheduler = JobStatusScheduler(
+            client,
+            on_status_change=partial(on_job_status_change, app),
+            on_finished=partial(on_job_finished, app),
+            estimator=duration_stats.estimate_job
+        )
+        app.bot_data['job_scheduler'] = scheduler
+        scheduler.start()
+        # Сервер алгоритмов сам сообщает о завершении задач, опрос остается страховочным
+        if CALLBACK_ENABLED:
+            if client.simulate:
+                logger.warning("CALLBACK_ENABLED не действует в режиме симуляции сервера алгоритмов")
+            else:
+                callback_server = CallbackServer(scheduler)
+                try:
+                    await callback_server.start()
+                    app.bot_data['callback_server'] = callback_server
+                    client.callback_url = CALLBACK_URL
+                    client.callback_token = CALLBACK_TOKEN
+                    scheduler.push_interval = CALLBACK_SAFETY_POLL_INTERVAL
+                except OSError as e:
+                    logger.error(f"❌ Не удалось запустить эндпоинт уведомлений, статусы будут опрашиваться: {e}")
         try:
             # Небольшая задержка для стабильности подключения
             import asyncio
@@ -218,13 +389,75 @@ def main():
             logger.error(f"❌ Ошибка инициализации БД: {e}", exc_info=True)
             logger.warning("Бот продолжит работу без БД")
             logger.info("Проверьте параметры подключения в token.env и убедитесь, что PostgreSQL запущен")
+        duration_stats.start()
+        # Задачи в работе хранятся в БД: опрос задач, запущенных до перезапуска, продолжается
+        job_queue = DurableJobQueue(scheduler, admission)
+        app.bot_data['job_queue'] = job_queue
+        job_queue.start()
+        # Регион по умолчанию перечитывается в фоне, а не при каждой заявке
+        region_cache = RegionCache()
+        app.bot_data['region_cache'] = region_cache
+        region_cache.start()
+        if isinstance(app.persistence, DatabasePersistence):
+            app.persistence.start(app)
     
     # Регистрируем функцию инициализации
     application.post_init = post_init
     
+    # Останавливаем планировщик до закрытия бота, чтобы успеть отправить готовые результаты
+    async def post_stop(app: Application) -> None:
+        """Остановка фоновых сервисов"""
+        callback_server = app.bot_data.get('callback_server')
+        if callback_server:
+            await callback_server.stop()
+            logger.info(f"Статистика уведомлений сервера алгоритмов: {callback_server.stats()}")
+        scheduler = app.bot_data.get('job_scheduler')
+        if scheduler:
+            logger.info(f"Остановка планировщика задач: {scheduler.stats()}")
+            await scheduler.stop()
+        # Задачи, которые не успели завершиться, отпускаются для следующего запуска
+        job_queue = app.bot_data.get('job_queue')
+        if job_queue:
+            logger.info(f"Остановка очереди задач: {job_queue.stats()}")
+            await job_queue.stop()
+        region_cache = app.bot_data.get('region_cache')
+        if region_cache:
+            await region_cache.stop()
+        duration_stats = app.bot_data.get('duration_stats')
+        if duration_stats:
+            await duration_stats.stop()
+            logger.info(f"Статистика длительности анализа: {duration_stats.stats()}")
+        if isinstance(app.persistence, DatabasePersistence):
+            await app.persistence.stop()
+        admission = app.bot_data.get('submission_scheduler')
+        if admission:
+            await admission.stop()
+            logger.info(f"Статистика допуска задач на сервер алгоритмов: {admission.stats()}")
+        # Буфер останавливается последним, чтобы записать статусы, обновленные при остановке
+        status_buffer = app.bot_data.get('status_buffer')
+        if status_buffer:
+            await status_buffer.stop()
+            logger.info(f"Статистика записи статусов заявок: {status_buffer.stats()}")
+    
+    application.post_stop = post_stop
+    
     # Функция для закрытия БД при завершении
     async def post_shutdown(app: Application) -> None:
         """Закрытие соединений при завершении"""
+        client = app.bot_data.pop('server_client', None)
+        if client:
+            logger.info(f"Статистика пула соединений с сервером алгоритмов: {client.pool_stats()}")
+            await client.close()
+        downloader = app.bot_data.pop('file_downloader', None)
+        if downloader:
+            await downloader.close()
+        validation_pool = app.bot_data.pop('validation_pool', None)
+        if validation_pool:
+            logger.info(f"Статистика проверки файлов: {validation_pool.stats()}")
+            validation_pool.shutdown()
+        # Последние изменения состояния пользователей записаны при остановке приложения (flush)
+        if isinstance(app.persistence, DatabasePersistence):
+            logger.info(f"Статистика хранения состояния пользователей: {app.persistence.stats()}")
         try:
             await close_db()
             logger.info("Соединение с БД закрыто")
@@ -234,8 +467,14 @@ def main():
     application.post_shutdown = post_shutdown
     
     # Запускаем бота
-    logger.info("Бот запущен...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_SHARD is not None:
+        logger.info(f"Рабочий процесс {BOT_SHARD} запущен...")
+        try:
+            asyncio.run(run_worker(application, SHARD_HOST, SHARD_BASE_PORT + BOT_SHARD))
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_updates(application)
 
 
 if __name__ == '__main__':
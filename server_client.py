@@ -1,12 +1,37 @@
 """
 Клиент для взаимодействия с сервером алгоритмов
 """
+import io
+import os
+import json
+import math
+import hashlib
 import aiohttp
 import asyncio
 import time
 import logging
-from typing import Dict, Optional, Tuple
-from config import ALGORITHM_SERVER_URL
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+from config import (
+    ALGORITHM_SERVER_URL,
+    SERVER_POOL_LIMIT,
+    SERVER_POOL_LIMIT_PER_HOST,
+    SERVER_DNS_CACHE_TTL,
+    SERVER_KEEPALIVE_TIMEOUT,
+    SIMULATE_ALGORITHM_SERVER,
+    SERVER_BULK_STATUS_MAX,
+    SERVER_STATUS_CONCURRENCY,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_READ_TIMEOUT,
+    RESUMABLE_UPLOAD_THRESHOLD,
+    UPLOAD_PART_SIZE,
+    UPLOAD_PARALLEL_PARTS,
+    UPLOAD_PART_RETRIES,
+    UPLOAD_STATE_DIR,
+    RESULT_CHUNK_SIZE,
+    RESULT_IN_MEMORY_MAX,
+    RESULTS_DIR
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,76 +40,469 @@ logger = logging.getLogger(__name__)
 _task_times: Dict[str, float] = {}
 
 
+def _read_part(file_path: str, offset: int, length: int) -> Tuple[bytes, str]:
+    """Читает часть файла и считает ее SHA-256 (выполняется в пуле потоков)"""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_json(path: str, data: Dict[str, Any]) -> None:
+    """Атомарно записывает JSON: сначала во временный файл, затем переименование"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class TransferProgress:
+    """Прогресс и скорость передачи одного файла"""
+    
+    __slots__ = ('total_bytes', 'transferred', 'started_at', 'finished_at')
+    
+    def __init__(self, total_bytes: int = 0):
+        self.total_bytes = total_bytes
+        self.transferred = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return max(end - self.started_at, 1e-9)
+    
+    @property
+    def percent(self) -> float:
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, self.transferred * 100.0 / self.total_bytes)
+    
+    @property
+    def throughput(self) -> float:
+        """Скорость передачи в байтах в секунду"""
+        return self.transferred / self.elapsed
+
+
+class ResultFile:
+    """
+    Файл результата анализа
+    
+    Небольшой результат хранится в памяти (content), большой - во временном файле на диске (path).
+    """
+    
+    __slots__ = ('filename', 'content', 'path', 'size')
+    
+    def __init__(self, filename: str, content: Optional[bytes] = None, path: Optional[str] = None, size: int = 0):
+        self.filename = filename
+        self.content = content
+        self.path = path
+        self.size = size
+    
+    def discard(self) -> None:
+        """Удаляет временный файл результата, если он есть"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
 class AlgorithmServerClient:
-    """Клиент для работы с сервером алгоритмов"""
+    """
+    Клиент для работы с сервером алгоритмов
+
+    Рассчитан на один экземпляр на всё приложение: сессия aiohttp держит
+    пул keep-alive соединений, поэтому повторные запросы не тратят время
+    на установку TCP/TLS соединения.
+    """
     
-    def __init__(self, base_url: str = ALGORITHM_SERVER_URL):
+    def __init__(
+        self,
+        base_url: str = ALGORITHM_SERVER_URL,
+        pool_limit: int = SERVER_POOL_LIMIT,
+        pool_limit_per_host: int = SERVER_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = SERVER_DNS_CACHE_TTL,
+        keepalive_timeout: float = SERVER_KEEPALIVE_TIMEOUT,
+        simulate: bool = SIMULATE_ALGORITHM_SERVER
+    ):
         self.base_url = base_url
+        # В режиме симуляции сервер алгоритмов не нужен (прототип)
+        self.simulate = simulate
+        # Поддерживает ли сервер пакетный запрос статусов (None - еще не проверяли)
+        self.bulk_status_supported: Optional[bool] = None
+        # Поддерживает ли сервер загрузку по частям (None - еще не проверяли)
+        self.resumable_upload_supported: Optional[bool] = None
+        # Куда сервер сообщает о статусе задач (None - не сообщает, см. services/callback_server.py)
+        self.callback_url: Optional[str] = None
+        self.callback_token: Optional[str] = None
+        # Число HTTP-запросов статуса (одиночных и пакетных)
+        self.status_requests = 0
+        # Счетчики передачи файлов (см. transfer_stats)
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self.spooled_downloads = 0
         self.session: Optional[aiohttp.ClientSession] = None
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        # Счетчики пула соединений (см. pool_stats)
+        self._pool_waits = 0
+        self._connections_created = 0
+        self._connections_reused = 0
         # Время обработки задачи в секундах (для прототипа)
         self.processing_time = 30  # 30 секунд для демонстрации
     
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Получает или создает сессию aiohttp"""
+        """Получает или создает сессию aiohttp с общим пулом соединений"""
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_queued_start.append(self._on_connection_queued)
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[trace_config]
+            )
         return self.session
     
+    async def _on_connection_queued(self, session, trace_config_ctx, params) -> None:
+        self._pool_waits += 1
+    
+    async def _on_connection_created(self, session, trace_config_ctx, params) -> None:
+        self._connections_created += 1
+    
+    async def _on_connection_reused(self, session, trace_config_ctx, params) -> None:
+        self._connections_reused += 1
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику пула соединений
+        
+        Returns:
+            Dict[str, Any]: in_use - занятые соединения, idle - свободные keep-alive соединения,
+            waiting - запросы, ожидающие соединения сейчас, waits - сколько раз запрос
+            ждал свободного соединения, created/reused - новые и переиспользованные соединения
+        """
+        stats = {
+            'limit': self.pool_limit,
+            'limit_per_host': self.pool_limit_per_host,
+            'in_use': 0,
+            'idle': 0,
+            'waiting': 0,
+            'waits': self._pool_waits,
+            'created': self._connections_created,
+            'reused': self._connections_reused
+        }
+        connector = self.session.connector if self.session and not self.session.closed else None
+        if connector is not None:
+            # Внутренние структуры TCPConnector, публичного API для них нет
+            stats['in_use'] = len(getattr(connector, '_acquired', ()))
+            stats['idle'] = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+            stats['waiting'] = sum(len(waiters) for waiters in getattr(connector, '_waiters', {}).values())
+        return stats
+    
+    def transfer_stats(self) -> Dict[str, Any]:
+        """Суммарная статистика отправки файлов на сервер"""
+        return {
+            'uploads': self.uploads,
+            'uploaded_bytes': self.uploaded_bytes,
+            'upload_throughput': self.uploaded_bytes / self.upload_seconds if self.upload_seconds else 0.0,
+            'downloads': self.downloads,
+            'spooled_downloads': self.spooled_downloads,
+            'downloaded_bytes': self.downloaded_bytes,
+            'download_throughput': self.downloaded_bytes / self.download_seconds if self.download_seconds else 0.0
+        }
+    
+    async def _iter_file(
+        self,
+        file_path: str,
+        progress: TransferProgress,
+        chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Читает файл частями по chunk_size байт
+        
+        Чтение с диска выполняется в пуле потоков, чтобы не блокировать цикл событий.
+        В памяти одновременно находится не больше одной части, поэтому расход памяти
+        не зависит от размера файла.
+        """
+        loop = asyncio.get_running_loop()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    break
+                progress.transferred += len(chunk)
+                yield chunk
+    
+    def _record_upload(self, progress: TransferProgress, uploaded_now: int) -> None:
+        progress.finished_at = time.monotonic()
+        self.uploads += 1
+        self.uploaded_bytes += uploaded_now
+        self.upload_seconds += progress.elapsed
+        logger.info(
+            f"Uploaded {uploaded_now / (1024 * 1024):.1f} MB in {progress.elapsed:.1f}s "
+            f"({uploaded_now / progress.elapsed / (1024 * 1024):.1f} MB/s)"
+        )
+    
     async def start_analysis(
         self, 
         algorithm_id: str, 
         file_path: str,
-        user_id: int
+        user_id: int,
+        progress: Optional[TransferProgress] = None
     ) -> Tuple[bool, Optional[str], Optional[str]]:
         """
         Запускает анализ на сервере алгоритмов
         
+        Файлы от RESUMABLE_UPLOAD_THRESHOLD загружаются по частям с возможностью докачки
+        (см. _start_analysis_resumable), остальные - одним потоковым запросом.
+        В обоих случаях файл не читается в память целиком.
+        
         Args:
             algorithm_id: ID выбранного алгоритма
             file_path: Путь к файлу с данными
             user_id: ID пользователя Telegram
+            progress: Объект для отслеживания прогресса и скорости загрузки
             
         Returns:
             Tuple[bool, Optional[str], Optional[str]]: 
             (успешно ли запущен, task_id если успешно, сообщение об ошибке если нет)
         """
         try:
-            session = await self._get_session()
+            if self.simulate:
+                return await self._simulate_start(algorithm_id, user_id)
+            
+            if progress is None:
+                progress = TransferProgress()
+            progress.total_bytes = os.path.getsize(file_path)
             
-            # В реальной реализации здесь будет отправка файла на сервер
-            # Для прототипа симулируем успешный запуск
-            await asyncio.sleep(0.5)  # Имитация сетевой задержки
-            
-            # Генерируем фиктивный task_id
-            current_time = time.time()
-            task_id = f"task_{user_id}_{algorithm_id}_{current_time}"
-            
-            # Сохраняем время создания задачи для симуляции
-            _task_times[task_id] = current_time
-            
-            # В реальной реализации:
-            # with open(file_path, 'rb') as f:
-            #     form_data = aiohttp.FormData()
-            #     form_data.add_field('file', f, filename=os.path.basename(file_path))
-            #     form_data.add_field('algorithm_id', algorithm_id)
-            #     form_data.add_field('user_id', str(user_id))
-            #     
-            #     async with session.post(
-            #         f"{self.base_url}/api/start_analysis",
-            #         data=form_data
-            #     ) as response:
-            #         if response.status == 200:
-            #             data = await response.json()
-            #             return True, data.get('task_id'), None
-            #         else:
-            #             error = await response.text()
-            #             return False, None, error
-            
-            return True, task_id, None
+            if progress.total_bytes >= RESUMABLE_UPLOAD_THRESHOLD and self.resumable_upload_supported is not False:
+                result = await self._start_analysis_resumable(algorithm_id, file_path, user_id, progress)
+                if result is not None:
+                    return result
+            
+            return await self._start_analysis_stream(algorithm_id, file_path, user_id, progress)
             
         except Exception as e:
             return False, None, f"Ошибка при запуске анализа: {str(e)}"
     
+    async def _start_analysis_stream(
+        self,
+        algorithm_id: str,
+        file_path: str,
+        user_id: int,
+        progress: TransferProgress
+    ) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Отправляет файл одним потоковым запросом (multipart/form-data, chunked)"""
+        session = await self._get_session()
+        progress.transferred = 0
+        with aiohttp.MultipartWriter('form-data') as form_data:
+            # Поля с параметрами идут перед файлом, чтобы сервер мог принять решение заранее
+            form_data.append(algorithm_id).set_content_disposition('form-data', name='algorithm_id')
+            form_data.append(str(user_id)).set_content_disposition('form-data', name='user_id')
+            for name, value in self._callback_fields().items():
+                form_data.append(value).set_content_disposition('form-data', name=name)
+            file_part = form_data.append_payload(aiohttp.AsyncIterablePayload(
+                self._iter_file(file_path, progress),
+                content_type='application/octet-stream'
+            ))
+            file_part.set_content_disposition('form-data', name='file', filename=os.path.basename(file_path))
+            
+            async with session.post(
+                f"{self.base_url}/api/start_analysis",
+                data=form_data,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=UPLOAD_READ_TIMEOUT)
+            ) as response:
+                self._record_upload(progress, progress.transferred)
+                if response.status == 200:
+                    data = await response.json()
+                    return True, data.get('task_id'), None
+                else:
+                    error = await response.text()
+                    return False, None, error
+    
+    def _callback_fields(self) -> Dict[str, str]:
+        """Поля запуска задачи, по которым сервер сообщит боту о ее завершении"""
+        if not self.callback_url:
+            return {}
+        return {'callback_url': self.callback_url, 'callback_token': self.callback_token or ''}
+    
+    def _upload_state_path(self, file_path: str, algorithm_id: str, user_id: int) -> str:
+        """Путь к файлу состояния загрузки; ключ меняется, если файл на диске изменился"""
+        stat = os.stat(file_path)
+        key = f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{algorithm_id}|{user_id}"
+        os.makedirs(UPLOAD_STATE_DIR, exist_ok=True)
+        return os.path.join(UPLOAD_STATE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+    
+    async def _start_analysis_resumable(
+        self,
+        algorithm_id: str,
+        file_path: str,
+        user_id: int,
+        progress: TransferProgress
+    ) -> Optional[Tuple[bool, Optional[str], Optional[str]]]:
+        """
+        Загружает файл частями по UPLOAD_PART_SIZE и запускает анализ
+        
+        Протокол сервера:
+            POST /api/uploads - создать сессию загрузки
+            GET  /api/uploads/{upload_id} - какие части сервер уже получил
+            PUT  /api/uploads/{upload_id}/parts/{n} - часть n, заголовок X-Part-SHA256
+            POST /api/uploads/{upload_id}/complete - собрать файл и запустить анализ
+        
+        ID сессии и полученные части сохраняются в UPLOAD_STATE_DIR, поэтому повторный
+        вызов для того же файла (в том числе после перезапуска бота) догружает только
+        недостающие части. До UPLOAD_PARALLEL_PARTS частей загружаются одновременно.
+        
+        Returns:
+            Результат как у start_analysis или None, если сервер не поддерживает
+            загрузку по частям
+        """
+        session = await self._get_session()
+        loop = asyncio.get_running_loop()
+        size = progress.total_bytes
+        state_path = self._upload_state_path(file_path, algorithm_id, user_id)
+        state = await loop.run_in_executor(None, _load_json, state_path)
+        received: set = set()
+        
+        if state:
+            # Сервер - источник истины о полученных частях
+            async with session.get(f"{self.base_url}/api/uploads/{state['upload_id']}") as response:
+                if response.status == 200:
+                    received = set((await response.json()).get('received_parts', []))
+                    logger.info(f"Resuming upload {state['upload_id']}: {len(received)} parts already received")
+                elif response.status == 404:
+                    state = None
+                else:
+                    received = set(state.get('parts_done', []))
+        
+        if not state:
+            async with session.post(
+                f"{self.base_url}/api/uploads",
+                json={
+                    'filename': os.path.basename(file_path),
+                    'size': size,
+                    'part_size': UPLOAD_PART_SIZE,
+                    'algorithm_id': algorithm_id,
+                    'user_id': str(user_id),
+                    **self._callback_fields()
+                }
+            ) as response:
+                if response.status in (404, 405, 501):
+                    logger.info("Algorithm server does not support resumable uploads, using single stream")
+                    self.resumable_upload_supported = False
+                    return None
+                if response.status != 200:
+                    return False, None, await response.text()
+                data = await response.json()
+            self.resumable_upload_supported = True
+            state = {
+                'upload_id': data['upload_id'],
+                'part_size': data.get('part_size', UPLOAD_PART_SIZE),
+                'size': size,
+                'parts_done': []
+            }
+            received = set(data.get('received_parts', []))
+        
+        upload_id = state['upload_id']
+        part_size = state['part_size']
+        part_count = max(1, math.ceil(size / part_size))
+        state['parts_done'] = sorted(received)
+        await loop.run_in_executor(None, _save_json, state_path, state)
+        
+        missing = [n for n in range(part_count) if n not in received]
+        progress.transferred = sum(min(part_size, size - n * part_size) for n in received if n < part_count)
+        already_uploaded = progress.transferred
+        semaphore = asyncio.Semaphore(UPLOAD_PARALLEL_PARTS)
+        # Сохранения состояния идут по одному, чтобы старый снимок не перезаписал новый
+        state_lock = asyncio.Lock()
+        
+        async def send_part(part_number: int) -> bool:
+            async with semaphore:
+                ok = await self._upload_part(session, upload_id, file_path, part_number, part_size, size, progress)
+            if ok:
+                received.add(part_number)
+                async with state_lock:
+                    state['parts_done'] = sorted(received)
+                    await loop.run_in_executor(None, _save_json, state_path, dict(state))
+            return ok
+        
+        results = await asyncio.gather(*(send_part(n) for n in missing))
+        self._record_upload(progress, progress.transferred - already_uploaded)
+        failed = [n for n, ok in zip(missing, results) if not ok]
+        if failed:
+            # Состояние сохранено: при повторном запуске догрузятся только эти части
+            return False, None, f"Не удалось загрузить {len(failed)} из {part_count} частей файла"
+        
+        async with session.post(f"{self.base_url}/api/uploads/{upload_id}/complete") as response:
+            if response.status != 200:
+                return False, None, await response.text()
+            data = await response.json()
+        
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+        return True, data.get('task_id'), None
+    
+    async def _upload_part(
+        self,
+        session: aiohttp.ClientSession,
+        upload_id: str,
+        file_path: str,
+        part_number: int,
+        part_size: int,
+        size: int,
+        progress: TransferProgress
+    ) -> bool:
+        """Загружает одну часть с контрольной суммой, повторяя попытки с экспоненциальной паузой"""
+        loop = asyncio.get_running_loop()
+        offset = part_number * part_size
+        length = min(part_size, size - offset)
+        data, checksum = await loop.run_in_executor(None, _read_part, file_path, offset, length)
+        
+        for attempt in range(UPLOAD_PART_RETRIES):
+            try:
+                async with session.put(
+                    f"{self.base_url}/api/uploads/{upload_id}/parts/{part_number}",
+                    data=data,
+                    headers={'X-Part-SHA256': checksum, 'Content-Type': 'application/octet-stream'},
+                    timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=UPLOAD_READ_TIMEOUT)
+                ) as response:
+                    if response.status == 200:
+                        progress.transferred += length
+                        return True
+                    logger.warning(f"Upload {upload_id} part {part_number} failed: {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Upload {upload_id} part {part_number} failed: {e}")
+            # После последней попытки ждать нечего
+            if attempt + 1 < UPLOAD_PART_RETRIES:
+                await asyncio.sleep(min(2 ** attempt, 30))
+        return False
+    
     async def check_status(self, task_id: str) -> Tuple[str, Optional[str]]:
         """
         Проверяет статус выполнения задачи
@@ -97,117 +515,301 @@ class AlgorithmServerClient:
             Статусы: 'pending', 'processing', 'completed', 'failed'
         """
         try:
+            if self.simulate:
+                # Для прототипа симулируем проверку статуса
+                await asyncio.sleep(0.2)
+                return self._simulate_status(task_id)
+            
             session = await self._get_session()
+            self.status_requests += 1
+            async with session.get(f"{self.base_url}/api/task/{task_id}/status") as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data.get('status'), data.get('error')
+                elif response.status == 404:
+                    return 'failed', "Задача не найдена"
+                else:
+                    return 'failed', f"Ошибка при проверке статуса: {response.status}"
             
-            # В реальной реализации:
-            # async with session.get(f"{self.base_url}/api/task/{task_id}/status") as response:
-            #     if response.status == 200:
-            #         data = await response.json()
-            #         return data.get('status'), None
-            #     else:
-            #         return 'failed', f"Ошибка при проверке статуса: {response.status}"
+        except Exception as e:
+            return 'failed', f"Ошибка при проверке статуса: {str(e)}"
+    
+    async def check_status_many(self, task_ids: Iterable[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+        """
+        Проверяет статусы нескольких задач
+        
+        Использует пакетный эндпоинт POST /api/tasks/status (до SERVER_BULK_STATUS_MAX задач
+        за запрос). Если сервер его не поддерживает, запоминает это и переходит на одиночные
+        запросы, не более SERVER_STATUS_CONCURRENCY одновременно.
+        
+        Args:
+            task_ids: ID задач
             
-            # Для прототипа симулируем проверку статуса
+        Returns:
+            Dict[str, Tuple[str, Optional[str]]]: task_id -> (статус, сообщение об ошибке)
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return {}
+        
+        if self.simulate:
             await asyncio.sleep(0.2)
+            return {task_id: self._simulate_status(task_id) for task_id in task_ids}
+        
+        statuses: Dict[str, Tuple[str, Optional[str]]] = {}
+        if self.bulk_status_supported is not False:
+            for start in range(0, len(task_ids), SERVER_BULK_STATUS_MAX):
+                chunk = task_ids[start:start + SERVER_BULK_STATUS_MAX]
+                chunk_statuses = await self._check_status_bulk(chunk)
+                if chunk_statuses is None:
+                    break
+                statuses.update(chunk_statuses)
+        
+        missing = [task_id for task_id in task_ids if task_id not in statuses]
+        if missing:
+            semaphore = asyncio.Semaphore(SERVER_STATUS_CONCURRENCY)
             
-            # Проверяем, прошло ли достаточно времени для завершения задачи
-            if task_id in _task_times:
-                elapsed_time = time.time() - _task_times[task_id]
-                remaining_time = max(0, self.processing_time - elapsed_time)
-                
-                if elapsed_time >= self.processing_time:
-                    # Задача завершена
-                    logger.info(f"Task {task_id} completed after {elapsed_time:.1f} seconds")
-                    # Удаляем задачу из словаря после завершения
-                    _task_times.pop(task_id, None)
-                    return 'completed', None
-                else:
-                    # Задача еще обрабатывается
-                    logger.debug(f"Task {task_id} processing... {remaining_time:.1f}s remaining")
-                    return 'processing', None
+            async def check_one(task_id: str) -> Tuple[str, Optional[str]]:
+                async with semaphore:
+                    return await self.check_status(task_id)
+            
+            results = await asyncio.gather(*(check_one(task_id) for task_id in missing))
+            statuses.update(zip(missing, results))
+        return statuses
+    
+    async def _check_status_bulk(self, task_ids: list) -> Optional[Dict[str, Tuple[str, Optional[str]]]]:
+        """
+        Один пакетный запрос статусов
+        
+        Returns:
+            Словарь статусов или None, если пакетный запрос выполнить не удалось
+            и нужно перейти на одиночные запросы
+        """
+        try:
+            session = await self._get_session()
+            self.status_requests += 1
+            async with session.post(
+                f"{self.base_url}/api/tasks/status",
+                json={'task_ids': task_ids}
+            ) as response:
+                if response.status in (404, 405, 501):
+                    if self.bulk_status_supported is None:
+                        logger.info("Algorithm server does not support bulk status, using single requests")
+                    self.bulk_status_supported = False
+                    return None
+                if response.status != 200:
+                    logger.warning(f"Bulk status request failed: {response.status}")
+                    return None
+                data = await response.json()
+        except Exception as e:
+            logger.warning(f"Bulk status request failed: {e}")
+            return None
+        
+        self.bulk_status_supported = True
+        tasks = data.get('tasks', {})
+        statuses = {}
+        for task_id in task_ids:
+            info = tasks.get(task_id)
+            if info is None:
+                statuses[task_id] = ('failed', "Задача не найдена")
             else:
-                # Задача не найдена (не должна происходить в прототипе)
-                logger.warning(f"Task {task_id} not found in tracking dictionary")
-                return 'failed', "Задача не найдена"
+                statuses[task_id] = (info.get('status'), info.get('error'))
+        return statuses
+    
+    async def cancel_task(self, task_id: str) -> Tuple[bool, Optional[str]]:
+        """
+        Отменяет задачу на сервере, чтобы он перестал тратить на нее ресурсы
+        
+        Args:
+            task_id: ID задачи
+            
+        Returns:
+            Tuple[bool, Optional[str]]: (остановлена ли задача, сообщение об ошибке если есть)
+            Неизвестная серверу задача считается остановленной
+        """
+        try:
+            if self.simulate:
+                _task_times.pop(task_id, None)
+                return True, None
+            
+            session = await self._get_session()
+            async with session.post(f"{self.base_url}/api/task/{task_id}/cancel") as response:
+                if response.status in (200, 202, 204, 404):
+                    return True, None
+                elif response.status == 409:
+                    return False, "Задача уже завершена"
+                else:
+                    return False, f"Ошибка при отмене задачи: {response.status}"
             
         except Exception as e:
-            return 'failed', f"Ошибка при проверке статуса: {str(e)}"
+            return False, f"Ошибка при отмене задачи: {str(e)}"
     
-    async def get_result(self, task_id: str) -> Tuple[bool, Optional[str], Optional[str]]:
+    async def get_result(self, task_id: str) -> Tuple[bool, Optional[ResultFile], Optional[str]]:
         """
         Получает результат выполнения задачи
         
+        Ответ читается потоково частями по RESULT_CHUNK_SIZE. Пока результат не больше
+        RESULT_IN_MEMORY_MAX, он остается в памяти и отправляется в Telegram без временного
+        файла; больший результат сбрасывается на диск в RESULTS_DIR, запись идет в пуле
+        потоков и не блокирует цикл событий.
+        
         Args:
             task_id: ID задачи
             
         Returns:
-            Tuple[bool, Optional[str], Optional[str]]: 
-            (успешно ли получен результат, путь к файлу результата, сообщение об ошибке)
+            Tuple[bool, Optional[ResultFile], Optional[str]]: 
+            (успешно ли получен результат, файл результата, сообщение об ошибке)
+            Временный файл результата удаляет вызывающий код через ResultFile.discard()
         """
         try:
-            session = await self._get_session()
+            if self.simulate:
+                return self._simulate_result(task_id)
             
-            # В реальной реализации:
-            # async with session.get(f"{self.base_url}/api/task/{task_id}/result") as response:
-            #     if response.status == 200:
-            #         # Сохраняем файл результата
-            #         result_path = f"results/{task_id}_result.zip"
-            #         with open(result_path, 'wb') as f:
-            #             async for chunk in response.content.iter_chunked(8192):
-            #                 f.write(chunk)
-            #         return True, result_path, None
-            #     else:
-            #         error = await response.text()
-            #         return False, None, error
-            
-            # Для прототипа создаем фиктивный файл результата
-            import os
-            from datetime import datetime
-            os.makedirs('results', exist_ok=True)
-            result_path = f"results/{task_id}_result.txt"
-            
-            # Извлекаем информацию об алгоритме из task_id
-            algorithm_id = task_id.split('_')[2] if '_' in task_id else 'unknown'
-            algorithm_names = {
-                'agriculture': 'Классификация сельскохозяйственных земель',
-                'vegetation': 'Расчет вегетационных индексов',
-                'object': 'Детекция объектов',
-                'change': 'Детекция изменений'
-            }
-            algo_name = next((name for key, name in algorithm_names.items() if key in algorithm_id), 'Неизвестный алгоритм')
-            
-            with open(result_path, 'w', encoding='utf-8') as f:
-                f.write("=" * 60 + "\n")
-                f.write("РЕЗУЛЬТАТЫ АНАЛИЗА АЭРОФОТОСНИМКОВ\n")
-                f.write("=" * 60 + "\n\n")
-                f.write(f"Дата и время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"ID задачи: {task_id}\n")
-                f.write(f"Алгоритм: {algo_name}\n\n")
-                f.write("-" * 60 + "\n")
-                f.write("СТАТИСТИКА ОБРАБОТКИ:\n")
-                f.write("-" * 60 + "\n")
-                f.write("Обработано пикселей: 12,450,000\n")
-                f.write("Размер обработанной области: 5000 x 2490 пикселей\n")
-                f.write("Время обработки: ~30 секунд\n\n")
-                f.write("-" * 60 + "\n")
-                f.write("РЕЗУЛЬТАТЫ:\n")
-                f.write("-" * 60 + "\n")
-                f.write("✓ Анализ успешно завершен\n")
-                f.write("✓ Результаты сохранены\n")
-                f.write("✓ Данные готовы к использованию\n\n")
-                f.write("=" * 60 + "\n")
-                f.write("ПРИМЕЧАНИЕ: Это прототип.\n")
-                f.write("В реальной версии здесь будет файл с результатами анализа\n")
-                f.write("(например, GeoTIFF с классификацией, JSON с метаданными и т.д.)\n")
-                f.write("=" * 60 + "\n")
-            
-            return True, result_path, None
+            session = await self._get_session()
+            async with session.get(
+                f"{self.base_url}/api/task/{task_id}/result",
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=UPLOAD_READ_TIMEOUT)
+            ) as response:
+                if response.status != 200:
+                    error = await response.text()
+                    return False, None, error
+                
+                filename = (response.content_disposition and response.content_disposition.filename) \
+                    or f"{task_id}_result.zip"
+                result = await self._read_result(response, task_id, filename)
+                return True, result, None
             
         except Exception as e:
             return False, None, f"Ошибка при получении результата: {str(e)}"
     
+    async def _read_result(self, response: aiohttp.ClientResponse, task_id: str, filename: str) -> ResultFile:
+        """Читает тело ответа в память или, если оно слишком большое, во временный файл"""
+        loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        buffer = bytearray()
+        spool = None
+        result = ResultFile(filename)
+        # Если размер известен заранее и он большой, сразу пишем на диск
+        spool_now = response.content_length is not None and response.content_length > RESULT_IN_MEMORY_MAX
+        try:
+            async for chunk in response.content.iter_chunked(RESULT_CHUNK_SIZE):
+                result.size += len(chunk)
+                if spool is None and (spool_now or len(buffer) + len(chunk) > RESULT_IN_MEMORY_MAX):
+                    os.makedirs(RESULTS_DIR, exist_ok=True)
+                    result.path = os.path.join(RESULTS_DIR, f"{task_id}_result.part")
+                    spool = await loop.run_in_executor(None, open, result.path, 'wb')
+                    if buffer:
+                        await loop.run_in_executor(None, spool.write, bytes(buffer))
+                        buffer = bytearray()
+                if spool is not None:
+                    await loop.run_in_executor(None, spool.write, chunk)
+                else:
+                    buffer += chunk
+        except BaseException:
+            if spool is not None:
+                spool.close()
+            result.discard()
+            raise
+        
+        if spool is not None:
+            await loop.run_in_executor(None, spool.close)
+            self.spooled_downloads += 1
+        else:
+            result.content = bytes(buffer)
+        self.downloads += 1
+        self.downloaded_bytes += result.size
+        self.download_seconds += time.monotonic() - started_at
+        return result
+    
+    async def _simulate_start(self, algorithm_id: str, user_id: int) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Симуляция запуска анализа (прототип без сервера алгоритмов)"""
+        await asyncio.sleep(0.5)  # Имитация сетевой задержки
+        
+        # Генерируем фиктивный task_id
+        current_time = time.time()
+        task_id = f"task_{user_id}_{algorithm_id}_{current_time}"
+        
+        # Сохраняем время создания задачи для симуляции
+        _task_times[task_id] = current_time
+        return True, task_id, None
+    
+    def _simulate_status(self, task_id: str) -> Tuple[str, Optional[str]]:
+        """Симуляция статуса: задача завершается через processing_time секунд"""
+        # Проверяем, прошло ли достаточно времени для завершения задачи
+        if task_id in _task_times:
+            elapsed_time = time.time() - _task_times[task_id]
+            remaining_time = max(0, self.processing_time - elapsed_time)
+            
+            if elapsed_time >= self.processing_time:
+                # Задача завершена
+                logger.info(f"Task {task_id} completed after {elapsed_time:.1f} seconds")
+                # Удаляем задачу из словаря после завершения
+                _task_times.pop(task_id, None)
+                return 'completed', None
+            else:
+                # Задача еще обрабатывается
+                logger.debug(f"Task {task_id} processing... {remaining_time:.1f}s remaining")
+                return 'processing', None
+        else:
+            # Задача не найдена (не должна происходить в прототипе)
+            logger.warning(f"Task {task_id} not found in tracking dictionary")
+            return 'failed', "Задача не найдена"
+    
+    def _simulate_result(self, task_id: str) -> Tuple[bool, Optional[ResultFile], Optional[str]]:
+        """Симуляция результата: текстовый отчет в памяти"""
+        # Извлекаем информацию об алгоритме из task_id
+        algorithm_id = task_id.split('_')[2] if '_' in task_id else 'unknown'
+        algorithm_names = {
+            'agriculture': 'Классификация сельскохозяйственных земель',
+            'vegetation': 'Расчет вегетационных индексов',
+            'object': 'Детекция объектов',
+            'change': 'Детекция изменений'
+        }
+        algo_name = next((name for key, name in algorithm_names.items() if key in algorithm_id), 'Неизвестный алгоритм')
+        
+        with io.StringIO() as f:
+            f.write("=" * 60 + "\n")
+            f.write("РЕЗУЛЬТАТЫ АНАЛИЗА АЭРОФОТОСНИМКОВ\n")
+            f.write("=" * 60 + "\n\n")
+            f.write(f"Дата и время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"ID задачи: {task_id}\n")
+            f.write(f"Алгоритм: {algo_name}\n\n")
+            f.write("-" * 60 + "\n")
+            f.write("СТАТИСТИКА ОБРАБОТКИ:\n")
+            f.write("-" * 60 + "\n")
+            f.write("Обработано пикселей: 12,450,000\n")
+            f.write("Размер обработанной области: 5000 x 2490 пикселей\n")
+            f.write("Время обработки: ~30 секунд\n\n")
+            f.write("-" * 60 + "\n")
+            f.write("РЕЗУЛЬТАТЫ:\n")
+            f.write("-" * 60 + "\n")
+            f.write("✓ Анализ успешно завершен\n")
+            f.write("✓ Результаты сохранены\n")
+            f.write("✓ Данные готовы к использованию\n\n")
+            f.write("=" * 60 + "\n")
+            f.write("ПРИМЕЧАНИЕ: Это прототип.\n")
+            f.write("В реальной версии здесь будет файл с результатами анализа\n")
+            f.write("(например, GeoTIFF с классификацией, JSON с метаданными и т.д.)\n")
+            f.write("=" * 60 + "\n")
+            content = f.getvalue().encode('utf-8')
+        
+        return True, ResultFile(f"{task_id}_result.txt", content=content, size=len(content)), None
+    
     async def close(self):
         """Закрывает сессию"""
         if self.session and not self.session.closed:
             await self.session.close()
 
+
+def get_shared_client(bot_data: Dict[str, Any]) -> AlgorithmServerClient:
+    """
+    Возвращает общий клиент приложения из bot_data
+    
+    Клиент создается в post_init и закрывается в post_shutdown (см. main.py).
+    Если приложение запущено без post_init, клиент создается при первом обращении.
+    """
+    client = bot_data.get('server_client')
+    if client is None:
+        client = AlgorithmServerClient()
+        bot_data['server_client'] = client
+    return client
@@ -0,0 +1,4 @@
+"""
+Фоновые сервисы бота
+"""
+
@@ -0,0 +1,80 @@
+"""
+HTTP-эндпоинт для уведомлений сервера алгоритмов о статусе задач: завершение
+доходит до пользователя сразу, а не при следующем опросе
+"""
+import hmac
+import logging
+from typing import Any, Dict, Optional
+from aiohttp import web
+from services.job_scheduler import JobStatusScheduler
+from config import CALLBACK_HOST, CALLBACK_PORT, CALLBACK_TOKEN
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_PATH = '/api/callback'
+
+
+class CallbackServer:
+    """
+    Принимает POST /api/callback с JSON {"task_id": ..., "status": ..., "error": ...}
+    и заголовком X-Callback-Token
+
+    Статус передается планировщику (JobStatusScheduler.notify). Уведомление о
+    задаче, которую отслеживает другой процесс, принимается, но ничего не
+    меняет: такую задачу найдет страховочный опрос ее процесса.
+    """
+
+    def __init__(
+        self,
+        scheduler: JobStatusScheduler,
+        host: str = CALLBACK_HOST,
+        port: int = CALLBACK_PORT,
+        token: str = CALLBACK_TOKEN
+    ):
+        self.scheduler = scheduler
+        self.host = host
+        self.port = port
+        self.token = token
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.unknown = 0
+        self.rejected = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'received': self.received,
+            'unknown': self.unknown,
+            'rejected': self.rejected
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get('X-Callback-Token', ''), self.token):
+            self.rejected += 1
+            return web.json_response({'error': 'invalid token'}, status=403)
+        try:
+            data = await request.json()
+            task_id = data['task_id']
+            status = data['status']
+        except Exception:
+            self.rejected += 1
+            return web.json_response({'error': 'task_id and status are required'}, status=400)
+
+        self.received += 1
+        known = await self.scheduler.notify(str(task_id), str(status), data.get('error'))
+        if not known:
+            self.unknown += 1
+            logger.debug(f"Callback for untracked task {task_id}: {status}")
+        return web.json_response({'accepted': known})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(CALLBACK_PATH, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Callback endpoint listening on {self.host}:{self.port}{CALLBACK_PATH}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,262 @@
+"""
+Хранение состояния диалога пользователей (context.user_data) в БД: состояние
+переживает перезапуск бота и доступно любому рабочему процессу
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+from telegram.ext import Application, BasePersistence, PersistenceInput
+from database.db_session import AsyncSessionLocal
+from database.repository import UserStateRepository
+from config import (
+    PERSISTENCE_EVICT_INTERVAL,
+    PERSISTENCE_IDLE_TTL,
+    PERSISTENCE_MAX_USERS,
+    PERSISTENCE_UPDATE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value: Any) -> Optional[str]:
+    """JSON значения или None, если значение не сериализуется (объект времени выполнения)"""
+    try:
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+
+
+class DatabasePersistence(BasePersistence):
+    """
+    Persistence для user_data на таблице user_states
+
+    - Загрузка ленивая: состояние пользователя читается из БД при его первом
+      обновлении (refresh_user_data), а не целиком при запуске.
+    - Запись инкрементальная: в БД уходят только изменившиеся ключи (удаленные -
+      как null), изменения всех пользователей за update_interval - одним запросом.
+    - Память ограничена: пользователи без активности дольше idle_ttl (и сверх
+      max_users - самые давние) выгружаются из памяти, их состояние остается в БД.
+
+    Значения, которые не сериализуются в JSON (пакет файлов в работе), в БД не
+    сохраняются, а пользователь с такими значениями не выгружается.
+    """
+
+    def __init__(
+        self,
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+        idle_ttl: float = PERSISTENCE_IDLE_TTL,
+        max_users: int = PERSISTENCE_MAX_USERS,
+        evict_interval: float = PERSISTENCE_EVICT_INTERVAL
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.evict_interval = evict_interval
+        self.application: Optional[Application] = None
+        # Загруженные пользователи: ID -> {ключ: JSON значения, как оно записано в БД}
+        self._stored: Dict[int, Dict[str, str]] = {}
+        # Время последнего обращения загруженных пользователей (первый - самый давний)
+        self._last_seen: 'OrderedDict[int, float]' = OrderedDict()
+        # Изменения, ожидающие записи: ID -> {ключ: значение или None - ключ удален}
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # Пользователи, выгруженные из памяти (drop_user_data не должен удалять их из БД)
+        self._evicting: Set[int] = set()
+        self._lock = asyncio.Lock()
+        self._write_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.writes = 0
+        self.rows_written = 0
+        self.evicted = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'loaded': len(self._stored),
+            'pending': len(self._pending),
+            'loads': self.loads,
+            'writes': self.writes,
+            'rows_written': self.rows_written,
+            'evicted': self.evicted,
+            'failures': self.failures
+        }
+
+    def _touch(self, user_id: int) -> None:
+        self._last_seen[user_id] = time.monotonic()
+        self._last_seen.move_to_end(user_id)
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Состояние загружается по пользователю в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id in self._stored:
+            self._touch(user_id)
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                data = await UserStateRepository.get(session, user_id)
+        except Exception as e:
+            # Пользователь продолжит с состоянием в памяти, загрузка повторится при следующем обновлении
+            self.failures += 1
+            logger.error(f"Error loading state of user {user_id}: {e}")
+            return
+        for key, value in data.items():
+            user_data.setdefault(key, value)
+        self._stored[user_id] = {key: _encode(value) for key, value in data.items()}
+        self._touch(user_id)
+        self.loads += 1
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        encoded = {}
+        for key, value in data.items():
+            value_json = _encode(value)
+            if value_json is not None and isinstance(key, str):
+                encoded[key] = value_json
+        stored = self._stored.get(user_id, {})
+        patch = {key: data[key] for key, value_json in encoded.items() if stored.get(key) != value_json}
+        patch.update((key, None) for key in stored if key not in encoded)
+        self._stored[user_id] = encoded
+        self._touch(user_id)
+        if not patch:
+            return
+        self._pending.setdefault(user_id, {}).update(patch)
+        # Application.update_persistence вызывает update_user_data для всех измененных
+        # пользователей разом - запись запускается после них и уходит одним запросом
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write())
+
+    async def _write(self) -> int:
+        """Записывает накопленные изменения одним запросом, возвращает число строк"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch = self._pending
+            self._pending = {}
+            try:
+                async with AsyncSessionLocal() as session:
+                    written = await UserStateRepository.save(session, batch)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Error saving state of {len(batch)} users: {e}")
+                # Повтор - при следующей записи; более новые изменения важнее
+                for user_id, patch in batch.items():
+                    self._pending[user_id] = {**patch, **self._pending.get(user_id, {})}
+                return 0
+            self.writes += 1
+            self.rows_written += written
+            return written
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicting:
+            self._evicting.discard(user_id)
+            if user_id in self._stored and self.application is not None:
+                # Пользователь вернулся раньше, чем Application применил выгрузку, и его
+                # изменения за этот интервал были отброшены - записываем их в следующий
+                self.application.mark_data_for_update_persistence(user_ids=user_id)
+            return
+        self._stored.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        async with AsyncSessionLocal() as session:
+            await UserStateRepository.delete(session, [user_id])
+
+    def evict(self) -> int:
+        """Выгружает из памяти давно неактивных пользователей, возвращает их число"""
+        if self.application is None:
+            return 0
+        now = time.monotonic()
+        excess = len(self._last_seen) - self.max_users
+        evicted = 0
+        for user_id, seen in list(self._last_seen.items()):
+            if excess <= 0 and now - seen < self.idle_ttl:
+                break
+            excess -= 1
+            if user_id in self._pending:
+                continue
+            user_data = self.application.user_data.get(user_id)
+            stored = self._stored.get(user_id, {})
+            # Значения, которых нет в БД (пакет в работе или еще не записанное изменение), не теряем
+            if user_data and any(key not in stored or stored[key] != _encode(value) for key, value in user_data.items()):
+                continue
+            del self._last_seen[user_id]
+            self._stored.pop(user_id, None)
+            if user_data is not None:
+                self._evicting.add(user_id)
+                self.application.drop_user_data(user_id)
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            try:
+                # Повтор записи, которая не удалась
+                await self._write()
+                evicted = self.evict()
+                if evicted:
+                    logger.debug(f"Evicted {evicted} idle users from memory")
+            except Exception as e:
+                logger.error(f"Error in persistence maintenance: {e}")
+
+    def start(self, application: Application) -> None:
+        """Запускает выгрузку неактивных пользователей и повтор неудавшихся записей"""
+        self.application = application
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def flush(self) -> None:
+        if self._write_task is not None and not self._write_task.done():
+            await self._write_task
+        await self._write()
+
+    # Данные чатов, бота, callback_data и ConversationHandler бот не хранит (см. store_data)
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
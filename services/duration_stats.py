@@ -0,0 +1,139 @@
+"""
+Статистика длительности анализа по алгоритму и размеру файла: по ней
+планировщик выбирает моменты опроса и таймаут, а пользователь видит
+ожидаемое время
+"""
+import asyncio
+import bisect
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+from database.db_session import AsyncSessionLocal
+from database.repository import RequestRepository
+from config import (
+    DURATION_STATS_MIN_SAMPLES,
+    DURATION_STATS_REFRESH_INTERVAL,
+    DURATION_STATS_SIZE_BUCKETS_MB,
+    DURATION_STATS_WINDOW_DAYS,
+    JOB_MAX_TIMEOUT,
+    JOB_MIN_TIMEOUT,
+    JOB_TIMEOUT_FACTOR
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DurationEstimate:
+    """Перцентили длительности анализа (в секундах) и число заявок, по которым они посчитаны"""
+
+    __slots__ = ('samples', 'p50', 'p90', 'p99')
+
+    def __init__(self, samples: int, p50: float, p90: float, p99: float):
+        self.samples = samples
+        self.p50 = p50
+        self.p90 = p90
+        self.p99 = p99
+
+
+class DurationStats:
+    """
+    Хранит перцентили длительности по (алгоритм, группа размера файла) и
+    периодически пересчитывает их в БД
+
+    Если по группе размера заявок меньше min_samples, используется статистика
+    алгоритма в целом, а если и ее нет - прогноза нет (планировщик опрашивает
+    с постоянным интервалом, как раньше).
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = DURATION_STATS_REFRESH_INTERVAL,
+        window_days: float = DURATION_STATS_WINDOW_DAYS,
+        min_samples: int = DURATION_STATS_MIN_SAMPLES,
+        size_buckets_mb=DURATION_STATS_SIZE_BUCKETS_MB
+    ):
+        self.refresh_interval = refresh_interval
+        self.window_days = window_days
+        self.min_samples = min_samples
+        self.size_bounds = [bound * 1024 * 1024 for bound in size_buckets_mb]
+        # (алгоритм, группа размера или None - алгоритм в целом) -> перцентили
+        self._estimates: Dict[Tuple[str, Optional[int]], DurationEstimate] = {}
+        self.loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    def estimate(self, algorithm_name: Optional[str], file_size: Optional[int] = None) -> Optional[DurationEstimate]:
+        """Прогноз длительности анализа файла размером file_size (None - размер неизвестен)"""
+        if not algorithm_name:
+            return None
+        if file_size is not None:
+            bucket = bisect.bisect_right(self.size_bounds, file_size)
+            estimate = self._estimates.get((algorithm_name, bucket))
+            if estimate is not None and estimate.samples >= self.min_samples:
+                return estimate
+        estimate = self._estimates.get((algorithm_name, None))
+        if estimate is not None and estimate.samples >= self.min_samples:
+            return estimate
+        return None
+
+    def estimate_job(self, job) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Ожидаемая длительность и таймаут задачи планировщика (см. JobStatusScheduler)
+
+        Returns:
+            (медиана длительности, таймаут) в секундах или (None, None), если статистики нет
+        """
+        file_size = job.file_size
+        if file_size is None and job.file_path:
+            # Задача из очереди в БД: размер файла не сохранен, но файл еще на диске
+            try:
+                file_size = os.path.getsize(job.file_path)
+            except OSError:
+                pass
+        estimate = self.estimate(job.algorithm_name, file_size)
+        if estimate is None:
+            return None, None
+        timeout = min(max(estimate.p99 * JOB_TIMEOUT_FACTOR, JOB_MIN_TIMEOUT), JOB_MAX_TIMEOUT)
+        return estimate.p50, timeout
+
+    async def refresh(self) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                rows = await RequestRepository.get_duration_percentiles(
+                    session,
+                    self.size_bounds,
+                    self.window_days * 86400
+                )
+            self._estimates = {
+                (algorithm_name, bucket): DurationEstimate(samples, p50, p90, p99)
+                for algorithm_name, bucket, samples, p50, p90, p99 in rows
+            }
+            self.loaded = True
+        except Exception as e:
+            # Остается прежняя статистика, следующая попытка - через refresh_interval
+            logger.error(f"Error refreshing duration stats: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'groups': len(self._estimates),
+            'algorithms': sum(1 for _, bucket in self._estimates if bucket is None),
+            'loaded': self.loaded
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
@@ -0,0 +1,222 @@
+"""
+Очередь задач в БД: задачи в работе переживают перезапуск бота и делятся
+между несколькими процессами
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Optional, Set
+from database.db_session import AsyncSessionLocal
+from database.repository import JobQueueRepository
+from services.job_scheduler import JobStatusScheduler, TrackedJob
+from services.submission_scheduler import SubmissionScheduler
+from config import (
+    BOT_SHARD,
+    BOT_WORKERS,
+    JOB_LEASE_INTERVAL,
+    JOB_LEASE_TTL,
+    JOB_POLL_BATCH_SIZE,
+    JOB_TAKEOVER_SHARDS,
+    JOB_WORKER_ID
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DurableJobQueue:
+    """
+    Хранит задачи планировщика в таблице analysis_jobs
+
+    Запущенная задача сразу записывается арендованной этим процессом.
+    Раз в lease_interval аренда всех задач процесса продлевается (вместе с
+    числом опросов), а задачи без владельца - процесс остановлен или упал и
+    аренда истекла - забираются в планировщик. Строка удаляется, когда
+    результат отправлен пользователю.
+
+    Рабочий процесс (shard не None) забирает только задачи пользователей
+    своего номера и номеров из takeover_shards: отменить задачу может только
+    процесс, в который приходят обновления ее пользователя.
+    """
+
+    def __init__(
+        self,
+        scheduler: JobStatusScheduler,
+        admission: Optional[SubmissionScheduler] = None,
+        worker_id: str = JOB_WORKER_ID,
+        lease_ttl: float = JOB_LEASE_TTL,
+        lease_interval: float = JOB_LEASE_INTERVAL,
+        batch_size: int = JOB_POLL_BATCH_SIZE,
+        shard: Optional[int] = BOT_SHARD,
+        shard_count: int = BOT_WORKERS,
+        takeover_shards: Iterable[int] = JOB_TAKEOVER_SHARDS
+    ):
+        self.scheduler = scheduler
+        self.admission = admission
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.lease_interval = lease_interval
+        self.batch_size = batch_size
+        self.shard_count = shard_count
+        self.shards = None if shard is None else sorted({shard, *takeover_shards})
+        # ID заявок, которые отслеживает этот процесс
+        self._owned: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.resumed = 0
+        self.completed = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'worker_id': self.worker_id,
+            'shards': self.shards,
+            'owned': len(self._owned),
+            'enqueued': self.enqueued,
+            'resumed': self.resumed,
+            'completed': self.completed,
+            'failures': self.failures
+        }
+
+    async def enqueue(self, job: TrackedJob) -> None:
+        """Сохраняет запущенную задачу (или заявку, присоединенную к ней)"""
+        if not job.db_request_id or not job.server_task_id:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await JobQueueRepository.enqueue(
+                    session,
+                    [{
+                        'analysis_request_id': job.db_request_id,
+                        'server_task_id': job.server_task_id,
+                        'chat_id': job.chat_id,
+                        'user_id': job.user_id,
+                        'file_path': job.file_path,
+                        'algorithm_name': job.algorithm_name,
+                        'algorithm_id': job.algorithm_id,
+                        'content_hash': job.content_hash
+                    }],
+                    self.worker_id,
+                    self.lease_ttl,
+                    self.scheduler.poll_interval
+                )
+            self._owned.add(job.db_request_id)
+            self.enqueued += 1
+        except Exception as e:
+            # Опрос продолжается в памяти, но перезапуск эта задача не переживет
+            self.failures += 1
+            logger.error(f"Error saving job {job.server_task_id} to queue: {e}")
+
+    async def complete(self, jobs: Iterable[TrackedJob]) -> None:
+        """Удаляет из очереди заявки, обработка которых закончена"""
+        request_ids = [job.db_request_id for job in jobs if job.db_request_id]
+        if not request_ids:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await JobQueueRepository.complete(session, request_ids)
+            self.completed += len(request_ids)
+        except Exception as e:
+            # Строки останутся арендованными до остановки процесса; после нее задачу
+            # опросят снова и результат будет отправлен повторно
+            self.failures += 1
+            logger.error(f"Error removing {len(request_ids)} jobs from queue: {e}")
+        finally:
+            self._owned.difference_update(request_ids)
+
+    async def lease(self) -> int:
+        """Забирает в планировщик задачи без владельца, возвращает число арендованных строк"""
+        async with AsyncSessionLocal() as session:
+            rows = await JobQueueRepository.lease(
+                session,
+                self.worker_id,
+                self.lease_ttl,
+                self.batch_size,
+                self.shard_count,
+                self.shards
+            )
+
+        for row in rows:
+            request_id = str(row['analysis_request_id'])
+            # Своя задача, аренда которой успела истечь (например, БД была недоступна) - уже в работе
+            if request_id in self._owned:
+                continue
+            job = TrackedJob(
+                server_task_id=row['server_task_id'],
+                chat_id=row['chat_id'],
+                user_id=row['user_id'],
+                db_request_id=request_id,
+                file_path=row['file_path'],
+                algorithm_name=row['algorithm_name'],
+                algorithm_id=row['algorithm_id'],
+                content_hash=row['content_hash']
+            )
+            job.attempts = row['attempts']
+            # Таймаут и прогноз длительности отсчитываются от запуска задачи, а не от перезапуска бота
+            if row['created_at'] is not None:
+                job.submitted_at = row['created_at'].timestamp()
+            self._owned.add(request_id)
+            self.resumed += 1
+            # Несколько заявок одной задачи опрашиваются одним запросом
+            if not self.scheduler.attach(job.server_task_id, job):
+                delay = row['poll_delay'].total_seconds() if row['poll_delay'] is not None else 0.0
+                self.scheduler.track(job, delay=max(0.0, delay))
+                # Задача уже на сервере и занимает место наравне с запущенными этим процессом
+                if self.admission is not None and job.algorithm_id:
+                    self.admission.occupy(job.server_task_id, job.algorithm_id)
+        if rows:
+            logger.info(f"Leased {len(rows)} jobs from queue")
+        return len(rows)
+
+    async def renew(self) -> int:
+        """Продлевает аренду задач процесса и сохраняет число их опросов"""
+        attempts = {}
+        for job in self.scheduler.jobs():
+            for recipient in [job] + job.followers:
+                if recipient.db_request_id:
+                    attempts[recipient.db_request_id] = job.attempts
+        async with AsyncSessionLocal() as session:
+            return await JobQueueRepository.renew(
+                session,
+                self.worker_id,
+                self.lease_ttl,
+                attempts,
+                self.scheduler.poll_interval
+            )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.renew()
+                # Пачками, пока свободные задачи не закончатся
+                while await self.lease() >= self.batch_size:
+                    pass
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Job queue error: {e}")
+            await asyncio.sleep(self.lease_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает аренду и отпускает задачи процесса, чтобы их сразу подхватил следующий запуск"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            async with AsyncSessionLocal() as session:
+                released = await JobQueueRepository.release(session, self.worker_id)
+            if released:
+                logger.info(f"Released {released} jobs back to queue")
+        except Exception as e:
+            logger.error(f"Error releasing jobs: {e}")
+        self._owned.clear()
+
+
+def get_shared_job_queue(bot_data: Dict[str, Any]) -> Optional[DurableJobQueue]:
+    """Возвращает общую очередь задач приложения из bot_data (None, если очередь не создана)"""
+    return bot_data.get('job_queue')
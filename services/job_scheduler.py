@@ -0,0 +1,355 @@
+"""
+Центральный планировщик опроса статусов задач на сервере алгоритмов
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from server_client import AlgorithmServerClient
+from config import (
+    JOB_POLL_INTERVAL,
+    JOB_MAX_POLL_ATTEMPTS,
+    JOB_POLL_BATCH_SIZE,
+    JOB_POLL_MIN_INTERVAL,
+    JOB_POLL_MAX_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Статусы сервера, после которых задачу больше не нужно опрашивать
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class TrackedJob:
+    """Задача на сервере алгоритмов, статус которой отслеживает планировщик"""
+
+    __slots__ = (
+        'server_task_id',
+        'chat_id',
+        'user_id',
+        'db_request_id',
+        'file_path',
+        'algorithm_name',
+        'algorithm_id',
+        'content_hash',
+        'followers',
+        'attempts',
+        'last_status',
+        'submitted_at',
+        'group',
+        'file_size',
+        'expected_duration',
+        'timeout'
+    )
+
+    def __init__(
+        self,
+        server_task_id: str,
+        chat_id: int,
+        user_id: int,
+        db_request_id: Optional[str] = None,
+        file_path: Optional[str] = None,
+        algorithm_name: Optional[str] = None,
+        algorithm_id: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        group: Optional[Any] = None,
+        file_size: Optional[int] = None
+    ):
+        self.server_task_id = server_task_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.db_request_id = db_request_id
+        self.file_path = file_path
+        self.algorithm_name = algorithm_name
+        self.algorithm_id = algorithm_id
+        self.content_hash = content_hash
+        # Заявки с тем же файлом и алгоритмом, которые ждут результата этой задачи
+        self.followers: List['TrackedJob'] = []
+        self.attempts = 0
+        self.last_status: Optional[str] = None
+        self.submitted_at = time.time()
+        # Пакет файлов, к которому относится заявка (см. handlers/batch_handler.JobGroup)
+        self.group = group
+        self.file_size = file_size
+        # Ожидаемая длительность и таймаут (в секундах от submitted_at), задаются при track
+        self.expected_duration: Optional[float] = None
+        self.timeout: Optional[float] = None
+
+
+# on_status_change(job, status) - статус изменился, задача еще выполняется
+StatusChangeCallback = Callable[[TrackedJob, str], Awaitable[None]]
+# on_finished(job, status, error) - задача завершилась, упала или истекло время ожидания
+# status: 'completed', 'failed' или 'timeout'
+FinishedCallback = Callable[[TrackedJob, str, Optional[str]], Awaitable[None]]
+# estimator(job) - (ожидаемая длительность, таймаут) в секундах или (None, None), если прогноза нет
+Estimator = Callable[[TrackedJob], Tuple[Optional[float], Optional[float]]]
+
+
+class JobStatusScheduler:
+    """
+    Один фоновый цикл, который опрашивает все задачи в работе
+
+    Сроки следующего опроса хранятся в куче (due_time, seq, task_id), поэтому
+    вместо сотни спящих корутин работает один таймер. Задачи, у которых
+    подошел срок, опрашиваются пачками по batch_size - одним пакетным
+    запросом статусов на пачку (см. AlgorithmServerClient.check_status_many).
+
+    Если estimator дает прогноз длительности задачи, интервал до следующего
+    опроса - половина расстояния до ожидаемого завершения: в начале опросы
+    редкие, к ожидаемому завершению учащаются, а после него снова
+    разреживаются (в пределах min_interval..max_interval). Без прогноза
+    задача опрашивается каждые poll_interval секунд, таймаут -
+    poll_interval * max_attempts.
+
+    Если сервер сам присылает статусы задач (см. notify), задачи опрашиваются
+    только раз в push_interval - на случай потерянного уведомления.
+    """
+
+    def __init__(
+        self,
+        client: AlgorithmServerClient,
+        on_status_change: StatusChangeCallback,
+        on_finished: FinishedCallback,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        max_attempts: int = JOB_MAX_POLL_ATTEMPTS,
+        batch_size: int = JOB_POLL_BATCH_SIZE,
+        estimator: Optional[Estimator] = None,
+        min_interval: float = JOB_POLL_MIN_INTERVAL,
+        max_interval: float = JOB_POLL_MAX_INTERVAL
+    ):
+        self.client = client
+        self.on_status_change = on_status_change
+        self.on_finished = on_finished
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.estimator = estimator
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Интервал страховочного опроса, если сервер сам сообщает о завершении задач (см. notify)
+        self.push_interval: Optional[float] = None
+        self._jobs: Dict[str, TrackedJob] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._finishing: Set[asyncio.Task] = set()
+        self._status_checks = 0
+        self._pushed = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def track(self, job: TrackedJob, delay: Optional[float] = None) -> None:
+        """Добавляет задачу в планировщик, первый опрос - через delay секунд (по умолчанию - по прогнозу)"""
+        self.estimate(job)
+        self._jobs[job.server_task_id] = job
+        self._schedule(job.server_task_id, self.next_delay(job) if delay is None else delay)
+        self._wakeup.set()
+
+    def estimate(self, job: TrackedJob) -> None:
+        """Задает ожидаемую длительность и таймаут задачи, если они еще не заданы"""
+        if job.timeout is not None:
+            return
+        if self.estimator is not None:
+            try:
+                job.expected_duration, job.timeout = self.estimator(job)
+            except Exception as e:
+                logger.error(f"Error estimating job {job.server_task_id} duration: {e}")
+        if job.timeout is None:
+            job.timeout = self.poll_interval * self.max_attempts
+
+    def next_delay(self, job: TrackedJob) -> float:
+        """Интервал до следующего опроса задачи"""
+        if self.push_interval is not None:
+            return self.push_interval
+        if job.expected_duration is None:
+            return self.poll_interval
+        distance = abs(job.expected_duration - (time.time() - job.submitted_at))
+        return min(max(distance / 2, self.min_interval), self.max_interval)
+
+    def untrack(self, server_task_id: str) -> Optional[TrackedJob]:
+        """Убирает задачу из планировщика. Запись в куче удалится при следующем извлечении"""
+        return self._jobs.pop(server_task_id, None)
+
+    def get(self, server_task_id: str) -> Optional[TrackedJob]:
+        return self._jobs.get(server_task_id)
+
+    def detach(self, server_task_id: str, db_request_id: str) -> Tuple[Optional[TrackedJob], bool]:
+        """
+        Убирает заявку из отслеживаемой задачи (например, пользователь отменил анализ)
+
+        Если убрана основная заявка, ее место занимает первая присоединенная.
+
+        Returns:
+            (убранная заявка или None, True - у задачи не осталось заявок и она больше не отслеживается)
+        """
+        job = self._jobs.get(server_task_id)
+        if job is None:
+            return None, False
+        if job.db_request_id != db_request_id:
+            for follower in job.followers:
+                if follower.db_request_id == db_request_id:
+                    job.followers.remove(follower)
+                    return follower, False
+            return None, False
+        if not job.followers:
+            self.untrack(server_task_id)
+            return job, True
+        successor = job.followers.pop(0)
+        successor.followers = job.followers
+        successor.attempts = job.attempts
+        successor.last_status = job.last_status
+        successor.submitted_at = job.submitted_at
+        successor.expected_duration = job.expected_duration
+        successor.timeout = job.timeout
+        job.followers = []
+        self._jobs[server_task_id] = successor
+        return job, False
+
+    async def notify(self, server_task_id: str, status: str, error: Optional[str] = None) -> bool:
+        """
+        Статус задачи, присланный сервером алгоритмов (см. services/callback_server.py)
+
+        Завершенная задача обрабатывается сразу, не дожидаясь опроса.
+
+        Returns:
+            False, если задача не отслеживается этим процессом
+        """
+        job = self._jobs.get(server_task_id)
+        if job is None:
+            return False
+        self._pushed += 1
+        if error or status in TERMINAL_STATUSES:
+            self._finish(job, 'failed' if error else status, error)
+        elif status != job.last_status:
+            job.last_status = status
+            try:
+                await self.on_status_change(job, status)
+            except Exception as e:
+                logger.error(f"Error handling job status change: {e}")
+        return True
+
+    def jobs(self) -> List[TrackedJob]:
+        """Отслеживаемые задачи (присоединенные заявки - в followers)"""
+        return list(self._jobs.values())
+
+    def attach(self, server_task_id: str, follower: TrackedJob) -> bool:
+        """
+        Подписывает заявку на результат уже отслеживаемой задачи
+
+        Returns:
+            False, если задача уже завершилась или не отслеживается
+        """
+        job = self._jobs.get(server_task_id)
+        if job is None:
+            return False
+        # Заявка ждет ту же задачу - тот же прогноз и таймаут
+        follower.submitted_at = job.submitted_at
+        follower.expected_duration = job.expected_duration
+        follower.timeout = job.timeout
+        job.followers.append(follower)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика планировщика: задачи в работе, размер кучи, число проверок и HTTP-запросов статуса"""
+        return {
+            'jobs': len(self._jobs),
+            'scheduled': len(self._heap),
+            'finishing': len(self._finishing),
+            'status_checks': self._status_checks,
+            'pushed': self._pushed,
+            'status_requests': self.client.status_requests
+        }
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run(), name='job_status_scheduler')
+
+    async def stop(self) -> None:
+        """Останавливает цикл опроса и дожидается отправки уже завершенных задач"""
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._finishing:
+            await asyncio.gather(*self._finishing, return_exceptions=True)
+
+    def _schedule(self, server_task_id: str, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), server_task_id))
+
+    def _pop_due(self) -> List[TrackedJob]:
+        """Извлекает из кучи задачи, срок опроса которых наступил"""
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, server_task_id = heapq.heappop(self._heap)
+            job = self._jobs.get(server_task_id)
+            if job is not None:
+                due.append(job)
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            due = self._pop_due()
+            if not due:
+                timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for start in range(0, len(due), self.batch_size):
+                try:
+                    await self._poll_batch(due[start:start + self.batch_size])
+                except Exception as e:
+                    logger.error(f"Error polling job batch: {e}", exc_info=True)
+
+    async def _poll_batch(self, jobs: List[TrackedJob]) -> None:
+        statuses = await self.client.check_status_many(job.server_task_id for job in jobs)
+        self._status_checks += len(jobs)
+        changes = []
+        for job in jobs:
+            # Задачу могли убрать из планировщика, пока шел запрос
+            if job.server_task_id not in self._jobs:
+                continue
+            status, error = statuses.get(job.server_task_id, ('failed', "Статус не получен"))
+            job.attempts += 1
+
+            if error or status in TERMINAL_STATUSES:
+                self._finish(job, 'failed' if error else status, error)
+                continue
+            if time.time() - job.submitted_at >= job.timeout:
+                self._finish(job, 'timeout', None)
+                continue
+
+            if status != job.last_status:
+                job.last_status = status
+                changes.append(self.on_status_change(job, status))
+            self._schedule(job.server_task_id, self.next_delay(job))
+
+        if changes:
+            for result in await asyncio.gather(*changes, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error(f"Error handling job status change: {result}")
+
+    def _finish(self, job: TrackedJob, status: str, error: Optional[str]) -> None:
+        """Убирает задачу и обрабатывает завершение в отдельной задаче, не задерживая опрос"""
+        self.untrack(job.server_task_id)
+        job.last_status = status
+        task = asyncio.create_task(self._run_finished(job, status, error))
+        self._finishing.add(task)
+        task.add_done_callback(self._finishing.discard)
+
+    async def _run_finished(self, job: TrackedJob, status: str, error: Optional[str]) -> None:
+        try:
+            await self.on_finished(job, status, error)
+        except Exception as e:
+            logger.error(f"Error finishing job {job.server_task_id}: {e}", exc_info=True)
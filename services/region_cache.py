@@ -0,0 +1,56 @@
+"""
+Кэш региона по умолчанию: обновляется в фоне, чтобы создание заявки
+не обращалось за ним к БД
+"""
+import asyncio
+import logging
+import uuid
+from typing import Any, Dict, Optional
+from database.db_session import AsyncSessionLocal
+from database.repository import RegionRepository
+from config import REGION_CACHE_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class RegionCache:
+    """Хранит ID региона по умолчанию и периодически перечитывает его из БД"""
+
+    def __init__(self, refresh_interval: float = REGION_CACHE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.default_region_id: Optional[uuid.UUID] = None
+        self.loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                self.default_region_id = await RegionRepository.get_default_region_id(session)
+            self.loaded = True
+        except Exception as e:
+            # Остается прежнее значение, следующая попытка - через refresh_interval
+            logger.error(f"Error refreshing region cache: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def get_default_region_id(bot_data: Dict[str, Any]) -> Optional[uuid.UUID]:
+    """Возвращает ID региона по умолчанию из общего кэша (None, если кэш не загружен)"""
+    region_cache = bot_data.get('region_cache')
+    return region_cache.default_region_id if region_cache else None
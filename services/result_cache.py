@@ -0,0 +1,186 @@
+"""
+Кэш результатов анализа по содержимому файла и объединение одинаковых задач
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, Optional, Tuple
+from server_client import ResultFile
+from database.db_session import AsyncSessionLocal
+from database.models import ResultCacheEntry
+from database.repository import ResultCacheRepository
+from config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# Ключ кэша: (SHA-256 файла, ID алгоритма)
+CacheKey = Tuple[str, str]
+
+
+def _write_bytes(path: str, content: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ResultCache:
+    """
+    Кэш результатов с ключом (content_hash, algorithm_id)
+
+    Файлы результатов лежат в cache_dir, записи - в таблице result_cache. Запись
+    вытесняется, если ее не использовали дольше max_age секунд или если общий
+    объем кэша превышает max_bytes (сначала самые давно использованные).
+
+    Кроме того, кэш объединяет одинаковые задачи в работе: пока задача с тем же
+    ключом выполняется, новые заявки ждут ее результата вместо запуска своей.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = RESULT_CACHE_DIR,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        max_age: float = RESULT_CACHE_MAX_AGE
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Ключ -> future с server_task_id задачи в работе (None, если запуск не удался)
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight)
+        }
+
+    async def lookup(self, content_hash: str, algorithm_id: str) -> Optional[ResultCacheEntry]:
+        """Ищет готовый результат; запись без файла на диске и без file_id считается промахом"""
+        try:
+            async with AsyncSessionLocal() as session:
+                entry = await ResultCacheRepository.get(session, content_hash, algorithm_id)
+                if entry is not None and (entry.telegram_file_id or os.path.exists(entry.file_path)):
+                    await ResultCacheRepository.touch(session, entry.id)
+                    self.hits += 1
+                    return entry
+        except Exception as e:
+            logger.error(f"Error looking up result cache: {e}", exc_info=True)
+        self.misses += 1
+        return None
+
+    async def store(
+        self,
+        content_hash: str,
+        algorithm_id: str,
+        request_id: Optional[str],
+        result_id: Optional[str],
+        result: ResultFile
+    ) -> Optional[str]:
+        """
+        Кладет результат в кэш
+
+        Временный файл результата перемещается в каталог кэша (без копирования),
+        результат из памяти записывается на диск. После сохранения файл принадлежит
+        кэшу: result.path сбрасывается, и ResultFile.discard() его уже не удалит.
+
+        Returns:
+            Путь к файлу результата в кэше или None, если сохранить не удалось
+        """
+        loop = asyncio.get_running_loop()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = os.path.join(self.cache_dir, f"{content_hash}_{algorithm_id}")
+        try:
+            if result.path:
+                await loop.run_in_executor(None, os.replace, result.path, cache_path)
+            else:
+                await loop.run_in_executor(None, _write_bytes, cache_path, result.content or b'')
+        except OSError as e:
+            logger.error(f"Error writing result to cache: {e}")
+            return None
+        # Файл теперь принадлежит кэшу
+        result.path = None
+
+        try:
+            async with AsyncSessionLocal() as session:
+                previous_path = await ResultCacheRepository.upsert(
+                    session=session,
+                    content_hash=content_hash,
+                    algorithm_id=algorithm_id,
+                    request_id=request_id,
+                    result_id=result_id,
+                    file_path=cache_path,
+                    file_name=result.filename,
+                    file_size=result.size
+                )
+            if previous_path:
+                await loop.run_in_executor(None, _remove_file, previous_path)
+        except Exception:
+            # Файл возвращается вызывающему коду как временный и будет удален после отправки
+            result.path = cache_path
+            return None
+
+        await self.evict()
+        return cache_path
+
+    async def remember_file_id(self, content_hash: str, algorithm_id: str, telegram_file_id: str) -> None:
+        """Запоминает file_id отправленного результата для повторной отправки без загрузки"""
+        async with AsyncSessionLocal() as session:
+            await ResultCacheRepository.set_telegram_file_id(session, content_hash, algorithm_id, telegram_file_id)
+
+    async def evict(self) -> int:
+        """Удаляет устаревшие записи и записи сверх лимита объема, возвращает их число"""
+        try:
+            async with AsyncSessionLocal() as session:
+                evicted = await ResultCacheRepository.select_for_eviction(session, self.max_age, self.max_bytes)
+                if not evicted:
+                    return 0
+                await ResultCacheRepository.delete_entries(session, [entry_id for entry_id, _ in evicted])
+        except Exception as e:
+            logger.error(f"Error evicting result cache: {e}", exc_info=True)
+            return 0
+
+        loop = asyncio.get_running_loop()
+        for _, file_path in evicted:
+            await loop.run_in_executor(None, _remove_file, file_path)
+        logger.info(f"Evicted {len(evicted)} result cache entries")
+        return len(evicted)
+
+    def claim(self, key: CacheKey) -> Optional[asyncio.Future]:
+        """
+        Регистрирует запуск задачи с ключом key
+
+        Returns:
+            None - вызывающий запускает задачу сам и потом вызывает publish;
+            future - такая же задача уже запускается или выполняется, ее
+            server_task_id будет в future (None, если запуск не удался)
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def publish(self, key: CacheKey, server_task_id: Optional[str]) -> None:
+        """Сообщает ожидающим заявкам server_task_id запущенной задачи"""
+        future = self._inflight.get(key)
+        if future is not None and not future.done():
+            future.set_result(server_task_id)
+        if server_task_id is None:
+            self._inflight.pop(key, None)
+
+    def release(self, key: CacheKey, server_task_id: str) -> None:
+        """Задача server_task_id завершилась: следующие одинаковые заявки пойдут через кэш"""
+        future = self._inflight.get(key)
+        if future is not None and future.done() and future.result() == server_task_id:
+            del self._inflight[key]
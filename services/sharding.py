@@ -0,0 +1,278 @@
+"""
+Распределение обновлений по рабочим процессам: фронт получает обновления от
+Telegram и пересылает каждое процессу его пользователя
+"""
+import asyncio
+import hmac
+import logging
+import os
+import signal
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+import aiohttp
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from config import (
+    CALLBACK_PORT,
+    SHARD_BASE_PORT,
+    SHARD_FORWARD_RETRIES,
+    SHARD_HOST,
+    SHARD_MONITOR_INTERVAL,
+    SHARD_TOKEN,
+    SUBMIT_MAX_IN_FLIGHT,
+    SUBMIT_MAX_PER_ALGORITHM
+)
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(update: Update, shards: int) -> int:
+    """Номер рабочего процесса для обновления: все обновления пользователя попадают в один процесс"""
+    if update.effective_user:
+        key = update.effective_user.id
+    elif update.effective_chat:
+        key = update.effective_chat.id
+    else:
+        key = update.update_id
+    return key % shards
+
+
+class UpdateForwarder:
+    """
+    Пересылает обновления рабочим процессам (POST {url}/update)
+
+    Фронт обрабатывает обновления через PerUserUpdateProcessor, поэтому
+    обновления одного пользователя пересылаются по очереди и приходят в
+    процесс в том же порядке. Если процесс пользователя недоступен после
+    retries попыток, обновление получает следующий по кругу. Задачи в работе
+    хранятся в БД (analysis_jobs), но процесс забирает только задачи своих
+    пользователей: задачи недоступного процесса следующий по кругу забирает,
+    только если его номер указан в JOB_TAKEOVER_SHARDS.
+    """
+
+    def __init__(self, worker_urls: List[str], token: str = SHARD_TOKEN, retries: int = SHARD_FORWARD_RETRIES):
+        self.worker_urls = worker_urls
+        self.token = token
+        self.retries = retries
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.forwarded = 0
+        self.failovers = 0
+        self.dropped = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': len(self.worker_urls),
+            'forwarded': self.forwarded,
+            'failovers': self.failovers,
+            'dropped': self.dropped
+        }
+
+    async def start(self) -> None:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+
+    async def stop(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> bool:
+        for attempt in range(self.retries):
+            try:
+                async with self.session.post(
+                    f"{url}/update",
+                    json=payload,
+                    headers={'X-Shard-Token': self.token}
+                ) as response:
+                    if response.status == 200:
+                        return True
+                    logger.warning(f"Worker {url} rejected update: {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Worker {url} is unavailable: {e}")
+            # После последней попытки обновление сразу уходит следующему процессу
+            if attempt + 1 < self.retries:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        return False
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик фронта (TypeHandler): пересылает обновление рабочему процессу"""
+        shard = shard_of(update, len(self.worker_urls))
+        payload = update.to_dict()
+        for offset in range(len(self.worker_urls)):
+            url = self.worker_urls[(shard + offset) % len(self.worker_urls)]
+            if await self._post(url, payload):
+                self.forwarded += 1
+                if offset:
+                    self.failovers += 1
+                return
+        self.dropped += 1
+        logger.error(f"Update {update.update_id} was dropped: no worker is available")
+
+
+class WorkerPool:
+    """
+    Рабочие процессы на этой машине: python main.py с BOT_SHARD=i, который
+    слушает host:base_port+i. Упавший процесс перезапускается.
+
+    Порты уведомлений сервера алгоритмов у процессов разные (свой адрес
+    процесс получает подстановкой {port} в CALLBACK_URL), а лимиты задач на
+    сервере алгоритмов (SUBMIT_MAX_*) делятся между процессами поровну.
+    """
+
+    def __init__(self, count: int, host: str = SHARD_HOST, base_port: int = SHARD_BASE_PORT):
+        self.count = count
+        self.host = host
+        self.base_port = base_port
+        self._processes: List[Optional[subprocess.Popen]] = [None] * count
+        self._task: Optional[asyncio.Task] = None
+        self.restarts = 0
+
+    @property
+    def urls(self) -> List[str]:
+        return [f"http://{self.host}:{self.base_port + index}" for index in range(self.count)]
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        env = dict(
+            os.environ,
+            BOT_SHARD=str(index),
+            BOT_WORKERS=str(self.count),
+            SHARD_HOST=self.host,
+            SHARD_BASE_PORT=str(self.base_port),
+            CALLBACK_PORT=str(CALLBACK_PORT + index),
+            SUBMIT_MAX_IN_FLIGHT=str(max(1, SUBMIT_MAX_IN_FLIGHT // self.count)),
+            SUBMIT_MAX_PER_ALGORITHM=str(max(1, SUBMIT_MAX_PER_ALGORITHM // self.count))
+        )
+        return subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])], env=env)
+
+    async def start(self, ready_timeout: float = 60) -> None:
+        """Запускает процессы и ждет, пока они начнут принимать обновления"""
+        for index in range(self.count):
+            self._processes[index] = self._spawn(index)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ready_timeout
+        for index in range(self.count):
+            while True:
+                try:
+                    _, writer = await asyncio.open_connection(self.host, self.base_port + index)
+                    writer.close()
+                    await writer.wait_closed()
+                    break
+                except OSError:
+                    if loop.time() > deadline:
+                        logger.warning(f"Worker {index} is not ready after {ready_timeout:.0f}s")
+                        break
+                    await asyncio.sleep(0.5)
+        logger.info(f"Started {self.count} worker processes")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(SHARD_MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and process.poll() is not None:
+                    logger.error(f"Worker {index} exited with code {process.returncode}, restarting")
+                    self._processes[index] = self._spawn(index)
+                    self.restarts += 1
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Останавливает процессы (SIGTERM) и ждет, пока они отправят готовые результаты"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        processes = [process for process in self._processes if process is not None]
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            try:
+                await loop.run_in_executor(None, process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = [None] * self.count
+
+
+class ShardWorkerServer:
+    """Принимает обновления от фронта (POST /update) и ставит их в очередь приложения"""
+
+    def __init__(self, application: Application, host: str, port: int, token: str = SHARD_TOKEN):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.token = token
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'received': self.received, 'rejected': self.rejected}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get('X-Shard-Token', ''), self.token):
+            self.rejected += 1
+            return web.json_response({'error': 'invalid token'}, status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception:
+            self.rejected += 1
+            return web.json_response({'error': 'invalid update'}, status=400)
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return web.json_response({'ok': True})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/update', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Worker listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_worker(application: Application, host: str, port: int) -> None:
+    """
+    Жизненный цикл рабочего процесса - как run_polling (с post_init, post_stop
+    и post_shutdown), но обновления приходят от фронта, а не от Telegram
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: процесс остановится по KeyboardInterrupt
+            pass
+
+    server = ShardWorkerServer(application, host, port)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await stop.wait()
+    finally:
+        await server.stop()
+        logger.info(f"Статистика приема обновлений от фронта: {server.stats()}")
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,139 @@
+"""
+Буфер статусов заявок: неизменившиеся статусы отбрасываются, изменившиеся
+записываются в БД пачкой раз в интервал
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from database.db_session import AsyncSessionLocal
+from database.repository import REQUEST_STATUSES, RequestRepository
+from config import STATUS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Итоговые статусы заявки записываются сразу, не дожидаясь интервала
+TERMINAL_REQUEST_STATUSES = ('COMPLETED', 'ERROR', 'CANCELLED')
+
+
+class StatusUpdateBuffer:
+    """
+    Накапливает изменения статусов заявок и записывает их одним запросом
+
+    Для каждой заявки в буфере остается только последний статус, поэтому
+    за интервал flush_interval в БД уходит не больше одного UPDATE с одной
+    фиксацией транзакции на все заявки. Итоговый статус (COMPLETED/ERROR/CANCELLED)
+    записывается сразу вместе со всем накопленным.
+
+    Время первого статуса PROCESSING (запуск на сервере алгоритмов) запоминается
+    при вызове update и записывается вместе со статусом, даже если до записи
+    его успел сменить итоговый.
+    """
+
+    def __init__(self, flush_interval: float = STATUS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # Статусы, ожидающие записи: ID заявки -> статус
+        self._pending: Dict[str, str] = {}
+        # Время запуска заявок, ожидающее записи: ID заявки -> время
+        self._submitted: Dict[str, datetime] = {}
+        # Последний записанный статус незавершенных заявок
+        self._written: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.updates = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'updates': self.updates,
+            'dropped': self.dropped,
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'failures': self.failures
+        }
+
+    async def update(self, request_id: str, status: str) -> None:
+        """Ставит статус заявки в очередь на запись; итоговый статус записывается сразу"""
+        if status not in REQUEST_STATUSES:
+            logger.error(f"Invalid status: {status}")
+            return
+        request_id = str(request_id)
+        self.updates += 1
+        current = self._pending.get(request_id, self._written.get(request_id))
+        if current == status:
+            self.dropped += 1
+            return
+        self._pending[request_id] = status
+        if status == 'PROCESSING':
+            self._submitted.setdefault(request_id, datetime.now(timezone.utc))
+        if status in TERMINAL_REQUEST_STATUSES:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записывает накопленные статусы одним запросом, возвращает число обновленных заявок"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch = self._pending
+            submitted = self._submitted
+            self._pending = {}
+            self._submitted = {}
+            try:
+                async with AsyncSessionLocal() as session:
+                    written = await RequestRepository.update_statuses(session, batch, submitted)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Error flushing {len(batch)} request statuses: {e}")
+                # Возвращаем в буфер то, что не перезаписано более новым статусом
+                for request_id, status in batch.items():
+                    self._pending.setdefault(request_id, status)
+                for request_id, submitted_at in submitted.items():
+                    self._submitted.setdefault(request_id, submitted_at)
+                return 0
+
+            self.flushes += 1
+            self.rows_written += written
+            for request_id, status in batch.items():
+                if status in TERMINAL_REQUEST_STATUSES:
+                    self._written.pop(request_id, None)
+                else:
+                    self._written[request_id] = status
+            logger.debug(f"Flushed {len(batch)} request statuses")
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Status buffer error: {e}", exc_info=True)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и записывает оставшиеся статусы"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def get_shared_status_buffer(bot_data: Dict[str, Any]) -> StatusUpdateBuffer:
+    """Возвращает общий буфер статусов приложения из bot_data"""
+    status_buffer = bot_data.get('status_buffer')
+    if status_buffer is None:
+        status_buffer = StatusUpdateBuffer()
+        status_buffer.start()
+        bot_data['status_buffer'] = status_buffer
+    return status_buffer
@@ -0,0 +1,249 @@
+"""
+Допуск задач на сервер алгоритмов: ограничение числа задач в работе,
+справедливая очередь пользователей и приоритет модераторов
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import (
+    SUBMIT_ALGORITHM_LIMITS,
+    SUBMIT_MAX_IN_FLIGHT,
+    SUBMIT_MAX_PER_ALGORITHM,
+    SUBMIT_METRICS_INTERVAL,
+    SUBMIT_POSITION_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# on_position(position) - позиция заявки в очереди изменилась (1 - следующая)
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'algorithm_id', 'priority', 'turn', 'seq', 'future', 'queued_at')
+
+    def __init__(self, user_id: int, algorithm_id: str, priority: bool, turn: int, seq: int):
+        self.user_id = user_id
+        self.algorithm_id = algorithm_id
+        self.priority = priority
+        self.turn = turn
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+    def key(self):
+        return (not self.priority, self.turn, self.seq)
+
+
+class SubmissionScheduler:
+    """
+    Пропускает на сервер алгоритмов не больше max_in_flight задач одновременно
+
+    Задача занимает место с запуска (acquire) до завершения (finish), причем
+    на один алгоритм - не больше per_algorithm мест. Остальные заявки ждут в
+    очереди: модераторы - впереди всех, пользователи - по справедливой очереди
+    (start-time fair queueing): у каждой заявки есть номер хода, и пакет из
+    пятидесяти файлов одного пользователя не задерживает единственный файл
+    другого дольше, чем на один ход.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = SUBMIT_MAX_IN_FLIGHT,
+        per_algorithm: int = SUBMIT_MAX_PER_ALGORITHM,
+        algorithm_limits: Optional[Dict[str, int]] = None
+    ):
+        self.max_in_flight = max_in_flight
+        self.per_algorithm = per_algorithm
+        self.algorithm_limits = SUBMIT_ALGORITHM_LIMITS if algorithm_limits is None else algorithm_limits
+        self._in_flight = 0
+        self._by_algorithm: Dict[str, int] = {}
+        # Запущенные задачи: server_task_id -> алгоритм
+        self._running: Dict[str, str] = {}
+        self._waiters: List[_Waiter] = []
+        # Номер последнего хода пользователя и номер хода последней допущенной заявки
+        self._user_turn: Dict[int, int] = {}
+        self._virtual_turn = 0
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        # Метрики
+        self.admitted = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self._busy_seconds = 0.0
+        self._busy_since = time.monotonic()
+        self._started_at = time.monotonic()
+
+    def _limit(self, algorithm_id: str) -> int:
+        return self.algorithm_limits.get(algorithm_id, self.per_algorithm)
+
+    def _has_capacity(self, algorithm_id: str) -> bool:
+        return (
+            self._in_flight < self.max_in_flight
+            and self._by_algorithm.get(algorithm_id, 0) < self._limit(algorithm_id)
+        )
+
+    def _account(self) -> None:
+        """Накапливает занятость (задачи в работе x время) перед изменением числа задач"""
+        now = time.monotonic()
+        self._busy_seconds += self._in_flight * (now - self._busy_since)
+        self._busy_since = now
+
+    def _take(self, algorithm_id: str) -> None:
+        self._account()
+        self._in_flight += 1
+        self._by_algorithm[algorithm_id] = self._by_algorithm.get(algorithm_id, 0) + 1
+
+    def _free(self, algorithm_id: str) -> None:
+        self._account()
+        self._in_flight -= 1
+        count = self._by_algorithm.get(algorithm_id, 0) - 1
+        if count > 0:
+            self._by_algorithm[algorithm_id] = count
+        else:
+            self._by_algorithm.pop(algorithm_id, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Допускает лучшие по очереди заявки, для алгоритма которых есть место"""
+        while self._waiters and self._in_flight < self.max_in_flight:
+            eligible = [waiter for waiter in self._waiters if self._has_capacity(waiter.algorithm_id)]
+            if not eligible:
+                return
+            waiter = min(eligible, key=_Waiter.key)
+            self._waiters.remove(waiter)
+            self._take(waiter.algorithm_id)
+            self._virtual_turn = max(self._virtual_turn, waiter.turn)
+            self._record_wait(time.monotonic() - waiter.queued_at)
+            waiter.future.set_result(None)
+        if len(self._user_turn) > 1000:
+            # Ход пользователя не позже текущего ничем не отличается от отсутствующего
+            self._user_turn = {
+                user_id: turn for user_id, turn in self._user_turn.items() if turn > self._virtual_turn
+            }
+
+    def _record_wait(self, waited: float) -> None:
+        self.admitted += 1
+        self.wait_seconds += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def position(self, waiter: _Waiter) -> int:
+        """Позиция заявки в очереди (1 - следующая)"""
+        key = waiter.key()
+        return 1 + sum(1 for other in self._waiters if other.key() < key)
+
+    async def acquire(
+        self,
+        user_id: int,
+        algorithm_id: str,
+        priority: bool = False,
+        on_position: Optional[PositionCallback] = None
+    ) -> None:
+        """
+        Ждет места для новой задачи; затем вызывающий обязан вызвать bind
+        (задача запущена) или release (запустить не удалось)
+        """
+        if not self._waiters and self._has_capacity(algorithm_id):
+            self._take(algorithm_id)
+            self._record_wait(0.0)
+            return
+
+        turn = max(self._user_turn.get(user_id, -1) + 1, self._virtual_turn)
+        self._user_turn[user_id] = turn
+        waiter = _Waiter(user_id, algorithm_id, priority, turn, next(self._seq))
+        self._waiters.append(waiter)
+        # Заявки в очереди могут ждать только лимита своего алгоритма: если для алгоритма
+        # этой заявки место есть, она допускается сразу, а не после завершения чужой задачи
+        self._dispatch()
+        if waiter.future.done():
+            return
+        self.queued += 1
+        last_position = None
+        try:
+            while not waiter.future.done():
+                position = self.position(waiter)
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.debug(f"Failed to report queue position: {e}")
+                    continue
+                await asyncio.wait({waiter.future}, timeout=SUBMIT_POSITION_INTERVAL)
+        except BaseException:
+            if waiter.future.done():
+                # Место уже выделено, но не будет использовано
+                self.release(algorithm_id)
+            else:
+                waiter.future.cancel()
+                self._waiters.remove(waiter)
+            raise
+
+    def bind(self, server_task_id: str, algorithm_id: str) -> None:
+        """Место, полученное acquire, занято запущенной задачей до finish"""
+        self._running[server_task_id] = algorithm_id
+
+    def release(self, algorithm_id: str) -> None:
+        """Место, полученное acquire, не понадобилось (задачу не удалось запустить)"""
+        self._free(algorithm_id)
+
+    def occupy(self, server_task_id: str, algorithm_id: str) -> None:
+        """Учитывает задачу, запущенную до перезапуска бота (без ожидания, даже сверх лимита)"""
+        if server_task_id in self._running:
+            return
+        self._take(algorithm_id)
+        self._running[server_task_id] = algorithm_id
+
+    def finish(self, server_task_id: str) -> None:
+        """Задача завершилась: место отдается следующей заявке в очереди"""
+        algorithm_id = self._running.pop(server_task_id, None)
+        if algorithm_id is not None:
+            self._free(algorithm_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики: задачи в работе и в очереди, время ожидания, загрузка сервера"""
+        self._account()
+        elapsed = time.monotonic() - self._started_at
+        capacity_seconds = elapsed * self.max_in_flight
+        return {
+            'in_flight': self._in_flight,
+            'by_algorithm': dict(self._by_algorithm),
+            'queue_depth': len(self._waiters),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'avg_wait': self.wait_seconds / self.admitted if self.admitted else 0.0,
+            'max_wait': self.max_wait,
+            'utilization': self._in_flight / self.max_in_flight if self.max_in_flight else 0.0,
+            'avg_utilization': self._busy_seconds / capacity_seconds if capacity_seconds else 0.0
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(SUBMIT_METRICS_INTERVAL)
+            logger.info(f"Submission scheduler metrics: {self.stats()}")
+
+    def start(self) -> None:
+        """Запускает периодическую запись метрик в лог"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def get_shared_submission_scheduler(bot_data: Dict[str, Any]) -> SubmissionScheduler:
+    """Возвращает общий планировщик допуска задач приложения из bot_data"""
+    admission = bot_data.get('submission_scheduler')
+    if admission is None:
+        admission = SubmissionScheduler()
+        bot_data['submission_scheduler'] = admission
+    return admission
@@ -0,0 +1,178 @@
+"""
+Пул проверки файлов: inspect_file выполняется вне цикла событий
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from utils.file_validator import inspect_file
+from utils.image_header import ImageMetadata
+from config import (
+    VALIDATION_EXECUTOR,
+    VALIDATION_WORKERS,
+    VALIDATION_MAX_PENDING,
+    VALIDATION_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ValidationPool:
+    """
+    Выполняет inspect_file в пуле потоков или процессов
+
+    Одновременно проверяется не больше max_workers файлов, остальные ждут
+    в очереди. Если в очереди уже max_pending файлов, новый файл сразу
+    отклоняется, поэтому всплеск загрузок не расходует процессор и память
+    без ограничений. Проверка дольше timeout секунд прерывается для
+    вызывающего кода; слот пула освобождается только когда проверка
+    действительно закончится, чтобы зависшие проверки не накапливались.
+    """
+
+    def __init__(
+        self,
+        kind: str = VALIDATION_EXECUTOR,
+        max_workers: int = VALIDATION_WORKERS,
+        max_pending: int = VALIDATION_MAX_PENDING,
+        timeout: float = VALIDATION_TIMEOUT
+    ):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown validation executor: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(max_workers)
+        self.pending = 0
+        self.running = 0
+        self.started = 0
+        self.finished = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_latency = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                # spawn: дочерние процессы не наследуют потоки и цикл событий бота
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='validation'
+                )
+        return self._executor
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'workers': self.max_workers,
+            'queue_depth': self.pending,
+            'running': self.running,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'avg_wait': self.wait_seconds / self.started if self.started else 0.0,
+            'avg_latency': self.run_seconds / self.finished if self.finished else 0.0,
+            'max_latency': self.max_latency
+        }
+
+    def _on_done(self, started_at: float, future: Any) -> None:
+        """Проверка закончилась в пуле (в том числе после таймаута): освобождаем слот"""
+        self.running -= 1
+        self._slots.release()
+        if not future.cancelled():
+            self.finished += 1
+            latency = time.monotonic() - started_at
+            self.run_seconds += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    async def inspect(self, file_path: str, file_size: int) -> Tuple[Optional[ImageMetadata], Optional[str]]:
+        """
+        Проверяет файл в пуле (см. inspect_file)
+
+        Returns:
+            Tuple[Optional[ImageMetadata], Optional[str]]: (сведения об изображении или None, сообщение об ошибке если есть)
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Validation queue is full ({self.pending}), rejecting {file_path}")
+            return None, "Сейчас проверяется слишком много файлов. Попробуйте отправить файл позже."
+
+        queued_at = time.monotonic()
+        self.pending += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.pending -= 1
+        started_at = time.monotonic()
+        self.wait_seconds += started_at - queued_at
+
+        try:
+            try:
+                future = self._get_executor().submit(inspect_file, file_path, file_size)
+            except BrokenExecutor:
+                # Рабочий процесс упал (например, из-за нехватки памяти): пересоздаем пул
+                self.shutdown()
+                future = self._get_executor().submit(inspect_file, file_path, file_size)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.started += 1
+        self.running += 1
+        # Слот освобождает сама проверка: loop.call_soon_threadsafe из потока пула
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(
+            lambda f: loop.call_soon_threadsafe(self._on_done, started_at, f)
+        )
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # Еще не начатую проверку можно отменить, начатая дойдет до конца в пуле
+            future.cancel()
+            logger.warning(f"Validation of {file_path} timed out after {self.timeout:.0f}s")
+            return None, "Проверка файла заняла слишком много времени. Попробуйте другой файл."
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            future.cancel()
+            raise
+        except BrokenExecutor as e:
+            logger.error(f"Validation pool failed while checking {file_path}: {e}")
+            self.shutdown()
+            return None, "Не удалось проверить файл. Попробуйте отправить его снова."
+
+        self.completed += 1
+        latency = time.monotonic() - started_at
+        logger.info(
+            f"Validated {file_path} in {latency:.2f}s "
+            f"(queued {started_at - queued_at:.2f}s, queue depth {self.pending})"
+        )
+        return result
+
+    def shutdown(self) -> None:
+        """Останавливает пул, не дожидаясь незавершенных проверок"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def get_shared_validation_pool(bot_data: Dict[str, Any]) -> ValidationPool:
+    """Возвращает общий пул проверки файлов приложения из bot_data"""
+    pool = bot_data.get('validation_pool')
+    if pool is None:
+        pool = ValidationPool()
+        bot_data['validation_pool'] = pool
+    return pool
@@ -0,0 +1,423 @@
+"""
+Локальный сервер-заглушка алгоритмов
+
+Реализует API сервера алгоритмов, которое использует server_client.py,
+чтобы проверять работу бота и измерять производительность без сети
+и без реального сервера. Если при запуске задачи передан callback_url,
+заглушка сама сообщает боту о завершении или отмене задачи.
+
+Запуск:
+    python stub_server.py --port 8000
+    SIMULATE_ALGORITHM_SERVER=false ALGORITHM_SERVER_URL=http://localhost:8000 python main.py
+    (с уведомлениями о завершении - дополнительно CALLBACK_ENABLED=true)
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Dict, Optional, Set
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class StubTask:
+    """Задача на сервере-заглушке"""
+
+    __slots__ = (
+        'task_id',
+        'algorithm_id',
+        'user_id',
+        'bytes_received',
+        'created_at',
+        'cancelled',
+        'callback_url',
+        'callback_token'
+    )
+
+    def __init__(
+        self,
+        algorithm_id: str,
+        user_id: str,
+        bytes_received: int,
+        callback_url: Optional[str] = None,
+        callback_token: Optional[str] = None
+    ):
+        self.task_id = uuid.uuid4().hex
+        self.algorithm_id = algorithm_id
+        self.user_id = user_id
+        self.bytes_received = bytes_received
+        self.created_at = time.monotonic()
+        self.cancelled = False
+        self.callback_url = callback_url
+        self.callback_token = callback_token
+
+
+class StubUpload:
+    """Сессия загрузки по частям: сервер помнит, какие части уже получены"""
+
+    __slots__ = (
+        'upload_id',
+        'size',
+        'part_size',
+        'algorithm_id',
+        'user_id',
+        'received_parts',
+        'callback_url',
+        'callback_token'
+    )
+
+    def __init__(
+        self,
+        size: int,
+        part_size: int,
+        algorithm_id: str,
+        user_id: str,
+        callback_url: Optional[str] = None,
+        callback_token: Optional[str] = None
+    ):
+        self.upload_id = uuid.uuid4().hex
+        self.size = size
+        self.part_size = part_size
+        self.algorithm_id = algorithm_id
+        self.user_id = user_id
+        self.received_parts: Set[int] = set()
+        self.callback_url = callback_url
+        self.callback_token = callback_token
+
+    @property
+    def part_count(self) -> int:
+        return max(1, math.ceil(self.size / self.part_size))
+
+
+class StubServerState:
+    """Состояние сервера-заглушки и счетчики запросов"""
+
+    def __init__(self, processing_time: float, status_latency: float, part_fail_rate: float = 0):
+        self.processing_time = processing_time
+        # Искусственная задержка обработки одного запроса статуса (имитация сети и сервера)
+        self.status_latency = status_latency
+        # Доля частей загрузки, которые заглушка отклоняет с 503 (имитация обрывов)
+        self.part_fail_rate = part_fail_rate
+        self.tasks: Dict[str, StubTask] = {}
+        self.uploads: Dict[str, StubUpload] = {}
+        self.counters = {
+            'start_requests': 0,
+            'status_requests': 0,
+            'bulk_status_requests': 0,
+            'result_requests': 0,
+            'cancel_requests': 0,
+            'part_requests': 0,
+            'part_failures': 0,
+            'callbacks_sent': 0,
+            'callback_failures': 0
+        }
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._background: Set[asyncio.Task] = set()
+
+    def add_task(self, task: StubTask) -> None:
+        """Регистрирует задачу; если задан callback_url, по завершении бот получит уведомление"""
+        self.tasks[task.task_id] = task
+        if task.callback_url:
+            self.spawn(self._notify_when_done(task))
+
+    def spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _notify_when_done(self, task: StubTask) -> None:
+        await asyncio.sleep(self.processing_time)
+        if not task.cancelled:
+            await self.send_callback(task, 'completed')
+
+    async def send_callback(self, task: StubTask, status: str) -> None:
+        """Сообщает боту о статусе задачи (POST callback_url)"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        try:
+            async with self.session.post(
+                task.callback_url,
+                json={'task_id': task.task_id, 'status': status, 'error': None},
+                headers={'X-Callback-Token': task.callback_token or ''},
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                if response.status == 200:
+                    self.counters['callbacks_sent'] += 1
+                else:
+                    self.counters['callback_failures'] += 1
+                    logger.warning(f"Callback for task {task.task_id} rejected: {response.status}")
+        except Exception as e:
+            # Бот узнает статус страховочным опросом
+            self.counters['callback_failures'] += 1
+            logger.warning(f"Callback for task {task.task_id} failed: {e}")
+
+    async def close(self) -> None:
+        for task in list(self._background):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def status_of(self, task_id: str) -> Optional[Dict[str, Optional[str]]]:
+        task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        elapsed = time.monotonic() - task.created_at
+        if task.cancelled:
+            status = 'cancelled'
+        else:
+            status = 'completed' if elapsed >= self.processing_time else 'processing'
+        return {'status': status, 'error': None}
+
+
+async def start_analysis(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['start_requests'] += 1
+    reader = await request.multipart()
+    fields = {}
+    bytes_received = 0
+    async for part in reader:
+        if part.name == 'file':
+            # Файл читаем частями и не храним: заглушке важен только объем
+            while True:
+                chunk = await part.read_chunk(1024 * 1024)
+                if not chunk:
+                    break
+                bytes_received += len(chunk)
+        else:
+            fields[part.name] = await part.text()
+
+    task = StubTask(
+        fields.get('algorithm_id', 'unknown'),
+        fields.get('user_id', ''),
+        bytes_received,
+        fields.get('callback_url'),
+        fields.get('callback_token')
+    )
+    state.add_task(task)
+    logger.info(f"Started task {task.task_id}: {task.algorithm_id}, {bytes_received} bytes")
+    return web.json_response({'task_id': task.task_id})
+
+
+async def create_upload(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    data = await request.json()
+    upload = StubUpload(
+        int(data['size']),
+        int(data.get('part_size') or 8 * 1024 * 1024),
+        data.get('algorithm_id', 'unknown'),
+        data.get('user_id', ''),
+        data.get('callback_url'),
+        data.get('callback_token')
+    )
+    state.uploads[upload.upload_id] = upload
+    return web.json_response({
+        'upload_id': upload.upload_id,
+        'part_size': upload.part_size,
+        'received_parts': []
+    })
+
+
+async def upload_status(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    upload = state.uploads.get(request.match_info['upload_id'])
+    if upload is None:
+        return web.json_response({'error': 'upload not found'}, status=404)
+    return web.json_response({
+        'upload_id': upload.upload_id,
+        'part_size': upload.part_size,
+        'received_parts': sorted(upload.received_parts)
+    })
+
+
+async def upload_part(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['part_requests'] += 1
+    upload = state.uploads.get(request.match_info['upload_id'])
+    if upload is None:
+        return web.json_response({'error': 'upload not found'}, status=404)
+    part_number = int(request.match_info['part'])
+    if not 0 <= part_number < upload.part_count:
+        return web.json_response({'error': 'part out of range'}, status=400)
+
+    digest = hashlib.sha256()
+    length = 0
+    while True:
+        chunk = await request.content.read(1024 * 1024)
+        if not chunk:
+            break
+        digest.update(chunk)
+        length += len(chunk)
+
+    if state.part_fail_rate and random.random() < state.part_fail_rate:
+        state.counters['part_failures'] += 1
+        return web.json_response({'error': 'simulated failure'}, status=503)
+    expected_length = min(upload.part_size, upload.size - part_number * upload.part_size)
+    if length != expected_length:
+        return web.json_response({'error': 'wrong part length'}, status=400)
+    if digest.hexdigest() != request.headers.get('X-Part-SHA256'):
+        return web.json_response({'error': 'checksum mismatch'}, status=400)
+
+    upload.received_parts.add(part_number)
+    return web.json_response({'received': part_number})
+
+
+async def complete_upload(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    upload = state.uploads.get(request.match_info['upload_id'])
+    if upload is None:
+        return web.json_response({'error': 'upload not found'}, status=404)
+    missing = [n for n in range(upload.part_count) if n not in upload.received_parts]
+    if missing:
+        return web.json_response({'error': 'missing parts', 'missing_parts': missing}, status=409)
+
+    del state.uploads[upload.upload_id]
+    task = StubTask(upload.algorithm_id, upload.user_id, upload.size, upload.callback_url, upload.callback_token)
+    state.add_task(task)
+    logger.info(f"Started task {task.task_id} from upload {upload.upload_id}: {upload.size} bytes")
+    return web.json_response({'task_id': task.task_id})
+
+
+async def task_status(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['status_requests'] += 1
+    if state.status_latency:
+        await asyncio.sleep(state.status_latency)
+    info = state.status_of(request.match_info['task_id'])
+    if info is None:
+        return web.json_response({'error': 'task not found'}, status=404)
+    return web.json_response(info)
+
+
+async def tasks_status(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['bulk_status_requests'] += 1
+    if state.status_latency:
+        await asyncio.sleep(state.status_latency)
+    data = await request.json()
+    tasks = {}
+    for task_id in data.get('task_ids', []):
+        info = state.status_of(task_id)
+        if info is not None:
+            tasks[task_id] = info
+    return web.json_response({'tasks': tasks})
+
+
+async def cancel_task(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['cancel_requests'] += 1
+    task_id = request.match_info['task_id']
+    info = state.status_of(task_id)
+    if info is None:
+        return web.json_response({'error': 'task not found'}, status=404)
+    if info['status'] == 'completed':
+        return web.json_response({'error': 'task is already completed'}, status=409)
+    task = state.tasks[task_id]
+    task.cancelled = True
+    if task.callback_url:
+        state.spawn(state.send_callback(task, 'cancelled'))
+    logger.info(f"Cancelled task {task_id}")
+    return web.json_response({'status': 'cancelled'})
+
+
+async def task_result(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    state.counters['result_requests'] += 1
+    task_id = request.match_info['task_id']
+    info = state.status_of(task_id)
+    if info is None:
+        return web.Response(text='task not found', status=404)
+    if info['status'] != 'completed':
+        return web.Response(text='task is not completed', status=409)
+    task = state.tasks[task_id]
+    body = (
+        f"task_id: {task.task_id}\n"
+        f"algorithm_id: {task.algorithm_id}\n"
+        f"bytes_received: {task.bytes_received}\n"
+    ).encode('utf-8')
+    return web.Response(body=body, content_type='application/octet-stream')
+
+
+async def stats(request: web.Request) -> web.Response:
+    state: StubServerState = request.app['state']
+    return web.json_response({'tasks': len(state.tasks), **state.counters})
+
+
+def create_app(
+    processing_time: float = 30,
+    status_latency: float = 0,
+    bulk_status: bool = True,
+    resumable_upload: bool = True,
+    part_fail_rate: float = 0
+) -> web.Application:
+    """
+    Создает приложение сервера-заглушки
+
+    Args:
+        processing_time: Через сколько секунд задача считается завершенной
+        status_latency: Задержка обработки одного запроса статуса (в секундах)
+        bulk_status: Поддерживать ли пакетный эндпоинт POST /api/tasks/status
+        resumable_upload: Поддерживать ли загрузку по частям (/api/uploads)
+        part_fail_rate: Доля частей загрузки, отклоняемых с ошибкой 503
+    """
+    # Файлы читаются потоково, поэтому лимит размера тела запроса снят
+    app = web.Application(client_max_size=1 << 40)
+    app['state'] = StubServerState(processing_time, status_latency, part_fail_rate)
+
+    async def close_state(app: web.Application) -> None:
+        await app['state'].close()
+
+    app.on_cleanup.append(close_state)
+    app.router.add_post('/api/start_analysis', start_analysis)
+    app.router.add_get('/api/task/{task_id}/status', task_status)
+    app.router.add_get('/api/task/{task_id}/result', task_result)
+    app.router.add_post('/api/task/{task_id}/cancel', cancel_task)
+    app.router.add_get('/api/stats', stats)
+    if bulk_status:
+        app.router.add_post('/api/tasks/status', tasks_status)
+    if resumable_upload:
+        app.router.add_post('/api/uploads', create_upload)
+        app.router.add_get('/api/uploads/{upload_id}', upload_status)
+        app.router.add_put('/api/uploads/{upload_id}/parts/{part}', upload_part)
+        app.router.add_post('/api/uploads/{upload_id}/complete', complete_upload)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный сервер-заглушка алгоритмов")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--processing-time', type=float, default=30,
+                        help="время выполнения задачи в секундах")
+    parser.add_argument('--status-latency', type=float, default=0,
+                        help="задержка ответа на запрос статуса в секундах")
+    parser.add_argument('--no-bulk', action='store_true',
+                        help="не поддерживать пакетный запрос статусов")
+    parser.add_argument('--no-resumable', action='store_true',
+                        help="не поддерживать загрузку по частям")
+    parser.add_argument('--part-fail-rate', type=float, default=0,
+                        help="доля частей загрузки, отклоняемых с ошибкой 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    app = create_app(
+        args.processing_time,
+        args.status_latency,
+        not args.no_bulk,
+        not args.no_resumable,
+        args.part_fail_rate
+    )
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
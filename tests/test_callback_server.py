@@ -0,0 +1,114 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from services.callback_server import CALLBACK_PATH, CallbackServer
+from stub_server import StubServerState, StubTask
+
+TOKEN = 'callback-secret'
+
+
+class FakeScheduler:
+    def __init__(self, known):
+        self.known = set(known)
+        self.notified = []
+
+    async def notify(self, server_task_id, status, error=None):
+        self.notified.append((server_task_id, status, error))
+        return server_task_id in self.known
+
+
+async def start_callback_server(scheduler):
+    callback = CallbackServer(scheduler, token=TOKEN)
+    app = web.Application()
+    app.router.add_post(CALLBACK_PATH, callback.handle)
+    server = TestServer(app)
+    await server.start_server()
+    return callback, server
+
+
+def stub_task(server, token=TOKEN):
+    """Задача сервера-заглушки, который шлет уведомления на server"""
+    return StubTask('alg', '1', 0, str(server.make_url(CALLBACK_PATH)), token)
+
+
+def test_callback_with_wrong_token_is_rejected():
+    async def scenario():
+        scheduler = FakeScheduler(known=[])
+        callback, server = await start_callback_server(scheduler)
+        stub = StubServerState(processing_time=0, status_latency=0)
+        try:
+            await stub.send_callback(stub_task(server, token='wrong'), 'completed')
+            await stub.send_callback(stub_task(server, token=None), 'completed')
+        finally:
+            await stub.close()
+            await server.close()
+        assert stub.counters['callback_failures'] == 2
+        assert scheduler.notified == []
+        assert callback.stats() == {'received': 0, 'unknown': 0, 'rejected': 2}
+
+    asyncio.run(scenario())
+
+
+def test_callback_with_bad_body_is_rejected():
+    async def scenario():
+        scheduler = FakeScheduler(known=[])
+        callback, server = await start_callback_server(scheduler)
+        url = str(server.make_url(CALLBACK_PATH))
+        headers = {'X-Callback-Token': TOKEN}
+        statuses = []
+        try:
+            async with aiohttp.ClientSession() as session:
+                for body in (b'not json', b'{"task_id": "t1"}', b'{"status": "completed"}', b'[]'):
+                    async with session.post(url, data=body, headers=headers) as response:
+                        statuses.append(response.status)
+        finally:
+            await server.close()
+        assert statuses == [400, 400, 400, 400]
+        assert scheduler.notified == []
+        assert callback.stats() == {'received': 0, 'unknown': 0, 'rejected': 4}
+
+    asyncio.run(scenario())
+
+
+def test_callback_for_known_task_is_passed_to_scheduler():
+    async def scenario():
+        scheduler = FakeScheduler(known=[])
+        callback, server = await start_callback_server(scheduler)
+        stub = StubServerState(processing_time=0, status_latency=0)
+        task = stub_task(server)
+        scheduler.known.add(task.task_id)
+        try:
+            # Заглушка сама сообщает о завершении задачи
+            stub.add_task(task)
+            for _ in range(100):
+                if stub.counters['callbacks_sent']:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await stub.close()
+            await server.close()
+        assert scheduler.notified == [(task.task_id, 'completed', None)]
+        assert stub.counters['callbacks_sent'] == 1
+        assert callback.stats() == {'received': 1, 'unknown': 0, 'rejected': 0}
+
+    asyncio.run(scenario())
+
+
+def test_callback_for_unknown_task_is_accepted_and_counted():
+    async def scenario():
+        scheduler = FakeScheduler(known=[])
+        callback, server = await start_callback_server(scheduler)
+        stub = StubServerState(processing_time=0, status_latency=0)
+        try:
+            task = stub_task(server)
+            await stub.send_callback(task, 'cancelled')
+        finally:
+            await stub.close()
+            await server.close()
+        # Задачу отслеживает другой процесс: заглушка не должна повторять уведомление
+        assert (stub.counters['callbacks_sent'], stub.counters['callback_failures']) == (1, 0)
+        assert scheduler.notified == [(task.task_id, 'cancelled', None)]
+        assert callback.stats() == {'received': 1, 'unknown': 1, 'rejected': 0}
+
+    asyncio.run(scenario())
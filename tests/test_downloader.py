@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import utils.downloader as downloader_module
+from utils.downloader import DownloadError, TelegramFileDownloader
+
+TOKEN = '123456:SECRET-bot-token'
+SEGMENT = 1024
+
+
+class FakeFile:
+    def __init__(self, file_path, file_size):
+        self.file_path = file_path
+        self.file_size = file_size
+
+
+async def start_file_server(handler):
+    app = web.Application()
+    app.router.add_get('/file/bot{token}/{name}', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def downloader_log(caplog):
+    """Записи лога бота (журнал доступа тестового сервера содержит URL по определению)"""
+    return "\n".join(record.getMessage() for record in caplog.records if record.name == 'utils.downloader')
+
+
+def download(tmp_path, handler, file_size):
+    async def scenario():
+        server = await start_file_server(handler)
+        downloader = TelegramFileDownloader(ranged_threshold=SEGMENT, max_segments=4, segment_size=SEGMENT)
+        url = str(server.make_url(f'/file/bot{TOKEN}/photo.tif'))
+        try:
+            await downloader.download(FakeFile(url, file_size), str(tmp_path / 'photo.tif'))
+        finally:
+            await downloader.close()
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_download_does_not_expose_bot_token(tmp_path, caplog):
+    async def handler(request):
+        return web.Response(status=404, reason='Not Found')
+
+    with caplog.at_level(logging.DEBUG), pytest.raises(DownloadError) as error:
+        download(tmp_path, handler, file_size=100)
+    assert str(error.value) == "HTTP 404 Not Found"
+    assert error.value.__context__ is None
+    assert TOKEN not in downloader_log(caplog)
+    assert not os.path.exists(tmp_path / 'photo.tif')
+
+
+def test_failed_range_does_not_expose_bot_token(tmp_path, caplog, monkeypatch):
+    monkeypatch.setattr(downloader_module, 'SEGMENT_RETRIES', 2)
+    data = os.urandom(SEGMENT * 3)
+
+    async def handler(request):
+        if request.headers.get('Range') == f"bytes=0-{SEGMENT - 1}":
+            return web.Response(
+                status=206,
+                body=data[:SEGMENT],
+                headers={'Content-Range': f"bytes 0-{SEGMENT - 1}/{len(data)}"}
+            )
+        return web.Response(status=503, reason='Service Unavailable')
+
+    with caplog.at_level(logging.DEBUG), pytest.raises(DownloadError) as error:
+        download(tmp_path, handler, file_size=len(data))
+    assert str(error.value) == "HTTP 503 Service Unavailable"
+    assert "failed (HTTP 503 Service Unavailable), retrying" in downloader_log(caplog)
+    assert TOKEN not in downloader_log(caplog)
@@ -0,0 +1,201 @@
+import asyncio
+from handlers import batch_handler
+from handlers.batch_handler import FileBatch, JobGroup
+from handlers.file_handler import _start_submission, _submit_job, cancel_user_jobs
+from services.job_scheduler import TrackedJob
+from services.submission_scheduler import SubmissionScheduler
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.texts.append(text)
+
+
+class FakeStatusBuffer:
+    def __init__(self):
+        self.statuses = {}
+
+    async def update(self, request_id, status):
+        self.statuses[request_id] = status
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.tracked = []
+
+    def track(self, job, delay=None):
+        self.tracked.append(job)
+
+    def jobs(self):
+        return []
+
+
+class FakeClient:
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+
+    async def start_analysis(self, algorithm_id, file_path, user_id):
+        self.started.append(file_path)
+        return True, f"task-{len(self.started)}", None
+
+    async def cancel_task(self, server_task_id):
+        self.cancelled.append(server_task_id)
+        return True, None
+
+
+class FakeBot:
+    async def send_message(self, chat_id, text, reply_markup=None):
+        return FakeMessage()
+
+
+class FakeApplication:
+    def __init__(self, admission):
+        self.bot_data = {
+            'submission_scheduler': admission,
+            'status_buffer': FakeStatusBuffer(),
+            'job_scheduler': FakeScheduler(),
+            'server_client': FakeClient()
+        }
+        self.bot = FakeBot()
+        self.user_data = {}
+
+    def create_task(self, coroutine):
+        return asyncio.create_task(coroutine)
+
+    def mark_data_for_update_persistence(self, chat_ids=None, user_ids=None):
+        pass
+
+
+def make_job(user_id, request_id):
+    job = TrackedJob(
+        server_task_id='',
+        chat_id=user_id,
+        user_id=user_id,
+        db_request_id=request_id,
+        file_path=f"/nonexistent/{request_id}.tif",
+        algorithm_name='A',
+        algorithm_id='x'
+    )
+    return job
+
+
+def make_group(user_id, file_names):
+    batch = FileBatch(user_id, user_id, None, {'name': 'A', 'id': 'x'}, auto=False)
+    batch.items = [(None, file_name) for file_name in file_names]
+    return batch, JobGroup(batch)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_queued_submission_does_not_block_and_can_be_cancelled():
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=1, per_algorithm=1, algorithm_limits={})
+        await admission.acquire(99, 'x')
+        admission.bind('busy', 'x')
+        application = FakeApplication(admission)
+        application.user_data[1] = {'db_request_id': 'r1', 'state': 'processing'}
+        message = FakeMessage()
+
+        # Обработчик только ставит заявку в очередь и сразу возвращается
+        _start_submission(application, make_job(1, 'r1'), message, False)
+        await settle()
+        assert admission.stats()['queue_depth'] == 1
+        assert "Позиция в очереди: 1" in message.texts[-1]
+
+        assert await cancel_user_jobs(application, 1) == 1
+        assert admission.stats()['queue_depth'] == 0
+        assert application.bot_data['status_buffer'].statuses == {'r1': 'CANCELLED'}
+        assert application.bot_data['server_client'].started == []
+        assert application.bot_data['pending_submissions'] == {}
+
+    asyncio.run(scenario())
+
+
+def test_queued_batch_is_cancelled(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    batch, group = make_group(1, ['a.tif', 'b.tif'])
+    jobs = [make_job(1, 'r1'), make_job(1, 'r2')]
+    for job in jobs:
+        job.group = group
+
+    async def prepare_item(application, group, file, file_name, semaphore):
+        return file_name, None
+
+    async def create_jobs(application, batch, group, ready):
+        return jobs
+
+    monkeypatch.setattr(batch_handler, '_prepare_item', prepare_item)
+    monkeypatch.setattr(batch_handler, '_create_jobs', create_jobs)
+
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=1, per_algorithm=1, algorithm_limits={})
+        await admission.acquire(99, 'x')
+        admission.bind('busy', 'x')
+        application = FakeApplication(admission)
+        application.user_data[1] = {'state': 'processing', 'batch_group': group}
+
+        run = asyncio.create_task(batch_handler._run_batch(application, batch, group))
+        await settle()
+        assert admission.stats()['queue_depth'] == 2
+        assert set(application.bot_data['pending_submissions'][1].values()) == set(jobs)
+
+        assert await cancel_user_jobs(application, 1) == 2
+        await asyncio.wait_for(run, 1)
+        assert group.closed
+        assert admission.stats()['queue_depth'] == 0
+        assert application.bot_data['status_buffer'].statuses == {'r1': 'CANCELLED', 'r2': 'CANCELLED'}
+        assert application.bot_data['server_client'].started == []
+        assert application.bot_data['pending_submissions'] == {}
+
+    asyncio.run(scenario())
+
+
+def test_batch_cancelled_during_upload_stops_server_task():
+    _, group = make_group(1, ['a.tif'])
+    job = make_job(1, 'r1')
+    job.group = group
+
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=1, per_algorithm=1, algorithm_limits={})
+        application = FakeApplication(admission)
+        client = application.bot_data['server_client']
+        start_analysis = client.start_analysis
+
+        async def start_and_cancel(algorithm_id, file_path, user_id):
+            # Пользователь отменяет пакет, пока файл загружается
+            await group.cancel()
+            return await start_analysis(algorithm_id, file_path, user_id)
+
+        client.start_analysis = start_and_cancel
+        assert await _submit_job(application, job) == ('cancelled', None)
+        assert client.cancelled == ['task-1']
+        assert admission.stats()['in_flight'] == 0
+        assert application.bot_data['job_scheduler'].tracked == []
+        assert application.bot_data['status_buffer'].statuses == {'r1': 'CANCELLED'}
+
+    asyncio.run(scenario())
+
+
+def test_submission_starts_in_background():
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=1, per_algorithm=1, algorithm_limits={})
+        application = FakeApplication(admission)
+        application.user_data[1] = {'db_request_id': 'r1', 'state': 'processing'}
+        message = FakeMessage()
+
+        _start_submission(application, make_job(1, 'r1'), message, False)
+        await settle()
+        assert application.user_data[1]['server_task_id'] == 'task-1'
+        assert application.bot_data['status_buffer'].statuses == {'r1': 'PROCESSING'}
+        assert [job.server_task_id for job in application.bot_data['job_scheduler'].tracked] == ['task-1']
+        assert message.texts[-1].startswith("✅ Анализ запущен!")
+        assert application.bot_data['pending_submissions'] == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+from sqlalchemy.dialects import postgresql
+from database.repository import JobQueueRepository
+from services.job_queue import DurableJobQueue
+
+
+class FakeResult:
+    def mappings(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class FakeSession:
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult()
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def compile_sql(statement):
+    compiled = statement.compile(dialect=postgresql.dialect())
+    return str(compiled), compiled.params
+
+
+def test_lease_is_limited_to_worker_shards():
+    session = FakeSession()
+    asyncio.run(JobQueueRepository.lease(session, 'w1', 60, 10, shard_count=4, shards=[1, 2]))
+    sql, params = compile_sql(session.statements[0])
+    assert 'analysis_jobs.user_id %' in sql
+    assert 4 in params.values()
+    assert [1, 2] in params.values()
+
+
+def test_lease_without_shards_takes_all_users():
+    session = FakeSession()
+    asyncio.run(JobQueueRepository.lease(session, 'w1', 60, 10))
+    sql, _ = compile_sql(session.statements[0])
+    assert 'user_id %' not in sql
+
+
+def test_queue_shards_include_explicit_takeover():
+    assert DurableJobQueue(None, shard=None, shard_count=4).shards is None
+    assert DurableJobQueue(None, shard=1, shard_count=4, takeover_shards=[]).shards == [1]
+    assert DurableJobQueue(None, shard=1, shard_count=4, takeover_shards=[2]).shards == [1, 2]
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import server_client
+from server_client import AlgorithmServerClient
+from stub_server import StubTask, create_app
+
+PART_SIZE = 64 * 1024
+
+
+@pytest.fixture
+def resumable(monkeypatch, tmp_path):
+    """Загрузка по частям для маленьких файлов, по одной части за раз"""
+    monkeypatch.setattr(server_client, 'RESUMABLE_UPLOAD_THRESHOLD', 1)
+    monkeypatch.setattr(server_client, 'UPLOAD_PART_SIZE', PART_SIZE)
+    monkeypatch.setattr(server_client, 'UPLOAD_PARALLEL_PARTS', 1)
+    monkeypatch.setattr(server_client, 'UPLOAD_STATE_DIR', str(tmp_path / 'state'))
+    return tmp_path
+
+
+async def start_stub(app):
+    server = TestServer(app)
+    await server.start_server()
+    client = AlgorithmServerClient(base_url=str(server.make_url('')).rstrip('/'), simulate=False)
+    return server, client
+
+
+def test_upload_resumes_after_interruption(resumable):
+    file_path = resumable / 'field.tif'
+    file_path.write_bytes(os.urandom(PART_SIZE * 5 + 100))
+    part_count = 6
+    interrupt_at = 3
+
+    async def scenario():
+        app = create_app(processing_time=30)
+        parts_seen = []
+        stalled = asyncio.Event()
+        release = asyncio.Event()
+
+        @web.middleware
+        async def interrupt(request, handler):
+            if '/parts/' in request.path:
+                parts_seen.append(int(request.match_info['part']))
+                if len(parts_seen) == interrupt_at + 1 and not release.is_set():
+                    # Соединение обрывается посреди части: бот перезапускается
+                    stalled.set()
+                    await release.wait()
+                    return web.json_response({'error': 'interrupted'}, status=503)
+            return await handler(request)
+
+        app.middlewares.append(interrupt)
+        server, client = await start_stub(app)
+        state = app['state']
+        try:
+            upload = asyncio.create_task(client.start_analysis('alg', str(file_path), 42))
+            await asyncio.wait_for(stalled.wait(), 10)
+            upload.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await upload
+            await client.close()
+            release.set()
+            (upload_id, pending), = state.uploads.items()
+            assert pending.received_parts == set(range(interrupt_at))
+            assert len(os.listdir(server_client.UPLOAD_STATE_DIR)) == 1
+
+            parts_seen.clear()
+            restarted = AlgorithmServerClient(base_url=client.base_url, simulate=False)
+            try:
+                ok, task_id, error = await restarted.start_analysis('alg', str(file_path), 42)
+            finally:
+                await restarted.close()
+            assert (ok, error) == (True, None)
+            assert sorted(parts_seen) == list(range(interrupt_at, part_count))
+            assert state.tasks[task_id].bytes_received == file_path.stat().st_size
+            assert upload_id not in state.uploads
+            assert os.listdir(server_client.UPLOAD_STATE_DIR) == []
+        finally:
+            release.set()
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_part_returns_without_waiting_after_last_attempt(resumable, monkeypatch):
+    monkeypatch.setattr(server_client, 'UPLOAD_PART_RETRIES', 1)
+    file_path = resumable / 'field.tif'
+    file_path.write_bytes(os.urandom(PART_SIZE * 2))
+
+    async def scenario():
+        app = create_app(processing_time=30, part_fail_rate=1)
+        server, client = await start_stub(app)
+        try:
+            started = asyncio.get_running_loop().time()
+            ok, task_id, error = await client.start_analysis('alg', str(file_path), 42)
+            elapsed = asyncio.get_running_loop().time() - started
+        finally:
+            await client.close()
+            await server.close()
+        assert (ok, task_id) == (False, None)
+        assert error == "Не удалось загрузить 2 из 2 частей файла"
+        assert elapsed < 0.5
+
+    asyncio.run(scenario())
+
+
+def test_status_falls_back_to_single_requests_without_bulk_endpoint():
+    async def scenario():
+        app = create_app(processing_time=30, bulk_status=False)
+        server, client = await start_stub(app)
+        state = app['state']
+        try:
+            tasks = [StubTask('alg', '1', 0) for _ in range(3)]
+            for task in tasks:
+                state.add_task(task)
+            tasks[0].cancelled = True
+            task_ids = [task.task_id for task in tasks]
+
+            statuses = await client.check_status_many(task_ids + ['missing'])
+            assert client.bulk_status_supported is False
+            assert statuses[task_ids[0]] == ('cancelled', None)
+            assert statuses[task_ids[1]] == ('processing', None)
+            assert statuses['missing'] == ('failed', "Задача не найдена")
+            assert state.counters['status_requests'] == 4
+
+            # Пакетный эндпоинт больше не запрашивается
+            requests = client.status_requests
+            await client.check_status_many(task_ids)
+            assert client.status_requests == requests + 3
+            assert state.counters['bulk_status_requests'] == 0
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_status_uses_bulk_endpoint_when_supported():
+    async def scenario():
+        app = create_app(processing_time=30)
+        server, client = await start_stub(app)
+        state = app['state']
+        try:
+            tasks = [StubTask('alg', '1', 0) for _ in range(3)]
+            for task in tasks:
+                state.add_task(task)
+            statuses = await client.check_status_many([task.task_id for task in tasks])
+            assert set(statuses.values()) == {('processing', None)}
+            assert client.bulk_status_supported is True
+            assert state.counters['bulk_status_requests'] == 1
+            assert state.counters['status_requests'] == 0
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_task(tmp_path):
+    file_path = tmp_path / 'field.png'
+    file_path.write_bytes(os.urandom(1024))
+
+    async def scenario():
+        app = create_app(processing_time=30)
+        server, client = await start_stub(app)
+        state = app['state']
+        try:
+            ok, task_id, error = await client.start_analysis('alg', str(file_path), 42)
+            assert (ok, error) == (True, None)
+            assert state.tasks[task_id].bytes_received == 1024
+
+            assert await client.cancel_task(task_id) == (True, None)
+            assert await client.check_status(task_id) == ('cancelled', None)
+            # Неизвестная серверу задача считается остановленной
+            assert await client.cancel_task('missing') == (True, None)
+
+            state.processing_time = 0
+            completed = StubTask('alg', '1', 0)
+            state.add_task(completed)
+            assert await client.cancel_task(completed.task_id) == (False, "Задача уже завершена")
+            assert state.counters['cancel_requests'] == 3
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(scenario())
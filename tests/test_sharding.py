@@ -0,0 +1,58 @@
+import asyncio
+import socket
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from telegram import Update
+from services.sharding import UpdateForwarder
+
+
+def make_update(user_id):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'user'}
+    return Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+            'text': 'hello'
+        }
+    }, None)
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_update_fails_over_without_waiting_after_last_attempt():
+    async def scenario():
+        received = []
+
+        async def handle(request):
+            received.append(await request.json())
+            return web.json_response({'ok': True})
+
+        app = web.Application()
+        app.router.add_post('/update', handle)
+        worker = TestServer(app)
+        await worker.start_server()
+        dead = f"http://127.0.0.1:{unused_port()}"
+        forwarder = UpdateForwarder([dead, str(worker.make_url('')).rstrip('/')], token='t', retries=2)
+        await forwarder.start()
+        try:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            # Пользователь 0 относится к недоступному процессу 0
+            await forwarder.forward(make_update(0), None)
+            elapsed = loop.time() - started
+        finally:
+            await forwarder.stop()
+            await worker.close()
+        assert [update['update_id'] for update in received] == [1]
+        assert forwarder.stats() == {'workers': 2, 'forwarded': 1, 'failovers': 1, 'dropped': 0}
+        # Одна пауза 0.5 с между двумя попытками, после последней - сразу следующий процесс
+        assert 0.5 <= elapsed < 1.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,73 @@
+import asyncio
+from sqlalchemy.dialects import postgresql
+import services.status_buffer as status_buffer_module
+from database.repository import RequestRepository
+from services.status_buffer import StatusUpdateBuffer
+
+REQUEST_ID = '00000000-0000-0000-0000-000000000001'
+
+
+class FakeResult:
+    rowcount = 1
+
+    def all(self):
+        return []
+
+
+class FakeSession:
+    def __init__(self):
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult()
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def test_submission_time_survives_terminal_status(monkeypatch):
+    calls = []
+
+    async def update_statuses(session, statuses, submitted=None):
+        calls.append((dict(statuses), dict(submitted or {})))
+        return len(statuses)
+
+    monkeypatch.setattr(status_buffer_module, 'AsyncSessionLocal', FakeSession)
+    monkeypatch.setattr(RequestRepository, 'update_statuses', staticmethod(update_statuses))
+
+    async def scenario():
+        buffer = StatusUpdateBuffer()
+        await buffer.update(REQUEST_ID, 'PROCESSING')
+        # Итоговый статус сменил PROCESSING до записи - время запуска все равно записывается
+        await buffer.update(REQUEST_ID, 'COMPLETED')
+        statuses, submitted = calls[-1]
+        assert statuses == {REQUEST_ID: 'COMPLETED'}
+        assert set(submitted) == {REQUEST_ID}
+
+    asyncio.run(scenario())
+
+
+def test_update_statuses_keeps_first_submission_time():
+    session = FakeSession()
+    asyncio.run(RequestRepository.update_statuses(session, {REQUEST_ID: 'PROCESSING'}, {}))
+    sql = str(session.statements[0].compile(dialect=postgresql.dialect()))
+    assert 'submitted_at=coalesce(analysis_requests.submitted_at, new_statuses.submitted_at)' in sql
+
+
+def test_durations_are_measured_from_submission():
+    session = FakeSession()
+    asyncio.run(RequestRepository.get_duration_percentiles(session, [16 * 1024 * 1024], 86400))
+    sql = str(session.statements[0].compile(dialect=postgresql.dialect()))
+    assert 'results.created_at - analysis_requests.submitted_at' in sql
+    assert 'analysis_requests.submitted_at IS NOT NULL' in sql
+
@@ -0,0 +1,59 @@
+import asyncio
+from services.submission_scheduler import SubmissionScheduler
+
+
+async def settle():
+    """Дает ожидающим задачам продолжиться после допуска"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_idle_algorithm_is_not_blocked_by_capped_waiter():
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=10, per_algorithm=1, algorithm_limits={})
+        await admission.acquire(1, 'x')
+        admission.bind('task-x', 'x')
+        # Вторая заявка алгоритма x ждет лимита своего алгоритма
+        blocked = asyncio.create_task(admission.acquire(2, 'x'))
+        await settle()
+        assert not blocked.done()
+        # Для алгоритма y место есть - заявка не ждет в очереди за заявкой x
+        await asyncio.wait_for(admission.acquire(3, 'y'), timeout=1)
+        assert admission.stats()['in_flight'] == 2
+        assert not blocked.done()
+        admission.finish('task-x')
+        await asyncio.wait_for(blocked, timeout=1)
+        assert admission.stats()['by_algorithm'] == {'x': 1, 'y': 1}
+
+    asyncio.run(scenario())
+
+
+def test_fair_order_when_server_is_full():
+    async def scenario():
+        admission = SubmissionScheduler(max_in_flight=1, per_algorithm=1, algorithm_limits={})
+        await admission.acquire(1, 'x')
+        admission.bind('first', 'x')
+        order = []
+
+        async def submit(user_id, algorithm_id):
+            await admission.acquire(user_id, algorithm_id)
+            order.append(user_id)
+            admission.bind(f'task-{user_id}', algorithm_id)
+
+        # Три файла пользователя 2 и один файл пользователя 3
+        tasks = [asyncio.create_task(submit(2, 'x')) for _ in range(3)]
+        await settle()
+        tasks.append(asyncio.create_task(submit(3, 'y')))
+        await settle()
+        assert order == []
+        admission.finish('first')
+        await settle()
+        admission.finish('task-2')
+        await settle()
+        # Пользователь 3 проходит вторым, а не после всех файлов пользователя 2
+        assert order == [2, 3]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
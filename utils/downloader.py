@@ -0,0 +1,603 @@
+"""
+Потоковое скачивание файлов из Telegram с подсчетом SHA-256
+
+Во время скачивания проверяются размер и начало файла: заведомо
+некорректный файл отклоняется, не дожидаясь конца скачивания.
+"""
+import asyncio
+import errno
+import hashlib
+import logging
+import os
+import sys
+import time
+from typing import Any, BinaryIO, Callable, Dict, Optional, Set, Tuple
+import aiohttp
+from telegram import File
+from config import (
+    DOWNLOAD_CHUNK_SIZE,
+    LOCAL_FILE_INGEST,
+    RANGED_DOWNLOAD_THRESHOLD,
+    DOWNLOAD_MAX_SEGMENTS,
+    DOWNLOAD_SEGMENT_SIZE
+)
+from utils.image_header import HEADER_PROBE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Проверка начала файла: получает первые байты и выбрасывает исключение, если файл некорректен
+PrefixProbe = Callable[[bytes], None]
+
+
+# Параллельное скачивание частями: границы размера части, время скачивания одной
+# части, к которому подстраивается ее размер, и число попыток на часть
+MIN_SEGMENT_SIZE = 1024 * 1024
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_TARGET_SECONDS = 2.0
+SEGMENT_RETRIES = 3
+# Сколько частей скачивается одновременно в начале; дальше число растет, пока растет скорость
+INITIAL_SEGMENT_WORKERS = 2
+
+# Для записи частей по смещению нужны os.pwrite/os.pread (нет в Windows)
+RANGED_DOWNLOAD_SUPPORTED = hasattr(os, 'pwrite') and hasattr(os, 'pread')
+
+
+class DownloadRejected(Exception):
+    """Скачивание прервано: файл слишком большой или некорректен"""
+
+
+class DownloadError(IOError):
+    """Ошибка скачивания по HTTP; в сообщении нет URL файла (в нем токен бота)"""
+
+
+def _check_status(response: aiohttp.ClientResponse) -> None:
+    """raise_for_status без URL в сообщении: ClientResponseError выводит URL с токеном бота"""
+    if response.status >= 400:
+        raise DownloadError(f"HTTP {response.status} {response.reason or ''}".rstrip())
+
+
+def _redact(error: BaseException, url: str) -> str:
+    """Текст исключения для лога, в котором URL файла заменен заглушкой"""
+    return str(error).replace(url, '<file url>')
+
+
+def _parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Разбирает 'bytes START-END/TOTAL', возвращает (START, TOTAL); TOTAL может быть неизвестен"""
+    if not value or not value.startswith('bytes '):
+        return None, None
+    try:
+        span, total = value[6:].split('/', 1)
+        start = int(span.split('-', 1)[0])
+        return start, (None if total == '*' else int(total))
+    except ValueError:
+        return None, None
+
+
+def _write_chunk(f: BinaryIO, hasher: Any, chunk: bytes) -> None:
+    """Записывает часть файла и обновляет хэш (выполняется в пуле потоков)"""
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+def _pwrite_all(fd: int, chunk: bytes, offset: int) -> None:
+    view = memoryview(chunk)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _hash_range(fd: int, hasher: Any, start: int, end: int, chunk_size: int) -> None:
+    """Дописывает в хэш байты файла [start, end) (выполняется в пуле потоков)"""
+    while start < end:
+        chunk = os.pread(fd, min(chunk_size, end - start), start)
+        if not chunk:
+            raise IOError(f"Unexpected end of file at {start}")
+        hasher.update(chunk)
+        start += len(chunk)
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """Резервирует место под файл целиком, чтобы части писались без фрагментации"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def _read_prefix(path: str, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+# ioctl FICLONE (Linux): копия файла, разделяющая блоки с оригиналом (btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str) -> None:
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdest.close()
+            os.remove(dest)
+            raise
+
+
+def _copy_and_hash(src: str, dest: str, hasher: Any, chunk_size: int) -> int:
+    """Копирует файл, считая хэш за тот же проход, возвращает размер"""
+    size = 0
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        while True:
+            chunk = fsrc.read(chunk_size)
+            if not chunk:
+                break
+            fdest.write(chunk)
+            hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _ingest_local(src: str, dest: str, mode: str) -> str:
+    """
+    Переносит файл локального сервера Bot API в dest без копирования данных
+
+    Returns:
+        Способ переноса: 'move', 'link', 'reflink' или '' (нужно копирование,
+        например, если файлы на разных файловых системах)
+    """
+    if os.path.exists(dest):
+        os.remove(dest)
+    if mode == 'move':
+        try:
+            os.rename(src, dest)
+            return 'move'
+        except OSError:
+            return ''
+    try:
+        os.link(src, dest)
+        return 'link'
+    except OSError:
+        # Жесткие ссылки могут быть запрещены (fs.protected_hardlinks, чужой владелец файла)
+        pass
+    try:
+        _reflink(src, dest)
+        return 'reflink'
+    except OSError:
+        return ''
+
+
+def _hash_file(path: str, hasher: Any, chunk_size: int) -> int:
+    """Считает хэш файла на диске, возвращает его размер (выполняется в пуле потоков)"""
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+class DownloadResult:
+    """Результат скачивания: размер, SHA-256 содержимого и затраченное время"""
+
+    __slots__ = ('path', 'size', 'sha256', 'elapsed', 'segments')
+
+    def __init__(self, path: str, size: int, sha256: str, elapsed: float, segments: int = 1):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.elapsed = elapsed
+        # Число частей, скачанных отдельными запросами Range (1 - один поток)
+        self.segments = segments
+
+    @property
+    def throughput(self) -> float:
+        """Скорость скачивания в байтах в секунду"""
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+
+class _RangedDownload:
+    """
+    Докачивает файл частями параллельными запросами Range
+
+    Части берутся из общей очереди смещений и пишутся в заранее выделенный
+    файл по своему смещению. Размер следующей части подстраивается под
+    скорость (часть скачивается примерно SEGMENT_TARGET_SECONDS), а число
+    одновременных запросов растет, пока это увеличивает общую скорость.
+    SHA-256 считается по порядку, как только готов непрерывный участок от
+    начала файла: данные еще в кэше страниц, повторного чтения с диска нет.
+    """
+
+    def __init__(
+        self,
+        downloader: 'TelegramFileDownloader',
+        session: aiohttp.ClientSession,
+        url: str,
+        fd: int,
+        hasher: Any,
+        start: int,
+        total: int
+    ):
+        self.downloader = downloader
+        self.session = session
+        self.url = url
+        self.fd = fd
+        self.hasher = hasher
+        self.total = total
+        self.next_offset = start
+        self.hash_pos = start
+        # Скачанные, но еще не учтенные в хэше части: начало -> конец
+        self.done: Dict[int, int] = {}
+        self.hash_lock = asyncio.Lock()
+        self.segment_size = downloader.segment_size
+        self.workers: Set[asyncio.Task] = set()
+        self.segments = 0
+        self.growing = True
+        self.best_throughput = 0.0
+        self.window_started_at = time.monotonic()
+        self.window_bytes = 0
+
+    def _spawn(self) -> None:
+        self.workers.add(asyncio.create_task(self._worker()))
+
+    async def run(self) -> int:
+        """Скачивает оставшуюся часть файла, возвращает число частей"""
+        for _ in range(min(INITIAL_SEGMENT_WORKERS, self.downloader.max_segments)):
+            self._spawn()
+        try:
+            while self.workers:
+                done, _ = await asyncio.wait(self.workers, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    self.workers.discard(task)
+                    task.result()
+        except BaseException:
+            for task in self.workers:
+                task.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            raise
+        await self._advance_hash()
+        if self.hash_pos != self.total:
+            raise IOError(f"Ranged download is incomplete: {self.hash_pos} of {self.total} bytes")
+        return self.segments
+
+    async def _worker(self) -> None:
+        while self.next_offset < self.total:
+            start = self.next_offset
+            end = min(start + self.segment_size, self.total)
+            self.next_offset = end
+            started_at = time.monotonic()
+            await self._fetch(start, end)
+            self.segments += 1
+            self._adapt(end - start, time.monotonic() - started_at)
+            self.done[start] = end
+            await self._advance_hash()
+
+    async def _fetch(self, start: int, end: int) -> None:
+        loop = asyncio.get_running_loop()
+        chunk_size = self.downloader.chunk_size
+        for attempt in range(SEGMENT_RETRIES):
+            try:
+                headers = {'Range': f"bytes={start}-{end - 1}"}
+                async with self.session.get(self.url, headers=headers) as response:
+                    _check_status(response)
+                    range_start, _ = _parse_content_range(response.headers.get('Content-Range'))
+                    if response.status != 206 or range_start != start:
+                        raise IOError(f"Server ignored range {start}-{end - 1}")
+                    pos = start
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        if pos + len(chunk) > end:
+                            raise IOError(f"Server sent more than range {start}-{end - 1}")
+                        await loop.run_in_executor(None, _pwrite_all, self.fd, chunk, pos)
+                        pos += len(chunk)
+                    if pos != end:
+                        raise IOError(f"Range {start}-{end - 1} ended at {pos}")
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                if attempt + 1 >= SEGMENT_RETRIES:
+                    raise
+                logger.warning(f"Range {start}-{end - 1} failed ({_redact(e, self.url)}), retrying")
+                await asyncio.sleep(2 ** attempt)
+
+    def _adapt(self, segment_bytes: int, elapsed: float) -> None:
+        """Подстраивает размер части и число одновременных запросов под наблюдаемую скорость"""
+        chunk_size = self.downloader.chunk_size
+        if elapsed > 0:
+            target = int(segment_bytes / elapsed * SEGMENT_TARGET_SECONDS)
+            target = max(MIN_SEGMENT_SIZE, min(MAX_SEGMENT_SIZE, target))
+            self.segment_size = max(chunk_size, target // chunk_size * chunk_size)
+
+        self.window_bytes += segment_bytes
+        # Оцениваем общую скорость, когда каждый запрос успел скачать примерно по части
+        if not self.growing or self.window_bytes < len(self.workers) * self.segment_size:
+            return
+        window = time.monotonic() - self.window_started_at
+        throughput = self.window_bytes / window if window > 0 else 0.0
+        if throughput > self.best_throughput * 1.1 and len(self.workers) < self.downloader.max_segments:
+            self.best_throughput = throughput
+            self._spawn()
+        else:
+            # Новый запрос не ускорил скачивание: канал или сервер уже загружены
+            self.growing = False
+        self.window_started_at = time.monotonic()
+        self.window_bytes = 0
+
+    async def _advance_hash(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self.hash_lock:
+            while self.hash_pos in self.done:
+                end = self.done.pop(self.hash_pos)
+                await loop.run_in_executor(
+                    None, _hash_range, self.fd, self.hasher, self.hash_pos, end, self.downloader.chunk_size
+                )
+                self.hash_pos = end
+
+
+class TelegramFileDownloader:
+    """
+    Скачивает файлы Telegram потоково, считая SHA-256 по ходу скачивания
+
+    Запись на диск и хэширование выполняются в пуле потоков, поэтому
+    скачивание большого файла не блокирует цикл событий, а хэш готов
+    сразу после скачивания без повторного чтения файла.
+
+    Большие файлы скачиваются частями параллельными запросами Range, если
+    сервер их поддерживает, иначе одним потоком.
+
+    Файлы локального сервера Bot API (режим --local) не скачиваются по HTTP,
+    а переносятся в рабочий каталог жесткой ссылкой, reflink или перемещением;
+    копирование остается только для другой файловой системы.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        local_ingest: str = LOCAL_FILE_INGEST,
+        ranged_threshold: int = RANGED_DOWNLOAD_THRESHOLD,
+        max_segments: int = DOWNLOAD_MAX_SEGMENTS,
+        segment_size: int = DOWNLOAD_SEGMENT_SIZE
+    ):
+        self.chunk_size = chunk_size
+        # Файлы от ranged_threshold байт скачиваются частями, не больше max_segments одновременно
+        self.ranged_threshold = ranged_threshold
+        self.max_segments = max_segments
+        self.segment_size = segment_size
+        self.ranged_downloads = 0
+        # 'link' - жесткая ссылка или reflink, 'move' - перемещение файла сервера Bot API
+        self.local_ingest = local_ingest
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self.rejected = 0
+        self.rejected_bytes = 0
+        # Сколько файлов локального сервера Bot API перенесено каждым способом
+        self.local_ingests = {'move': 0, 'link': 0, 'reflink': 0, 'copy': 0}
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            # Скачивание 2000 МБ может идти долго, ограничиваем только ожидание данных
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+            )
+        return self.session
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'downloads': self.downloads,
+            'downloaded_bytes': self.downloaded_bytes,
+            'download_throughput': self.downloaded_bytes / self.download_seconds if self.download_seconds else 0.0,
+            'ranged_downloads': self.ranged_downloads,
+            'rejected': self.rejected,
+            'rejected_bytes': self.rejected_bytes,
+            'local_ingests': dict(self.local_ingests)
+        }
+
+    def _reject(self, reason: str, received: int) -> DownloadRejected:
+        self.rejected += 1
+        self.rejected_bytes += received
+        logger.info(f"Download aborted after {received} bytes: {reason}")
+        return DownloadRejected(reason)
+
+    def _probe(self, probe: Optional[PrefixProbe], prefix: bytes, received: int) -> None:
+        if probe is None:
+            return
+        try:
+            probe(prefix)
+        except ValueError as e:
+            raise self._reject(f"Файл поврежден или имеет некорректный формат: {e}", received)
+
+    def _check_size(self, size: int, max_size: Optional[int], received: int) -> None:
+        if max_size is not None and size > max_size:
+            raise self._reject(
+                f"Файл слишком большой. Максимальный размер: {max_size / (1024 * 1024):.0f} МБ",
+                received
+            )
+
+    async def _read_stream(
+        self,
+        response: aiohttp.ClientResponse,
+        f: BinaryIO,
+        hasher: Any,
+        received: int,
+        max_size: Optional[int],
+        probe: Optional[PrefixProbe]
+    ) -> int:
+        """Дописывает тело ответа в f по порядку, возвращает общее число полученных байт"""
+        loop = asyncio.get_running_loop()
+        # Начало файла копится, пока его не хватит для проверки заголовка
+        prefix = bytearray() if probe is not None and received == 0 else None
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            received += len(chunk)
+            self._check_size(received, max_size, received)
+            if prefix is not None:
+                prefix += chunk[:HEADER_PROBE_SIZE - len(prefix)]
+                if len(prefix) >= HEADER_PROBE_SIZE:
+                    self._probe(probe, bytes(prefix), received)
+                    prefix = None
+            await loop.run_in_executor(None, _write_chunk, f, hasher, chunk)
+        if prefix is not None:
+            # Файл короче HEADER_PROBE_SIZE
+            self._probe(probe, bytes(prefix), received)
+        return received
+
+    async def _download_http(
+        self,
+        url: str,
+        dest_path: str,
+        hasher: Any,
+        expected_size: Optional[int],
+        max_size: Optional[int],
+        probe: Optional[PrefixProbe]
+    ) -> Tuple[int, int]:
+        """
+        Скачивает файл по HTTP: большие файлы частями, остальные одним потоком
+
+        Первый запрос большого файла запрашивает только первую часть. Если сервер
+        ответил 206, из Content-Range известен полный размер, и остальное
+        докачивается параллельно; если ответил 200, этот же ответ дочитывается
+        одним потоком.
+
+        Returns:
+            (размер файла, число частей)
+        """
+        loop = asyncio.get_running_loop()
+        session = await self._get_session()
+        ranged = (
+            RANGED_DOWNLOAD_SUPPORTED
+            and self.max_segments > 1
+            and expected_size is not None
+            and expected_size >= self.ranged_threshold
+        )
+        headers = {'Range': f"bytes=0-{self.segment_size - 1}"} if ranged else None
+        segments = 1
+        # Файл открыт и на чтение: хэш частей считается по уже записанным данным
+        f = await loop.run_in_executor(None, open, dest_path, 'w+b')
+        try:
+            async with session.get(url, headers=headers) as response:
+                _check_status(response)
+                total = None
+                if response.status == 206:
+                    _, total = _parse_content_range(response.headers.get('Content-Range'))
+                    if total is not None:
+                        self._check_size(total, max_size, 0)
+                elif response.content_length is not None:
+                    self._check_size(response.content_length, max_size, 0)
+                size = await self._read_stream(response, f, hasher, 0, max_size, probe)
+                partial = response.status == 206
+
+            if partial and total is None:
+                # Полный размер неизвестен: дочитываем остаток одним потоком
+                async with session.get(url, headers={'Range': f"bytes={size}-"}) as response:
+                    _check_status(response)
+                    if response.status != 206:
+                        raise IOError("Server ignored open-ended range request")
+                    size = await self._read_stream(response, f, hasher, size, max_size, probe)
+            elif partial and size < total:
+                await loop.run_in_executor(None, f.flush)
+                await loop.run_in_executor(None, _preallocate, f.fileno(), total)
+                ranged_download = _RangedDownload(self, session, url, f.fileno(), hasher, size, total)
+                segments += await ranged_download.run()
+                self.ranged_downloads += 1
+                size = total
+
+            if total is not None:
+                actual_size = os.fstat(f.fileno()).st_size
+                if actual_size != total:
+                    raise IOError(f"Downloaded file size {actual_size} does not match {total}")
+        except BaseException:
+            f.close()
+            try:
+                os.remove(dest_path)
+            except OSError:
+                pass
+            raise
+        await loop.run_in_executor(None, f.close)
+        return size, segments
+
+    async def download(
+        self,
+        file_obj: File,
+        dest_path: str,
+        max_size: Optional[int] = None,
+        probe: Optional[PrefixProbe] = None
+    ) -> DownloadResult:
+        """
+        Скачивает файл Telegram в dest_path
+
+        Args:
+            file_obj: Файл, полученный через bot.get_file
+            dest_path: Куда сохранить файл
+            max_size: Максимальный размер файла; проверяется по ходу скачивания,
+                а не по заявленному размеру
+            probe: Проверка первых HEADER_PROBE_SIZE байт файла (см. check_image_prefix),
+                ValueError из нее прерывает скачивание
+
+        Returns:
+            DownloadResult: размер и SHA-256 скачанного файла
+
+        Raises:
+            DownloadRejected: файл превысил max_size или не прошел probe
+            DownloadError: сервер вернул ошибку или соединение оборвалось
+        """
+        loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        hasher = hashlib.sha256()
+        size = 0
+        segments = 1
+        url = file_obj.file_path or ''
+
+        if url.startswith(('http://', 'https://')):
+            try:
+                size, segments = await self._download_http(
+                    url, dest_path, hasher, getattr(file_obj, 'file_size', None), max_size, probe
+                )
+            except aiohttp.ClientError as e:
+                # Исключения aiohttp (и цепочка причин в traceback) содержат URL с токеном бота
+                raise DownloadError(f"{type(e).__name__}: {_redact(e, url)}") from None
+        elif os.path.isabs(url) and os.path.exists(url):
+            # Локальный сервер Bot API (--local) отдает путь к файлу на диске:
+            # размер и заголовок проверяются до переноса
+            self._check_size(os.path.getsize(url), max_size, 0)
+            if probe is not None:
+                self._probe(probe, await loop.run_in_executor(None, _read_prefix, url, HEADER_PROBE_SIZE), 0)
+            method = await loop.run_in_executor(None, _ingest_local, url, dest_path, self.local_ingest)
+            if method:
+                size = await loop.run_in_executor(None, _hash_file, dest_path, hasher, self.chunk_size)
+            else:
+                # Другая файловая система: копируем, считая хэш за тот же проход
+                method = 'copy'
+                size = await loop.run_in_executor(None, _copy_and_hash, url, dest_path, hasher, self.chunk_size)
+            self.local_ingests[method] += 1
+            logger.info(f"Ingested local Bot API file {url} via {method}")
+        else:
+            await file_obj.download_to_drive(dest_path)
+            size = await loop.run_in_executor(None, _hash_file, dest_path, hasher, self.chunk_size)
+
+        elapsed = time.monotonic() - started_at
+        self.downloads += 1
+        self.downloaded_bytes += size
+        self.download_seconds += elapsed
+        logger.info(
+            f"Downloaded {size / (1024 * 1024):.1f} MB in {elapsed:.1f}s "
+            f"({size / max(elapsed, 1e-9) / (1024 * 1024):.1f} MB/s, segments: {segments})"
+        )
+        return DownloadResult(dest_path, size, hasher.hexdigest(), elapsed, segments)
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+
+def get_shared_downloader(bot_data: Dict[str, Any]) -> TelegramFileDownloader:
+    """Возвращает общий загрузчик файлов приложения из bot_data"""
+    downloader = bot_data.get('file_downloader')
+    if downloader is None:
+        downloader = TelegramFileDownloader()
+        bot_data['file_downloader'] = downloader
+    return downloader
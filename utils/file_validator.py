@@ -4,45 +4,65 @@
 import os
 from typing import Tuple, Optional
 from config import SUPPORTED_FILE_FORMATS, MAX_FILE_SIZE
+from utils.image_header import ImageHeaderError, ImageMetadata, read_image_header
 
 
-def validate_file(file_path: str, file_size: int) -> Tuple[bool, Optional[str]]:
+def check_file_name(file_name: str) -> Optional[str]:
     """
-    Проверяет корректность загруженного файла
-    
+    Проверяет расширение файла (до скачивания)
+
+    Returns:
+        Optional[str]: сообщение об ошибке или None, если формат поддерживается
+    """
+    file_ext = os.path.splitext(file_name)[1].lower()
+    if file_ext not in SUPPORTED_FILE_FORMATS:
+        return f"Неподдерживаемый формат файла. Поддерживаемые форматы: {', '.join(SUPPORTED_FILE_FORMATS)}"
+    return None
+
+
+def inspect_file(file_path: str, file_size: int) -> Tuple[Optional[ImageMetadata], Optional[str]]:
+    """
+    Проверяет корректность загруженного файла и читает сведения об изображении
+
     Args:
         file_path: Путь к файлу
         file_size: Размер файла в байтах
-        
+
     Returns:
-        Tuple[bool, Optional[str]]: (валиден ли файл, сообщение об ошибке если есть)
+        Tuple[Optional[ImageMetadata], Optional[str]]: (сведения об изображении или None, сообщение об ошибке если есть)
     """
     # Проверка размера файла
     if file_size > MAX_FILE_SIZE:
-        return False, f"Файл слишком большой. Максимальный размер: {MAX_FILE_SIZE / (1024*1024):.0f} МБ"
-    
+        return None, f"Файл слишком большой. Максимальный размер: {MAX_FILE_SIZE / (1024*1024):.0f} МБ"
+
     # Проверка расширения файла
-    file_ext = os.path.splitext(file_path)[1].lower()
-    if file_ext not in SUPPORTED_FILE_FORMATS:
-        return False, f"Неподдерживаемый формат файла. Поддерживаемые форматы: {', '.join(SUPPORTED_FILE_FORMATS)}"
-    
+    error = check_file_name(file_path)
+    if error:
+        return None, error
+
     # Проверка существования файла
     if not os.path.exists(file_path):
-        return False, "Файл не найден"
-    
-    # Дополнительная проверка целостности (базовая)
+        return None, "Файл не найден"
+
+    # Проверка целостности по заголовкам (без декодирования изображения)
     try:
-        # Для изображений можно проверить через Pillow
-        if file_ext in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
-            from PIL import Image
-            try:
-                img = Image.open(file_path)
-                img.verify()
-            except Exception as e:
-                return False, f"Файл поврежден или имеет некорректный формат: {str(e)}"
-    except ImportError:
-        # Если Pillow не установлен, пропускаем проверку
-        pass
-    
-    return True, None
+        return read_image_header(file_path), None
+    except ImageHeaderError as e:
+        return None, f"Файл поврежден или имеет некорректный формат: {e}"
+    except OSError as e:
+        return None, f"Не удалось прочитать файл: {e}"
+
+
+def validate_file(file_path: str, file_size: int) -> Tuple[bool, Optional[str]]:
+    """
+    Проверяет корректность загруженного файла
 
+    Args:
+        file_path: Путь к файлу
+        file_size: Размер файла в байтах
+
+    Returns:
+        Tuple[bool, Optional[str]]: (валиден ли файл, сообщение об ошибке если есть)
+    """
+    metadata, error = inspect_file(file_path, file_size)
+    return metadata is not None, error
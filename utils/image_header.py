@@ -0,0 +1,430 @@
+"""
+Быстрый разбор заголовков TIFF/BigTIFF/GeoTIFF, PNG и JPEG
+
+Файл отображается в память (mmap), и читаются только заголовки: цепочка IFD,
+смещения полос и тайлов, каталог GeoKey. Данные изображения не декодируются,
+поэтому проверка файла в 2000 МБ занимает доли миллисекунды, а обрезанный
+файл (полосы или тайлы за концом файла) обнаруживается без чтения данных.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class ImageHeaderError(ValueError):
+    """Файл поврежден, обрезан или не является поддерживаемым изображением"""
+
+
+class ImageMetadata:
+    """Сведения об изображении, прочитанные из заголовка"""
+
+    __slots__ = (
+        'format', 'width', 'height', 'bands', 'bit_depth', 'compression',
+        'crs', 'tiled', 'tile_size', 'pages', 'bigtiff'
+    )
+
+    def __init__(
+        self,
+        format: str,
+        width: int,
+        height: int,
+        bands: int,
+        bit_depth: int,
+        compression: Optional[int] = None,
+        crs: Optional[str] = None,
+        tiled: bool = False,
+        tile_size: Optional[Tuple[int, int]] = None,
+        pages: int = 1,
+        bigtiff: bool = False
+    ):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.bands = bands
+        self.bit_depth = bit_depth
+        self.compression = compression
+        self.crs = crs
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.pages = pages
+        self.bigtiff = bigtiff
+
+    def to_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def describe(self) -> str:
+        """Краткое описание для пользователя"""
+        parts = [f"{self.width}×{self.height}", f"каналов: {self.bands}", f"{self.bit_depth} бит"]
+        if self.crs:
+            parts.append(self.crs)
+        if self.tiled and self.tile_size:
+            parts.append(f"тайлы {self.tile_size[0]}×{self.tile_size[1]}")
+        return f"{self.format}, " + ", ".join(parts)
+
+    def __repr__(self) -> str:
+        return f"ImageMetadata({self.to_dict()})"
+
+
+# Теги TIFF
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_GEO_KEY_DIRECTORY = 34735
+
+# Ключи GeoTIFF, задающие систему координат
+GEOKEY_GEOGRAPHIC_TYPE = 2048
+GEOKEY_PROJECTED_CS_TYPE = 3072
+GEOKEY_USER_DEFINED = 32767
+
+# Тип поля TIFF -> (размер элемента, код array)
+TIFF_TYPES = {
+    1: (1, 'B'), 2: (1, 'B'), 3: (2, 'H'), 4: (4, 'I'), 5: (8, 'I'),
+    6: (1, 'b'), 7: (1, 'B'), 8: (2, 'h'), 9: (4, 'i'), 10: (8, 'i'),
+    11: (4, 'f'), 12: (8, 'd'), 13: (4, 'I'), 16: (8, 'Q'), 17: (8, 'q'), 18: (8, 'Q')
+}
+# Типы RATIONAL состоят из двух чисел
+RATIONAL_TYPES = (5, 10)
+
+# Защита от зацикленных и заведомо испорченных цепочек IFD
+MAX_IFD_COUNT = 4096
+MAX_IFD_ENTRIES = 4096
+
+# Сколько байт начала файла проверяется во время скачивания
+HEADER_PROBE_SIZE = 64 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+# Число каналов PNG по типу цвета
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+class _TiffReader:
+    """Разбор цепочки IFD классического TIFF и BigTIFF"""
+
+    def __init__(self, data: Union[mmap.mmap, bytes], size: int, complete: bool = True):
+        self.data = data
+        self.size = size
+        # False - доступно только начало файла, значения тегов за его пределами не проверяются
+        self.complete = complete
+        self.order = '<' if data[:2] == b'II' else '>'
+        version = self._unpack('H', 2)[0]
+        if version == 42:
+            self.bigtiff = False
+            self.first_ifd = self._unpack('I', 4)[0]
+        elif version == 43:
+            self.bigtiff = True
+            if size < 16:
+                raise ImageHeaderError("обрезанный заголовок BigTIFF")
+            byte_size, _ = self._unpack('HH', 4)
+            if byte_size != 8:
+                raise ImageHeaderError("некорректный заголовок BigTIFF")
+            self.first_ifd = self._unpack('Q', 8)[0]
+        else:
+            raise ImageHeaderError("неизвестная версия TIFF")
+
+    def _unpack(self, fmt: str, offset: int) -> tuple:
+        fmt = self.order + fmt
+        if offset + struct.calcsize(fmt) > self.size:
+            raise ImageHeaderError("заголовок TIFF выходит за конец файла")
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def read_ifd(self, offset: int) -> Tuple[Dict[int, Tuple[int, int, int]], int]:
+        """
+        Читает IFD по смещению
+
+        Returns:
+            (тег -> (тип, число значений, смещение значений), смещение следующего IFD)
+        """
+        if self.bigtiff:
+            count_fmt, entry_fmt, entry_size, inline_size, next_fmt = 'Q', 'HHQ', 20, 8, 'Q'
+        else:
+            count_fmt, entry_fmt, entry_size, inline_size, next_fmt = 'H', 'HHI', 12, 4, 'I'
+        count_size = struct.calcsize(count_fmt)
+        entry_count = self._unpack(count_fmt, offset)[0]
+        if entry_count == 0 or entry_count > MAX_IFD_ENTRIES:
+            raise ImageHeaderError(f"некорректное число тегов в IFD: {entry_count}")
+        entries_start = offset + count_size
+        next_offset = self._unpack(next_fmt, entries_start + entry_count * entry_size)[0]
+
+        tags = {}
+        for i in range(entry_count):
+            entry_offset = entries_start + i * entry_size
+            tag, field_type, count = self._unpack(entry_fmt, entry_offset)
+            type_info = TIFF_TYPES.get(field_type)
+            if type_info is None:
+                # Неизвестные типы по спецификации пропускаются
+                continue
+            value_offset = entry_offset + entry_size - inline_size
+            if type_info[0] * count > inline_size:
+                value_offset = self._unpack(next_fmt, value_offset)[0]
+                if self.complete and value_offset + type_info[0] * count > self.size:
+                    raise ImageHeaderError(f"значение тега {tag} выходит за конец файла")
+            tags[tag] = (field_type, count, value_offset)
+        return tags, next_offset
+
+    def values(self, tags: Dict[int, Tuple[int, int, int]], tag: int) -> List:
+        """Возвращает значения тега (пустой список, если тега нет)"""
+        entry = tags.get(tag)
+        if entry is None:
+            return []
+        field_type, count, offset = entry
+        item_size, typecode = TIFF_TYPES[field_type]
+        if field_type in RATIONAL_TYPES:
+            count *= 2
+            item_size //= 2
+        values = array(typecode)
+        values.frombytes(self.data[offset:offset + item_size * count])
+        if (self.order == '<') != (sys.byteorder == 'little'):
+            values.byteswap()
+        return values.tolist()
+
+    def value(self, tags: Dict[int, Tuple[int, int, int]], tag: int, default: Optional[int] = None) -> Optional[int]:
+        values = self.values(tags, tag)
+        return values[0] if values else default
+
+
+def _check_blocks(reader: _TiffReader, tags: Dict[int, Tuple[int, int, int]], page: int) -> None:
+    """Проверяет, что все полосы или тайлы IFD лежат внутри файла"""
+    if TAG_TILE_OFFSETS in tags:
+        offsets = reader.values(tags, TAG_TILE_OFFSETS)
+        counts = reader.values(tags, TAG_TILE_BYTE_COUNTS)
+        kind = "тайл"
+    else:
+        offsets = reader.values(tags, TAG_STRIP_OFFSETS)
+        counts = reader.values(tags, TAG_STRIP_BYTE_COUNTS)
+        kind = "полоса"
+    if not offsets:
+        raise ImageHeaderError(f"в изображении {page} нет смещений данных")
+    if len(counts) != len(offsets):
+        raise ImageHeaderError(f"в изображении {page} число размеров блоков не совпадает с числом смещений")
+    end = max(map(sum, zip(offsets, counts)))
+    if end > reader.size:
+        raise ImageHeaderError(
+            f"файл обрезан: {kind} изображения {page} заканчивается на байте {end}, "
+            f"а размер файла {reader.size}"
+        )
+
+
+def _read_crs(reader: _TiffReader, tags: Dict[int, Tuple[int, int, int]]) -> Optional[str]:
+    """Извлекает код EPSG из каталога GeoKey (None, если его нет или СК задана вручную)"""
+    directory = reader.values(tags, TAG_GEO_KEY_DIRECTORY)
+    if len(directory) < 4:
+        return None
+    key_count = directory[3]
+    if len(directory) < 4 + key_count * 4:
+        raise ImageHeaderError("каталог GeoKey обрезан")
+    keys = {}
+    for i in range(key_count):
+        key_id, location, _, value = directory[4 + i * 4:8 + i * 4]
+        # Значение хранится прямо в каталоге, если location == 0
+        if location == 0:
+            keys[key_id] = value
+    for key_id in (GEOKEY_PROJECTED_CS_TYPE, GEOKEY_GEOGRAPHIC_TYPE):
+        code = keys.get(key_id)
+        if code and code != GEOKEY_USER_DEFINED:
+            return f"EPSG:{code}"
+    return "user-defined" if keys else None
+
+
+def _parse_tiff(data: mmap.mmap, size: int) -> ImageMetadata:
+    reader = _TiffReader(data, size)
+    offset = reader.first_ifd
+    seen = set()
+    metadata = None
+    page = 0
+    while offset:
+        if offset in seen or len(seen) >= MAX_IFD_COUNT:
+            raise ImageHeaderError("цепочка IFD зациклена")
+        seen.add(offset)
+        tags, next_offset = reader.read_ifd(offset)
+        _check_blocks(reader, tags, page)
+        if metadata is None:
+            width = reader.value(tags, TAG_IMAGE_WIDTH)
+            height = reader.value(tags, TAG_IMAGE_LENGTH)
+            if not width or not height:
+                raise ImageHeaderError("не указаны размеры изображения")
+            tiled = TAG_TILE_OFFSETS in tags
+            metadata = ImageMetadata(
+                format='BigTIFF' if reader.bigtiff else 'TIFF',
+                width=width,
+                height=height,
+                bands=reader.value(tags, TAG_SAMPLES_PER_PIXEL, 1),
+                bit_depth=reader.value(tags, TAG_BITS_PER_SAMPLE, 1),
+                compression=reader.value(tags, TAG_COMPRESSION, 1),
+                crs=_read_crs(reader, tags),
+                tiled=tiled,
+                tile_size=(
+                    (reader.value(tags, TAG_TILE_WIDTH, 0), reader.value(tags, TAG_TILE_LENGTH, 0))
+                    if tiled else None
+                ),
+                bigtiff=reader.bigtiff
+            )
+        page += 1
+        offset = next_offset
+    if metadata is None:
+        raise ImageHeaderError("в файле TIFF нет изображений")
+    metadata.pages = page
+    return metadata
+
+
+def _parse_tiff_prefix(data: bytes, size: int) -> None:
+    """Проверяет заголовок TIFF и первый IFD, если он попал в начало файла"""
+    reader = _TiffReader(data, size, complete=False)
+    header_size = 16 if reader.bigtiff else 8
+    if reader.first_ifd < header_size:
+        raise ImageHeaderError("некорректное смещение первого IFD")
+    count_size = 8 if reader.bigtiff else 2
+    entry_size = 20 if reader.bigtiff else 12
+    if reader.first_ifd + count_size > size:
+        # IFD записан в конце файла (так пишут многие библиотеки): проверим после скачивания
+        return
+    entry_count = reader._unpack('Q' if reader.bigtiff else 'H', reader.first_ifd)[0]
+    if entry_count == 0 or entry_count > MAX_IFD_ENTRIES:
+        raise ImageHeaderError(f"некорректное число тегов в IFD: {entry_count}")
+    if reader.first_ifd + count_size + entry_count * entry_size + count_size > size:
+        return
+    tags, _ = reader.read_ifd(reader.first_ifd)
+    if TAG_IMAGE_WIDTH not in tags or TAG_IMAGE_LENGTH not in tags:
+        raise ImageHeaderError("не указаны размеры изображения")
+    if not reader.value(tags, TAG_IMAGE_WIDTH) or not reader.value(tags, TAG_IMAGE_LENGTH):
+        raise ImageHeaderError("не указаны размеры изображения")
+    if TAG_STRIP_OFFSETS not in tags and TAG_TILE_OFFSETS not in tags:
+        raise ImageHeaderError("в изображении 0 нет смещений данных")
+
+
+def _parse_png_header(data: Union[mmap.mmap, bytes], size: int) -> ImageMetadata:
+    if size < 33 or data[12:16] != b'IHDR':
+        raise ImageHeaderError("нет заголовка IHDR")
+    width, height, bit_depth, color_type = struct.unpack_from('>IIBB', data, 16)
+    if color_type not in PNG_CHANNELS:
+        raise ImageHeaderError(f"неизвестный тип цвета PNG: {color_type}")
+    return ImageMetadata('PNG', width, height, PNG_CHANNELS[color_type], bit_depth)
+
+
+def _parse_png(data: mmap.mmap, size: int) -> ImageMetadata:
+    metadata = _parse_png_header(data, size)
+    # Обрезанный PNG не заканчивается блоком IEND
+    if data[size - len(PNG_IEND):size] != PNG_IEND:
+        raise ImageHeaderError("файл обрезан: нет завершающего блока IEND")
+    return metadata
+
+
+def _parse_jpeg_frame(data: Union[mmap.mmap, bytes], size: int) -> Optional[ImageMetadata]:
+    """Ищет заголовок кадра (SOF) среди первых size байт, None - если не дошли до него"""
+    offset = 2
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            raise ImageHeaderError("некорректный маркер JPEG")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Заполнитель между маркерами
+            offset += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            offset += 2
+            continue
+        length = struct.unpack_from('>H', data, offset + 2)[0]
+        # SOF0-SOF15, кроме DHT (C4), JPG (C8) и DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if offset + 10 > size:
+                return None
+            bit_depth, height, width, bands = struct.unpack_from('>BHHB', data, offset + 4)
+            return ImageMetadata('JPEG', width, height, bands, bit_depth)
+        if marker == 0xDA:
+            raise ImageHeaderError("не найден заголовок кадра JPEG")
+        offset += 2 + length
+    return None
+
+
+def _parse_jpeg(data: mmap.mmap, size: int) -> ImageMetadata:
+    metadata = _parse_jpeg_frame(data, size)
+    if metadata is None:
+        raise ImageHeaderError("не найден заголовок кадра JPEG")
+    # Обрезанный JPEG не заканчивается маркером EOI (допускаем нулевое выравнивание в конце)
+    tail = data[max(0, size - 1024):size].rstrip(b'\x00')
+    if not tail.endswith(b'\xff\xd9'):
+        raise ImageHeaderError("файл обрезан: нет маркера конца изображения")
+    return metadata
+
+
+def _detect_format(magic: bytes) -> Optional[str]:
+    if magic[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return 'TIFF'
+    if magic[:8] == PNG_SIGNATURE:
+        return 'PNG'
+    if magic[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    return None
+
+
+def check_image_prefix(prefix: bytes) -> None:
+    """
+    Проверяет начало файла во время скачивания
+
+    Распознает формат по сигнатуре и проверяет заголовок TIFF (и первый IFD,
+    если он попал в prefix), IHDR у PNG и маркеры JPEG до заголовка кадра.
+    Полная проверка (read_image_header) выполняется после скачивания.
+
+    Args:
+        prefix: Первые байты файла (HEADER_PROBE_SIZE или весь файл, если он короче)
+
+    Raises:
+        ImageHeaderError: по началу файла уже видно, что он некорректен
+    """
+    size = len(prefix)
+    if size < 8:
+        raise ImageHeaderError("файл пустой или слишком короткий")
+    file_format = _detect_format(prefix)
+    try:
+        if file_format == 'TIFF':
+            _parse_tiff_prefix(prefix, size)
+        elif file_format == 'PNG':
+            _parse_png_header(prefix, size)
+        elif file_format == 'JPEG':
+            _parse_jpeg_frame(prefix, size)
+        else:
+            raise ImageHeaderError("содержимое файла не является изображением TIFF, PNG или JPEG")
+    except struct.error as e:
+        raise ImageHeaderError(f"заголовок выходит за конец файла: {e}")
+
+
+def read_image_header(file_path: str) -> ImageMetadata:
+    """
+    Проверяет структуру файла по заголовкам и возвращает сведения об изображении
+
+    Args:
+        file_path: Путь к файлу TIFF/BigTIFF/GeoTIFF, PNG или JPEG
+
+    Returns:
+        ImageMetadata: размеры, число каналов, разрядность, СК и тайлинг
+
+    Raises:
+        ImageHeaderError: файл поврежден, обрезан или формат не поддерживается
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 8:
+            raise ImageHeaderError("файл пустой или слишком короткий")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                file_format = _detect_format(data[:8])
+                if file_format == 'TIFF':
+                    return _parse_tiff(data, size)
+                if file_format == 'PNG':
+                    return _parse_png(data, size)
+                if file_format == 'JPEG':
+                    return _parse_jpeg(data, size)
+            except struct.error as e:
+                raise ImageHeaderError(f"заголовок выходит за конец файла: {e}")
+    raise ImageHeaderError("содержимое файла не является изображением TIFF, PNG или JPEG")
@@ -0,0 +1,78 @@
+"""
+Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+"""
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления разных пользователей параллельно,
+    а обновления одного пользователя - строго по очереди.
+
+    Первое обновление пользователя занимает один слот глобального лимита
+    и последовательно выполняет всю очередь этого пользователя. Последующие
+    обновления того же пользователя только добавляются в очередь и слот
+    не занимают, поэтому один активный пользователь не может вытеснить
+    остальных, а переходы context.user_data['state'] остаются согласованными.
+    """
+
+    __slots__ = ('_queues',)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._queues: Dict[Hashable, Deque[Awaitable[Any]]] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[Hashable]:
+        """Возвращает ключ, внутри которого обновления должны идти по порядку"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return ('user', update.effective_user.id)
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    @property
+    def active_keys(self) -> int:
+        """Количество пользователей, обновления которых сейчас обрабатываются"""
+        return len(self._queues)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # У пользователя уже есть обработчик очереди - просто встаем за ним
+            queue.append(coroutine)
+            return
+
+        queue = self._queues[key] = deque([coroutine])
+        try:
+            while queue:
+                next_coroutine = queue.popleft()
+                try:
+                    await next_coroutine
+                except Exception as e:
+                    logger.error(f"Error while processing update for {key}: {e}", exc_info=True)
+        finally:
+            self._queues.pop(key, None)
+            # При отмене закрываем оставшиеся корутины, чтобы не было предупреждений
+            for pending in queue:
+                close = getattr(pending, 'close', None)
+                if close:
+                    close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass